@@ -1,10 +1,25 @@
+import importlib
 import os
+import threading
+from uuid import uuid4
 import streamlit as st
 from dotenv import load_dotenv
 import configparser
 
-# Import your chain
-from graphs.graph import PostgreSQLChain
+# The chain (LangChain/LangGraph/OpenAI) and pandas are imported on first use to keep startup fast
+from utilities.config import load_config
+from utilities.job_queue import JobQueue, JobStore, QueueFullError, QUEUED, DONE, FAILED
+
+CONFIG = load_config()
+POLL_SECONDS = CONFIG.getfloat("jobs", "poll_seconds", fallback=1)
+GRAPH_ENGINE = CONFIG.get("graph", "engine", fallback="parent")
+MAX_SESSION_MESSAGES = CONFIG.getint("memory", "max_session_messages", fallback=200)
+MAX_SESSION_TABLES = CONFIG.getint("memory", "max_session_tables", fallback=3)
+SHOW_TRACE_PANEL = (CONFIG.getboolean("tracing", "enabled", fallback=True)
+                    and CONFIG.getboolean("tracing", "show_panel", fallback=True))
+
+# Returned by answer_from_last_result when the follow-up needs the raw rows of an aggregated result
+LOAD_RAW_ROWS = object()
 
 APP_TITLE = "crmGPT - Interactive Chat"
 APP_ICON = "🤖"
@@ -41,10 +56,18 @@ def main():
         with st.expander("Settings"):
             m = st.radio("LLM to use", options=models.keys())
             model = models[m]
+        if SHOW_TRACE_PANEL and st.session_state.get("last_trace"):
+            with st.expander("Timeline of the last run"):
+                show_trace_panel(st.session_state.last_trace)
 
     # Initialize session state for conversation history
     if "conversation_history" not in st.session_state:
         st.session_state.conversation_history = []
+    if "user_id" not in st.session_state:
+        st.session_state.user_id = str(uuid4())
+        st.session_state.active_job = None
+        st.session_state.last_result = None
+        st.session_state.last_trace = None
 
     messages = st.session_state.conversation_history
 
@@ -60,6 +83,14 @@ def main():
         elif message["role"] == "assistant":
             with st.chat_message("assistant"):
                 st.write(message["content"])
+                if message.get("table") is not None:
+                    st.dataframe(message["table"], hide_index=True)
+
+    # Show the error of the last failed run, if any
+    if error := st.session_state.pop("job_error", None):
+        st.error(f"An error occurred: {error}")
+        st.error("Please check the input or the model configuration.")
+        st.error(f"Exception type: {type(error).__name__}")
 
     # User input at the bottom of the chat
     query = st.chat_input("Enter your query:")
@@ -70,33 +101,243 @@ def main():
         with st.chat_message("user"):
             st.write(query)
 
-        # Run your chain logic to get the response
-        with st.spinner("Processing..."):
-            try:
-                output, st.session_state.conversation_history = run_chain_sql(
-                    query, model, st.session_state.conversation_history
-                )
-            except Exception as e:
-                st.error(f"An error occurred: {e}")
-                st.error("Please check the input or the model configuration.")
-                st.error(f"Exception type: {type(e).__name__}")
-                #output = "An error occurred while processing your request."
+        # Paging, sorting, filtering and aggregating the previous result is answered locally
+        answer = answer_from_last_result(query)
+        if answer is LOAD_RAW_ROWS:
+            # Loading the raw rows re-runs a large query, so it is queued like a chain run
+            job = submit_job({"action": "raw_rows", "result_id": st.session_state.last_result["run_id"]})
+            if job is not None:
+                st.session_state.raw_rows_job = job.id
+        elif answer is not None:
+            messages.append(answer)
+            trim_conversation(messages)
+            with st.chat_message("assistant"):
+                st.write(answer["content"])
+                st.dataframe(answer["table"], hide_index=True)
+            return
+        else:
+            # Queue the chain run on the background workers, without the result tables
+            history = [{"role": m["role"], "content": m["content"]} for m in messages]
+            submit_job({"query": query, "model": model, "conversation_history": history,
+                        "thread_id": st.session_state.user_id})
+
+    if st.session_state.active_job:
+        show_job_progress()
+
+
+def submit_job(payload):
+    """
+    Queues a job for the session, superseding its previous one. Returns the job, or None when
+    admission control rejected it, in which case the user's message is withdrawn.
+    """
+    # A new request supersedes the previous one, so stop its run
+    get_job_queue().cancel_user_jobs(st.session_state.user_id)
+    try:
+        job = get_job_queue().submit(st.session_state.user_id, payload)
+    except QueueFullError as e:
+        st.session_state.conversation_history.pop()
+        st.warning(str(e))
+        return None
+    st.session_state.active_job = job.id
+    return job
 
 
-        # Immediately display the agent's response
+@st.cache_resource
+def get_job_queue():
+    """Returns the job queue shared by all Streamlit sessions of this process."""
+    # With a shared [state_backend] the jobs are recorded where every replica can see them
+    from utilities.state_backend import get_state_store
+    state_store = get_state_store()
+    job_queue = JobQueue(
+        run_chain_job,
+        workers=CONFIG.getint("jobs", "workers", fallback=4),
+        max_pending=CONFIG.getint("jobs", "max_pending", fallback=32),
+        max_per_user=CONFIG.getint("jobs", "max_per_user", fallback=1),
+        abandon_seconds=CONFIG.getint("jobs", "abandon_seconds", fallback=30),
+        store=JobStore(state_store) if state_store is not None else None,
+    )
+    # Memory instrumentation, when on, traces allocations from the start
+    from utilities.memory_profile import get_memory_profiler
+    get_memory_profiler()
+    # Import the chain in the background so the first question doesn't pay for it
+    threading.Thread(target=importlib.import_module, args=("graphs.graph_parent",), daemon=True).start()
+    return job_queue
+
+
+@st.fragment(run_every=POLL_SECONDS)
+def show_job_progress():
+    """Polls the active job, showing per-node progress until it finishes."""
+    job_queue = get_job_queue()
+    job = job_queue.get(st.session_state.active_job)
+    if job is None:
+        st.session_state.active_job = None
+        return
+
+    if not job.finished:
         with st.chat_message("assistant"):
-            st.write(output)
+            if job.status == QUEUED:
+                st.write(f"Waiting in queue ({job_queue.position(job.id)} ahead)...")
+            elif job.cancel_requested:
+                st.write("Stopping...")
+                return
+            else:
+                st.write("Processing... " + " → ".join(job.progress))
+            if st.button("Cancel", key=f"cancel-{job.id}"):
+                job_queue.cancel(job.id)
+        return
 
+    # The job finished: record the answer and re-render the whole conversation
+    st.session_state.active_job = None
+    if st.session_state.pop("raw_rows_job", None) == job.id:
+        if job.status == DONE:
+            show_raw_rows()
+        elif job.status == FAILED:
+            st.session_state.job_error = job.error
+        st.rerun()
+    st.session_state.last_trace = job.id
+    if job.status == DONE:
+        st.session_state.conversation_history.append({"role": "assistant", "content": job.output})
+        trim_conversation(st.session_state.conversation_history)
+        from utilities.result_store import get_result_store
+        from utilities.result_followup import DEFAULT_PAGE_SIZE
+        if get_result_store().exists(job.id):
+            st.session_state.last_result = {"run_id": job.id, "offset": 0, "limit": DEFAULT_PAGE_SIZE}
+    elif job.status == FAILED:
+        st.session_state.job_error = job.error
+    st.rerun()
 
 
+def show_raw_rows():
+    """Answers with the first page of the raw rows loaded in place of the last, aggregated result."""
+    from utilities.result_store import get_result_store
+    from utilities.result_followup import FollowUp, answer_followup
+    last = st.session_state.last_result
+    last.update(offset=0, sort_by=None, ascending=True, filters={})
+    description, table = answer_followup(get_result_store(), last["run_id"], FollowUp("raw", limit=last["limit"]))
+    st.session_state.conversation_history.append({"role": "assistant", "content": description, "table": table})
+    trim_conversation(st.session_state.conversation_history)
 
-def run_chain_sql(query, model, conversation_history):
-    """Run the SQL chain with the user's query and conversation history."""
-    chain_sql = PostgreSQLChain(model)
 
-    chain_sql.build_graph()
+def show_trace_panel(run_id):
+    """Shows the span tree of a run as a timeline, with its export as OTLP/JSON."""
+    import json
+    import altair as alt
+    import pandas as pd
+    from utilities.tracing import load_trace, timeline_rows, to_otlp
+
+    trace = load_trace(run_id)
+    if trace is None:
+        # Traces are kept by the replica that ran the job, and only for the last runs
+        st.caption("No trace of this run on this server.")
+        return
+    rows = pd.DataFrame(timeline_rows(trace))
+    if rows.empty:
+        return
+    slowest = rows[rows["depth"] > 0].nlargest(3, "duration_ms")
+    caption = f"{rows['duration_ms'].iloc[0] / 1000:.2f}s in total"
+    if not slowest.empty:
+        caption += "; slowest: " + ", ".join(f"{span.name} {span.duration_ms / 1000:.2f}s"
+                                             for span in slowest.itertuples())
+    st.caption(caption)
+    chart = alt.Chart(rows).mark_bar().encode(
+        x=alt.X("start_ms:Q", title="ms since the start of the run"),
+        x2="end_ms:Q",
+        y=alt.Y("row:N", sort=None, title=None, axis=alt.Axis(labelLimit=220)),
+        color=alt.Color("kind:N", legend=alt.Legend(orient="bottom", title=None)),
+        tooltip=["name", "kind", "duration_ms", "error", "details"],
+    ).properties(height=max(120, 18 * len(rows)))
+    st.altair_chart(chart, use_container_width=True)
+    st.download_button("Download OTLP/JSON", json.dumps(to_otlp(trace)), file_name=f"trace-{run_id}.json",
+                       mime="application/json", key=f"trace-{run_id}")
+
+
+def trim_conversation(messages):
+    """
+    Keeps a session's conversation from growing without bound: only the last
+    MAX_SESSION_MESSAGES messages are kept, and only the last MAX_SESSION_TABLES of them
+    keep their result table.
+    """
+    if MAX_SESSION_MESSAGES > 0:
+        del messages[:-MAX_SESSION_MESSAGES]
+    else:
+        messages.clear()
+    tables = [message for message in messages if message.get("table") is not None]
+    for message in tables[:-MAX_SESSION_TABLES] if MAX_SESSION_TABLES else tables:
+        message["table"] = None
+
+
+def answer_from_last_result(query):
+    """
+    Answers follow-ups such as "show me the next 50 rows" or "sort that by revenue" from the
+    stored result of the previous run. Returns the assistant message, or None if the query
+    needs the full chain, or LOAD_RAW_ROWS when the raw rows of an aggregated result must be
+    loaded first.
+    """
+    last = st.session_state.last_result
+    if not last:
+        return None
+    from utilities.result_store import get_result_store
+    from utilities.result_followup import parse_followup, answer_followup
+    store = get_result_store()
+    df = store.load(last["run_id"])
+    if df is None:
+        return None
+    followup = parse_followup(query, list(df.columns), offset=last["offset"], page_size=last["limit"])
+    if followup is None:
+        return None
+
+    if followup.action == "raw":
+        # Aggregated results are replaced by the rows of their raw query on request
+        if not (store.load_meta(last["run_id"]) or {}).get("aggregated"):
+            return None
+        return LOAD_RAW_ROWS
+
+    if followup.action == "page":
+        # Keep paging through the previously sorted/filtered view
+        followup.sort_by = last.get("sort_by")
+        followup.ascending = last.get("ascending", True)
+        followup.filters = last.get("filters", {})
+    if followup.action != "aggregate":
+        last.update(offset=followup.offset, limit=followup.limit, sort_by=followup.sort_by,
+                    ascending=followup.ascending, filters=followup.filters)
+
+    description, table = answer_followup(store, last["run_id"], followup)
+    return {"role": "assistant", "content": description, "table": table}
+
+
+def run_chain_job(job):
+    """
+    Job queue entry point: runs the SQL chain for a queued job on a worker thread, or loads the
+    raw rows of an aggregated result for a "raw_rows" job.
+    """
+    payload = job.payload
+    try:
+        if payload.get("action") == "raw_rows":
+            from tools.tool_sql import load_raw_result
+            df = load_raw_result(payload["result_id"], run=job.handle)
+            return f"Loaded {len(df)} raw rows." if df is not None else "The result was not aggregated."
+        output, _ = run_chain_sql(
+            payload["query"],
+            payload["model"],
+            payload["conversation_history"],
+            on_node=job.report_node,
+            run_handle=job.handle,
+            thread_id=payload["thread_id"]
+        )
+    finally:
+        # With [memory] instrumentation on, each run ends with a memory checkpoint
+        from utilities.memory_profile import get_memory_profiler
+        profiler = get_memory_profiler()
+        if profiler is not None:
+            profiler.checkpoint(f"job {job.id}")
+    return output
+
+
+def run_chain_sql(query, model, conversation_history, on_node=None, run_handle=None, thread_id=None):
+    """Run the SQL chain with the user's query and conversation history."""
+    from graphs.chain_cache import get_chain
 
-    compiled_chain = chain_sql.compile_chain()
+    chain_sql, compiled_chain = get_chain(model, GRAPH_ENGINE)
 
     # Limit conversation history to the last N messages (e.g., last 4 messages)
     limited_conversation_history = conversation_history[-4:]
@@ -104,7 +345,10 @@ def run_chain_sql(query, model, conversation_history):
     # Enter the chain with the updated conversation history
     output = chain_sql.enter_chain(query, 
                                    compiled_chain, 
-                                   limited_conversation_history)
+                                   limited_conversation_history,
+                                   on_node=on_node,
+                                   run_handle=run_handle,
+                                   thread_id=thread_id)
     conversation_history.append({"role": "assistant", "content": output})
 
     return output, conversation_history
@@ -0,0 +1,85 @@
+"""
+Deterministic stand-in for the OpenAI chat models, for soak and load runs that need many turns
+without an API key or recordings. Each graph node is recognized by its system prompt or its
+functions and gets a fixed, well-formed answer; the SQL for a question is looked up in the
+gold questions, so queries really run against the fixture and results are really stored.
+"""
+import json
+import re
+from typing import Dict
+
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_openai import ChatOpenAI
+from pydantic import Field
+
+DEFAULT_SQL = "SELECT COUNT(*) FROM public.accounts"
+
+
+class FakeChatOpenAI(ChatOpenAI):
+    """ChatOpenAI that answers locally instead of calling the API."""
+
+    answers: Dict[str, str] = Field(default_factory=dict)  # Lower-cased question -> SQL
+
+    def _question(self, messages) -> str:
+        # The latest message without a name is the user's input (see HelperUtilities.prune_messages)
+        for message in reversed(messages):
+            if message.type == "human" and not message.name:
+                return str(message.content)
+        return ""
+
+    def _answer(self, messages, **kwargs) -> AIMessage:
+        system = str(messages[0].content) if messages else ""
+        functions = {function["name"]: function for function in kwargs.get("functions") or []}
+        question = self._question(messages)
+        sql = self.answers.get(question.strip().lower(), DEFAULT_SQL)
+
+        if "route" in functions:
+            options = functions["route"]["parameters"]["properties"]["next"]["anyOf"][0]["enum"]
+            choice = next(option for option in ("data_prompt_generator", "sql_generation", "FINISH")
+                          if option in options)
+            return AIMessage(content="", additional_kwargs={
+                "function_call": {"name": "route", "arguments": json.dumps({"next": choice})}})
+        if "execute_sql_query" in functions and not any(m.type == "function" for m in messages):
+            query = re.search(r"Use the following sql query.*?:\s*(.+?)\n\s*\n", system, re.S)
+            arguments = {"query": query.group(1).strip() if query else sql}
+            return AIMessage(content="", additional_kwargs={
+                "function_call": {"name": "execute_sql_query", "arguments": json.dumps(arguments)}})
+        # Later nodes' prompts embed the earlier nodes' outputs, so the most specific output format is checked first
+        if '"sql_query"' in system and "Output Format" in system:
+            return AIMessage(content=json.dumps({"sql_query": sql}))
+        if '"generated_prompt"' in system and "Output Format" in system:
+            return AIMessage(content=json.dumps({"generated_prompt": question}))
+        if "purpose_of_data" in system:
+            return AIMessage(content=json.dumps({
+                "purpose_of_data": "Reporting", "specific_data_needs": question,
+                "time_frame": "All time", "filters_criteria": "None",
+            }))
+        return AIMessage(content=f"Summary of the answer to: {question}")
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        message = self._answer(messages, **kwargs)
+        usage = {"input_tokens": sum(len(str(m.content)) // 4 for m in messages),
+                 "output_tokens": len(str(message.content)) // 4}
+        usage["total_tokens"] = usage["input_tokens"] + usage["output_tokens"]
+        message.usage_metadata = usage
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        message = self._generate(messages, stop, **kwargs).generations[0].message
+        chunk = ChatGenerationChunk(message=AIMessageChunk(
+            content=message.content, additional_kwargs=message.additional_kwargs,
+            usage_metadata=message.usage_metadata,
+        ))
+        if run_manager:
+            run_manager.on_llm_new_token(message.content, chunk=chunk)
+        yield chunk
+
+
+def fake_llm_factory(gold: list):
+    """Returns an LLM factory (see utilities.helper.set_llm_factory) answering with the gold SQL."""
+    answers = {item["question"].strip().lower(): item["sql"] for item in gold}
+
+    def factory(model: str) -> FakeChatOpenAI:
+        return FakeChatOpenAI(model=model, api_key="fake", answers=answers)
+    return factory
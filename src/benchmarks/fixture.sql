@@ -0,0 +1,191 @@
+-- Seeded CRM fixture for the text-to-SQL benchmark.
+-- Portable between SQLite (attached as schema "public" by utilities/db.py) and
+-- PostgreSQL (load into an empty database with: psql -f fixture.sql).
+
+CREATE TABLE accounts (
+    account_id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    industry TEXT NOT NULL,
+    country TEXT NOT NULL,
+    created_at DATE NOT NULL
+);
+
+CREATE TABLE contacts (
+    contact_id INTEGER PRIMARY KEY,
+    account_id INTEGER NOT NULL REFERENCES accounts (account_id),
+    first_name TEXT NOT NULL,
+    last_name TEXT NOT NULL,
+    email TEXT NOT NULL,
+    title TEXT
+);
+
+CREATE TABLE products (
+    product_id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    category TEXT NOT NULL,
+    unit_price NUMERIC(12, 2) NOT NULL
+);
+
+CREATE TABLE supplier (
+    supplier_id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    country TEXT NOT NULL
+);
+
+CREATE TABLE opportunities (
+    opportunity_id INTEGER PRIMARY KEY,
+    account_id INTEGER NOT NULL REFERENCES accounts (account_id),
+    name TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    amount NUMERIC(12, 2) NOT NULL,
+    close_date DATE NOT NULL,
+    owner TEXT NOT NULL
+);
+
+CREATE TABLE orders (
+    order_id INTEGER PRIMARY KEY,
+    account_id INTEGER NOT NULL REFERENCES accounts (account_id),
+    order_date DATE NOT NULL,
+    status TEXT NOT NULL,
+    total_amount NUMERIC(12, 2) NOT NULL
+);
+
+CREATE TABLE order_items (
+    order_item_id INTEGER PRIMARY KEY,
+    order_id INTEGER NOT NULL REFERENCES orders (order_id),
+    product_id INTEGER NOT NULL REFERENCES products (product_id),
+    quantity INTEGER NOT NULL,
+    unit_price NUMERIC(12, 2) NOT NULL
+);
+
+CREATE TABLE metadata_table (
+    schema_name TEXT NOT NULL,
+    table_name TEXT NOT NULL,
+    column_name TEXT NOT NULL,
+    data_type TEXT NOT NULL,
+    column_description TEXT,
+    constraint_name TEXT,
+    constraint_type TEXT
+);
+
+INSERT INTO accounts VALUES
+    (1, 'Acme Corp', 'Manufacturing', 'Germany', '2022-03-14'),
+    (2, 'Globex', 'Technology', 'United States', '2022-07-01'),
+    (3, 'Initech', 'Technology', 'United States', '2023-01-20'),
+    (4, 'Umbrella Health', 'Healthcare', 'United Kingdom', '2023-02-11'),
+    (5, 'Stark Industries', 'Manufacturing', 'United States', '2023-05-30'),
+    (6, 'Wayne Enterprises', 'Finance', 'United States', '2023-08-09'),
+    (7, 'Nordic Retail', 'Retail', 'Sweden', '2024-01-15'),
+    (8, 'Soylent Foods', 'Retail', 'Germany', '2024-03-03');
+
+INSERT INTO contacts VALUES
+    (1, 1, 'Anna', 'Keller', 'anna.keller@acme.example', 'Head of Procurement'),
+    (2, 1, 'Jonas', 'Weber', 'jonas.weber@acme.example', 'CFO'),
+    (3, 2, 'Maria', 'Lopez', 'maria.lopez@globex.example', 'CTO'),
+    (4, 2, 'Tom', 'Baker', 'tom.baker@globex.example', 'IT Manager'),
+    (5, 3, 'Peter', 'Gibbons', 'peter.gibbons@initech.example', 'Engineer'),
+    (6, 4, 'Olivia', 'Hughes', 'olivia.hughes@umbrella.example', 'Operations Director'),
+    (7, 5, 'Pepper', 'Potts', 'pepper.potts@stark.example', 'CEO'),
+    (8, 5, 'Harold', 'Hogan', 'harold.hogan@stark.example', 'Head of Security'),
+    (9, 6, 'Lucius', 'Fox', 'lucius.fox@wayne.example', 'CTO'),
+    (10, 7, 'Elin', 'Larsson', 'elin.larsson@nordic.example', 'Buyer'),
+    (11, 7, 'Nils', 'Berg', 'nils.berg@nordic.example', 'Store Manager'),
+    (12, 8, 'Greta', 'Schmidt', 'greta.schmidt@soylent.example', 'Purchasing Lead');
+
+INSERT INTO products VALUES
+    (1, 'CRM Cloud Basic', 'Software', 49.00),
+    (2, 'CRM Cloud Pro', 'Software', 129.00),
+    (3, 'Analytics Add-on', 'Software', 79.00),
+    (4, 'Onboarding Package', 'Services', 1500.00),
+    (5, 'Premium Support', 'Services', 900.00),
+    (6, 'Barcode Scanner', 'Hardware', 240.00);
+
+INSERT INTO supplier VALUES
+    (1, 'Cloud Hosting GmbH', 'Germany'),
+    (2, 'Scanner Supply Ltd', 'United Kingdom'),
+    (3, 'Support Partners Inc', 'United States'),
+    (4, 'Datacenter Nord AB', 'Sweden');
+
+INSERT INTO opportunities VALUES
+    (1, 1, 'Acme CRM rollout', 'Closed Won', 42000.00, '2023-06-30', 'Sarah'),
+    (2, 1, 'Acme analytics upsell', 'Negotiation', 18000.00, '2024-09-30', 'Sarah'),
+    (3, 2, 'Globex enterprise deal', 'Closed Won', 120000.00, '2023-11-15', 'David'),
+    (4, 2, 'Globex support renewal', 'Proposal', 25000.00, '2024-12-31', 'David'),
+    (5, 3, 'Initech pilot', 'Closed Lost', 15000.00, '2023-04-01', 'Sarah'),
+    (6, 4, 'Umbrella clinics', 'Qualification', 65000.00, '2024-10-15', 'Priya'),
+    (7, 5, 'Stark global CRM', 'Closed Won', 250000.00, '2024-02-28', 'David'),
+    (8, 5, 'Stark hardware refresh', 'Negotiation', 80000.00, '2024-11-30', 'Priya'),
+    (9, 6, 'Wayne finance suite', 'Proposal', 95000.00, '2024-12-15', 'Sarah'),
+    (10, 7, 'Nordic POS integration', 'Closed Won', 30000.00, '2024-05-20', 'Priya'),
+    (11, 8, 'Soylent starter', 'Qualification', 12000.00, '2024-10-01', 'David'),
+    (12, 3, 'Initech second try', 'Closed Lost', 22000.00, '2024-03-15', 'Priya');
+
+INSERT INTO orders VALUES
+    (1, 1, '2023-07-05', 'Delivered', 7290.00),
+    (2, 2, '2023-11-20', 'Delivered', 16060.00),
+    (3, 2, '2024-01-10', 'Delivered', 1800.00),
+    (4, 5, '2024-03-05', 'Delivered', 27300.00),
+    (5, 5, '2024-03-28', 'Shipped', 4800.00),
+    (6, 7, '2024-05-25', 'Delivered', 4380.00),
+    (7, 7, '2024-06-30', 'Cancelled', 960.00),
+    (8, 1, '2024-02-14', 'Delivered', 1580.00),
+    (9, 6, '2024-07-01', 'Pending', 3870.00),
+    (10, 4, '2024-08-12', 'Shipped', 2400.00),
+    (11, 2, '2024-09-03', 'Pending', 2580.00),
+    (12, 5, '2024-09-18', 'Delivered', 9600.00);
+
+INSERT INTO order_items VALUES
+    (1, 1, 2, 30, 129.00),
+    (2, 1, 4, 1, 1500.00),
+    (3, 1, 6, 8, 240.00),
+    (4, 2, 2, 100, 129.00),
+    (5, 2, 3, 40, 79.00),
+    (6, 3, 5, 2, 900.00),
+    (7, 4, 2, 200, 129.00),
+    (8, 4, 4, 1, 1500.00),
+    (9, 5, 6, 20, 240.00),
+    (10, 6, 1, 60, 49.00),
+    (11, 6, 6, 6, 240.00),
+    (12, 7, 6, 4, 240.00),
+    (13, 8, 3, 20, 79.00),
+    (14, 9, 2, 30, 129.00),
+    (15, 10, 6, 10, 240.00),
+    (16, 11, 2, 20, 129.00),
+    (17, 12, 6, 40, 240.00);
+
+INSERT INTO metadata_table VALUES
+    ('public', 'accounts', 'account_id', 'integer', 'Unique identifier of the customer account', 'accounts_pkey', 'PRIMARY KEY'),
+    ('public', 'accounts', 'name', 'text', 'Company name of the account', NULL, NULL),
+    ('public', 'accounts', 'industry', 'text', 'Industry the account operates in', NULL, NULL),
+    ('public', 'accounts', 'country', 'text', 'Country of the account''s headquarters', NULL, NULL),
+    ('public', 'accounts', 'created_at', 'date', 'Date the account was created in the CRM', NULL, NULL),
+    ('public', 'contacts', 'contact_id', 'integer', 'Unique identifier of the contact', 'contacts_pkey', 'PRIMARY KEY'),
+    ('public', 'contacts', 'account_id', 'integer', 'Account the contact works for', 'contacts_account_id_fkey', 'FOREIGN KEY'),
+    ('public', 'contacts', 'first_name', 'text', 'First name of the contact', NULL, NULL),
+    ('public', 'contacts', 'last_name', 'text', 'Last name of the contact', NULL, NULL),
+    ('public', 'contacts', 'email', 'text', 'Email address of the contact', NULL, NULL),
+    ('public', 'contacts', 'title', 'text', 'Job title of the contact', NULL, NULL),
+    ('public', 'products', 'product_id', 'integer', 'Unique identifier of the product', 'products_pkey', 'PRIMARY KEY'),
+    ('public', 'products', 'name', 'text', 'Product name', NULL, NULL),
+    ('public', 'products', 'category', 'text', 'Product category: Software, Services or Hardware', NULL, NULL),
+    ('public', 'products', 'unit_price', 'numeric', 'List price per unit', NULL, NULL),
+    ('public', 'supplier', 'supplier_id', 'integer', 'Unique identifier of the supplier', 'supplier_pkey', 'PRIMARY KEY'),
+    ('public', 'supplier', 'name', 'text', 'Supplier name', NULL, NULL),
+    ('public', 'supplier', 'country', 'text', 'Country of the supplier', NULL, NULL),
+    ('public', 'opportunities', 'opportunity_id', 'integer', 'Unique identifier of the sales opportunity', 'opportunities_pkey', 'PRIMARY KEY'),
+    ('public', 'opportunities', 'account_id', 'integer', 'Account the opportunity belongs to', 'opportunities_account_id_fkey', 'FOREIGN KEY'),
+    ('public', 'opportunities', 'name', 'text', 'Opportunity name', NULL, NULL),
+    ('public', 'opportunities', 'stage', 'text', 'Sales stage: Qualification, Proposal, Negotiation, Closed Won or Closed Lost', NULL, NULL),
+    ('public', 'opportunities', 'amount', 'numeric', 'Expected deal value', NULL, NULL),
+    ('public', 'opportunities', 'close_date', 'date', 'Expected or actual close date', NULL, NULL),
+    ('public', 'opportunities', 'owner', 'text', 'Sales representative owning the opportunity', NULL, NULL),
+    ('public', 'orders', 'order_id', 'integer', 'Unique identifier of the order', 'orders_pkey', 'PRIMARY KEY'),
+    ('public', 'orders', 'account_id', 'integer', 'Account that placed the order', 'orders_account_id_fkey', 'FOREIGN KEY'),
+    ('public', 'orders', 'order_date', 'date', 'Date the order was placed', NULL, NULL),
+    ('public', 'orders', 'status', 'text', 'Order status: Pending, Shipped, Delivered or Cancelled', NULL, NULL),
+    ('public', 'orders', 'total_amount', 'numeric', 'Total value of the order', NULL, NULL),
+    ('public', 'order_items', 'order_item_id', 'integer', 'Unique identifier of the order line', 'order_items_pkey', 'PRIMARY KEY'),
+    ('public', 'order_items', 'order_id', 'integer', 'Order the line belongs to', 'order_items_order_id_fkey', 'FOREIGN KEY'),
+    ('public', 'order_items', 'product_id', 'integer', 'Product ordered', 'order_items_product_id_fkey', 'FOREIGN KEY'),
+    ('public', 'order_items', 'quantity', 'integer', 'Number of units ordered', NULL, NULL),
+    ('public', 'order_items', 'unit_price', 'numeric', 'Price per unit on the order', NULL, NULL);
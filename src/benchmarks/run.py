@@ -0,0 +1,244 @@
+"""
+Text-to-SQL accuracy and latency benchmark.
+
+Each question in gold.jsonl is run through the parent graph against the seeded
+CRM fixture (fixture.sql). The SQL the graph generated is executed and its
+result compared with the gold result (execution match: same rows, ignoring
+column names, and ignoring row order unless the gold SQL has an ORDER BY).
+LLM calls, tokens and wall time are recorded per question.
+
+Modes:
+    fake    answer with benchmarks/fake_llm.py (offline, no API key): the gold SQL goes
+            through the real graph, tools and database, so accuracy and latency check
+            the graph's plumbing and overhead rather than the model
+    replay  answer from the responses in recordings.jsonl (offline, no API key)
+    record  call the live model and save its responses for replay
+    live    call the live model without saving anything
+Recordings are matched by request (see utilities/llm_cache.py); --match lenient
+tolerates whitespace-only prompt differences. Replay fails when recordings.jsonl is
+missing or a request has no recorded response.
+
+Prompt tokens are counted per graph node (system prompt, messages and the static
+prefix a provider's prompt cache can serve). --prompts compact runs with the
+compacted system prompts of utilities/prompt_compaction.py; --prompts compare
+runs the questions with both and fails when compaction lowers the accuracy.
+Compacted prompts need their own recordings (make benchmark-prompts).
+
+By default the fixture is loaded into a temporary SQLite database. With
+--db postgres the configured database is used; load fixture.sql into an empty
+database first.
+
+Run from the src directory:
+    python -m benchmarks.run [--mode fake] [--model gpt-4-1106-preview] [--questions id ...]
+                             [--prompts original|compact|compare]
+
+The summary is appended to temp/benchmarks.jsonl, and the command exits with
+status 1 when the accuracy is zero or below --min-accuracy.
+"""
+import argparse
+import json
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from decimal import Decimal
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURE_PATH = os.path.join(BENCHMARK_DIR, "fixture.sql")
+GOLD_PATH = os.path.join(BENCHMARK_DIR, "gold.jsonl")
+RECORDINGS_PATH = os.path.join(BENCHMARK_DIR, "recordings.jsonl")
+RESULTS_PATH = os.path.join(os.path.dirname(BENCHMARK_DIR), "temp", "benchmarks.jsonl")
+
+
+def build_fixture(path: str) -> str:
+    """Creates the SQLite fixture database at path."""
+    conn = sqlite3.connect(path)
+    with open(FIXTURE_PATH) as file:
+        conn.executescript(file.read())
+    conn.close()
+    return path
+
+
+def read_gold(path: str = GOLD_PATH, ids: list = None) -> list:
+    with open(path) as file:
+        gold = [json.loads(line) for line in file if line.strip()]
+    if ids:
+        gold = [item for item in gold if item["id"] in ids]
+    return gold
+
+
+def normalize_rows(rows, ordered: bool) -> list:
+    """Makes result rows comparable across databases: numbers as rounded floats, optionally sorted."""
+    def normalize(value):
+        if isinstance(value, (int, float, Decimal)) and not isinstance(value, bool):
+            return round(float(value), 2)
+        return value
+    rows = [tuple(normalize(value) for value in row) for row in rows]
+    return rows if ordered else sorted(rows, key=repr)
+
+
+def execute(sql: str) -> list:
+    from utilities.db import get_db_connection
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(sql)
+        return cursor.fetchall()
+    finally:
+        conn.close()
+
+
+def execution_match(sql: str, item: dict) -> bool:
+    """Returns whether the SQL returns the gold result of the question."""
+    ordered = "order by" in item["sql"].lower()
+    return normalize_rows(execute(sql), ordered) == normalize_rows(item["result"], ordered)
+
+
+def run_question(chain_sql, compiled_chain, item: dict, profiler=None) -> dict:
+    """Runs one gold question and returns its benchmark record."""
+    from utilities.run_callbacks import UsageCallbackHandler
+
+    usage = UsageCallbackHandler()
+    callbacks = [usage] + ([profiler] if profiler is not None else [])
+    record = {"id": item["id"], "match": False, "error": None, "sql_query": None}
+    start = time.perf_counter()
+    try:
+        state = chain_sql.run_chain(item["question"], compiled_chain, [],
+                                    thread_id=f"benchmark-{item['id']}-{time.time()}",
+                                    callbacks=callbacks)
+        record["sql_query"] = state.get("sql_query") or None
+    except Exception as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+    record["seconds"] = round(time.perf_counter() - start, 3)
+    record.update(usage.totals())
+
+    if record["sql_query"]:
+        try:
+            record["match"] = execution_match(record["sql_query"], item)
+        except Exception as e:
+            record["error"] = f"Generated SQL failed: {e}"
+    elif record["error"] is None:
+        record["error"] = "No SQL generated"
+    return record
+
+
+def summarize(records: list) -> dict:
+    seconds = [record["seconds"] for record in records]
+    return {
+        "questions": len(records),
+        "accuracy": round(sum(record["match"] for record in records) / len(records), 3) if records else None,
+        "llm_calls": sum(record["llm_calls"] for record in records),
+        "input_tokens": sum(record["input_tokens"] for record in records),
+        "output_tokens": sum(record["output_tokens"] for record in records),
+        "total_seconds": round(sum(seconds), 3),
+        "p50_seconds": statistics.median(seconds) if seconds else None,
+        "max_seconds": max(seconds) if seconds else None,
+    }
+
+
+def print_prompt_report(report: dict):
+    print(f"{'node':<26}{'calls':>6}{'system':>9}{'messages':>10}{'mean':>7}{'max':>7}{'static prefix':>15}")
+    for node, entry in report.items():
+        print(f"{node:<26}{entry['calls']:>6}{entry['system_tokens']:>9}{entry['message_tokens']:>10}"
+              f"{entry['mean_tokens']:>7}{entry['max_tokens']:>7}{entry['static_prefix_tokens']:>15}")
+
+
+def run_benchmark(args, compact: bool, llm_cache=None) -> tuple:
+    """Runs the gold questions through a graph built with original or compacted prompts."""
+    from graphs.graph_parent import ParentGraph
+    from utilities.prompt_compaction import set_prompt_compaction
+    from utilities.run_callbacks import PromptProfileCallbackHandler
+
+    set_prompt_compaction(compact)
+    chain_sql = ParentGraph(args.model)
+    compiled_chain = chain_sql.compile_graph()
+    profiler = PromptProfileCallbackHandler()
+
+    records = []
+    for item in read_gold(ids=args.questions):
+        record = run_question(chain_sql, compiled_chain, item, profiler)
+        records.append(record)
+        status = "match" if record["match"] else f"MISMATCH ({record['error'] or 'different result'})"
+        print(f"{item['id']}: {status}, {record['llm_calls']} LLM calls, "
+              f"{record['input_tokens'] + record['output_tokens']} tokens, {record['seconds']:.2f}s")
+
+    summary = summarize(records)
+    summary["prompts"] = "compact" if compact else "original"
+    summary["prompt_tokens"] = profiler.report()
+    if llm_cache is not None:
+        summary["llm_cache"] = llm_cache.stats()
+    print_prompt_report(summary["prompt_tokens"])
+    print(json.dumps({key: value for key, value in summary.items() if key != "prompt_tokens"}, indent=2))
+    return summary, records
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark SQL generation accuracy and latency.")
+    parser.add_argument("--mode", choices=["fake", "replay", "record", "live"], default="fake")
+    parser.add_argument("--model", default="gpt-4-1106-preview", help="Default model of the graph nodes")
+    parser.add_argument("--questions", nargs="*", help="Gold question ids to run (default: all)")
+    parser.add_argument("--match", choices=["strict", "lenient"], default="strict",
+                        help="How recorded responses are matched in replay mode")
+    parser.add_argument("--db", choices=["sqlite", "postgres"], default="sqlite")
+    parser.add_argument("--prompts", choices=["original", "compact", "compare"], default="original",
+                        help="System prompts to run with; compare runs both and checks compaction keeps the accuracy")
+    parser.add_argument("--results", default=RESULTS_PATH, help="JSON lines file the summary is appended to")
+    parser.add_argument("--min-accuracy", type=float, default=0.0)
+    args = parser.parse_args(argv)
+
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    if args.db == "sqlite":
+        os.environ["db_sqlite_path"] = build_fixture(os.path.join(tempfile.mkdtemp(), "crm_fixture.db"))
+
+    from utilities.helper import openai_llm_factory, set_llm_factory
+    from utilities.llm_cache import LLMCache, cached_llm_factory
+
+    llm_cache = None
+    if args.mode == "fake":
+        from benchmarks.fake_llm import fake_llm_factory
+        os.environ.setdefault("OPENAI_API_KEY", "fake")
+        set_llm_factory(fake_llm_factory(read_gold()))
+    elif args.mode == "live":
+        set_llm_factory(openai_llm_factory)
+    else:
+        if args.mode == "replay" and not os.path.exists(RECORDINGS_PATH):
+            print(f"No recordings to replay at {RECORDINGS_PATH}; record them with --mode record")
+            return 1
+        llm_cache = LLMCache(RECORDINGS_PATH, mode=args.mode, match=args.match)
+        set_llm_factory(cached_llm_factory(llm_cache))
+
+    variants = {"original": [False], "compact": [True], "compare": [False, True]}[args.prompts]
+    runs = [run_benchmark(args, compact, llm_cache) for compact in variants]
+
+    os.makedirs(os.path.dirname(args.results), exist_ok=True)
+    with open(args.results, "a") as file:
+        for summary, records in runs:
+            file.write(json.dumps({**summary, "mode": args.mode, "model": args.model, "db": args.db,
+                                   "recorded_at": time.time(), "records": records}) + "\n")
+
+    status = 0
+    for summary, _ in runs:
+        if not summary["accuracy"] or summary["accuracy"] < args.min_accuracy:
+            print(f"Accuracy {summary['accuracy']} is below {args.min_accuracy} or zero")
+            status = 1
+    if args.mode == "replay" and llm_cache.stats()["misses"]:
+        print(f"{llm_cache.stats()['misses']} requests had no recorded response; re-record with --mode record")
+        status = 1
+    if args.prompts == "compare":
+        (original, _), (compact, _) = runs
+        saved = sum(entry["total_tokens"] for entry in original["prompt_tokens"].values()) - \
+            sum(entry["total_tokens"] for entry in compact["prompt_tokens"].values())
+        print(f"Compaction: accuracy {original['accuracy']} -> {compact['accuracy']}, "
+              f"{saved} prompt tokens saved ({original['input_tokens']} -> {compact['input_tokens']} input tokens billed)")
+        if (compact["accuracy"] or 0) < (original["accuracy"] or 0):
+            print("Compacted prompts lowered the accuracy")
+            status = 1
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,124 @@
+"""
+Memory soak test of the app's chain runs.
+
+Runs hundreds of turns of simulated Streamlit sessions through the app's job queue and
+run_chain_job, with the fake LLM of benchmarks/fake_llm.py answering the gold questions
+against the SQLite fixture. After --warmup turns (imports, caches and pools filled), memory
+is measured with utilities/memory_profile.py every --every turns. The command exits with
+status 1 when the memory traced by tracemalloc grew by more than --max-growth-mb between the
+end of the warmup and the last turn, or the RSS by more than --max-rss-growth-mb, and
+when fewer than --min-done of the turns ended DONE (turns that fail fast keep memory flat).
+
+Run from the src directory:
+    python -m benchmarks.soak [--turns 300] [--sessions 4] [--max-growth-mb 10]
+
+The summary is appended to temp/soak.jsonl.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+from benchmarks.run import build_fixture, read_gold
+
+RESULTS_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "temp", "soak.jsonl")
+
+
+def run_turn(job_queue, session: dict, question: str, model: str) -> str:
+    """Runs one question of a session the way app.py does and returns the job status."""
+    from app import trim_conversation
+    from utilities.job_queue import DONE
+
+    messages = session["messages"]
+    messages.append({"role": "user", "content": question})
+    history = [{"role": m["role"], "content": m["content"]} for m in messages]
+    job = job_queue.submit(session["user_id"], {"query": question, "model": model,
+                                                "conversation_history": history,
+                                                "thread_id": session["user_id"]})
+    while not job.finished:
+        time.sleep(0.005)
+    if job.status == DONE:
+        messages.append({"role": "assistant", "content": job.output})
+    trim_conversation(messages)
+    return job.status
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Check that memory stays flat over many chain runs.")
+    parser.add_argument("--turns", type=int, default=300)
+    parser.add_argument("--warmup", type=int, default=30, help="Turns run before the baseline is measured")
+    parser.add_argument("--every", type=int, default=50, help="Turns between memory checkpoints")
+    parser.add_argument("--sessions", type=int, default=4, help="Simulated browser sessions, served round-robin")
+    parser.add_argument("--model", default="gpt-4-1106-preview")
+    parser.add_argument("--max-growth-mb", type=float, default=10.0, help="Allowed growth of the traced memory")
+    parser.add_argument("--max-rss-growth-mb", type=float, default=50.0, help="Allowed growth of the RSS")
+    parser.add_argument("--min-done", type=float, default=0.99, help="Share of the turns that must end DONE")
+    parser.add_argument("--results", default=RESULTS_PATH, help="JSON lines file the summary is appended to")
+    args = parser.parse_args(argv)
+    if not 1 < args.warmup < args.turns:
+        parser.error("--warmup must be between 1 and --turns")
+
+    os.environ["db_sqlite_path"] = build_fixture(os.path.join(tempfile.mkdtemp(), "crm_fixture.db"))
+    os.environ.setdefault("OPENAI_API_KEY", "fake")
+
+    from benchmarks.fake_llm import fake_llm_factory
+    from utilities.helper import set_llm_factory
+    from utilities.job_queue import DONE, JobQueue
+    from utilities.memory_profile import MemoryConfig, MemoryProfiler
+    import app
+
+    gold = read_gold()
+    set_llm_factory(fake_llm_factory(gold))
+    profiler = MemoryProfiler(MemoryConfig())
+    # Finished jobs are only kept briefly, so the jobs retained for polling don't count as growth
+    job_queue = JobQueue(app.run_chain_job, workers=2, max_pending=args.sessions, max_per_user=1,
+                         retention_seconds=1, abandon_seconds=3600)
+    sessions = [{"user_id": f"soak-{i}", "messages": []} for i in range(args.sessions)]
+
+    statuses = {}
+    checkpoints = []
+    baseline = None
+    start = time.perf_counter()
+    for turn in range(1, args.turns + 1):
+        session = sessions[turn % len(sessions)]
+        status = run_turn(job_queue, session, gold[turn % len(gold)]["question"], args.model)
+        statuses[status] = statuses.get(status, 0) + 1
+        if turn == args.warmup // 2:
+            # The profiler keeps its last tracemalloc snapshot; take one before the baseline so
+            # the snapshot's own memory is part of the baseline RSS
+            profiler.checkpoint("warmup", record=False)
+        elif turn == args.warmup:
+            baseline = profiler.checkpoint(f"turn {turn} (baseline)")
+            checkpoints.append(baseline)
+        elif turn > args.warmup and (turn % args.every == 0 or turn == args.turns):
+            checkpoints.append(profiler.checkpoint(f"turn {turn}"))
+
+    last = checkpoints[-1]
+    growth = round(last["traced_mb"] - baseline["traced_mb"], 2)
+    rss_growth = round(last["rss_mb"] - baseline["rss_mb"], 2) if last["rss_mb"] is not None else None
+    summary = {
+        "turns": args.turns, "sessions": args.sessions, "statuses": statuses,
+        "seconds": round(time.perf_counter() - start, 1),
+        "traced_mb": [checkpoint["traced_mb"] for checkpoint in checkpoints],
+        "rss_mb": [checkpoint["rss_mb"] for checkpoint in checkpoints],
+        "traced_growth_mb": growth, "rss_growth_mb": rss_growth,
+        "per_turn_kb": round(growth * 1024 / max(1, args.turns - args.warmup), 2),
+    }
+    print(json.dumps(summary, indent=2))
+    os.makedirs(os.path.dirname(args.results), exist_ok=True)
+    with open(args.results, "a") as file:
+        file.write(json.dumps({**summary, "recorded_at": time.time(), "checkpoints": checkpoints}) + "\n")
+
+    grew = growth > args.max_growth_mb or (rss_growth is not None and rss_growth > args.max_rss_growth_mb)
+    if grew:
+        print("Memory grew beyond the threshold; see top_growth and object_deltas of the checkpoints")
+    done = statuses.get(DONE, 0) / args.turns
+    if done < args.min_done:
+        print(f"Only {done:.1%} of the turns ended {DONE}: {statuses}")
+    return 1 if grew or done < args.min_done else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,23 @@
+import threading
+
+# Compiled chains are shared by every session of the process: (engine, model) -> (chain, compiled chain)
+_chains = {}
+_lock = threading.Lock()
+
+
+def get_chain(model: str, engine: str = "parent"):
+    """Builds and compiles the chain for a model once per process and returns (chain, compiled chain)."""
+    with _lock:
+        if (engine, model) not in _chains:
+            if engine == "flat":
+                from graphs.graph import PostgreSQLChain
+                chain_sql = PostgreSQLChain(model)
+                chain_sql.build_graph()
+                _chains[engine, model] = (chain_sql, chain_sql.compile_chain())
+            else:
+                from graphs.graph_parent import ParentGraph
+                from utilities.state_backend import get_checkpointer
+                # Threads are checkpointed in the [state_backend], so any replica can continue them
+                chain_sql = ParentGraph(model, checkpointer=get_checkpointer())
+                _chains[engine, model] = (chain_sql, chain_sql.compile_graph())
+        return _chains[engine, model]
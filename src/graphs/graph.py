@@ -1,32 +1,29 @@
 from langgraph.graph import StateGraph, START, END
 from langchain_core.messages import BaseMessage, HumanMessage
-from typing import List, TypedDict, Annotated, Any
+from typing import List
 from teams.team_sql import SQLTeam
-from teams.team_data import DataRequirementTeam
-import operator
-
-
-class CombinedTeamState(TypedDict):
-    messages: Annotated[List[BaseMessage], operator.add]
-    chat_history: List[str]
-    team_members: List[str]  # Ensuring team members are passed correctly
-    data_team_members: List[str]
-    sql_team_members: List[str]
-    next: str
-    agent_scratchpad: str
-    data_requirements: List[str]  # Stores parameters collected by DataRequirementTeam
-    generated_prompt: str    # Stores the prompt generated by data_prompt_generator
-    sql_query: str
-    execution_results: Any
-    intermediate_steps: List[str]
-    metadata: List[dict]
+from teams.team_data import TeamDataRequirement
+from teams.team_prompt import TeamPromptGenerator
+from utilities.config import ModelConfig
+from utilities.loop_control import LOOP_CONFIG, LoopGuard, loop_summary
+from utilities.run_context import RunHandle, bind_run
+from utilities.run_callbacks import CancellationCallbackHandler
+from utilities.tracing import trace_run
+from graphs.graph_state import CombinedTeamState
+import time
 
 
 class PostgreSQLChain:
-    def __init__(self, model):
-        # Create instances of both teams
-        self.sql_team = SQLTeam(model=model)
-        self.data_team = DataRequirementTeam(model=model)
+    def __init__(self, model, node_models=None):
+        # Resolve the model used by each node from the config file unless given explicitly
+        if node_models is None:
+            node_models = ModelConfig(model).node_models()
+        self.node_models = node_models
+
+        # Create instances of the teams
+        self.sql_team = SQLTeam(model=model, node_models=node_models)
+        self.data_team = TeamDataRequirement(model=model, node_models=node_models)
+        self.prompt_team = TeamPromptGenerator(model=model, node_models=node_models)
         self.graph = StateGraph(CombinedTeamState)  # Initialize the StateGraph with combined state
 
         # List of team members for supervisor agents
@@ -45,11 +42,25 @@ class PostgreSQLChain:
     def build_graph(self):
         """Build the combined data requirement and SQL execution graph."""
 
-        # Add nodes for DataRequirementTeam agents
+        # Add nodes for the data requirement and prompt generation agents
         self.graph.add_node("data_gather_information", self.data_team.data_gather_information())
-        self.graph.add_node("data_prompt_generator", self.data_team.data_prompt_generator())
-        self.graph.add_node("data_gather_supervisor", self.data_team.data_gather_supervisor(self.data_team_members))
-        self.graph.add_node("data_prompt_supervisor", self.data_team.data_prompt_supervisor(self.team_members))
+        self.graph.add_node("data_prompt_generator", self.prompt_team.prompt_generator())
+        # The supervisors route in loops; the guards end a loop that stops making progress
+        self.graph.add_node("data_gather_supervisor", LoopGuard(
+            "data_gather_supervisor",
+            self.data_team.data_gather_supervisor(self.data_team_members),
+            agents=["data_gather_information", "data_prompt_generator"],
+            routes=["FINISH", "data_gather_information", "data_prompt_generator"],
+            fallback=lambda state: "FINISH",
+        ))
+        self.graph.add_node("data_prompt_supervisor", LoopGuard(
+            "data_prompt_supervisor",
+            self.prompt_team.data_prompt_supervisor(self.team_members),
+            agents=["data_prompt_generator"],
+            routes=["data_prompt_generator", "sql_generation"],
+            # Continue with the prompt generated so far, if any
+            fallback=lambda state: "sql_generation" if (state.get("generated_prompt") or "").strip() else "FINISH",
+        ))
 
         # Add nodes for SQLTeam agents
         self.graph.add_node("sql_generation", self.sql_team.sql_generation_agent())
@@ -80,7 +91,8 @@ class PostgreSQLChain:
             lambda x: x["next"],
             {
                 "data_prompt_generator": "data_prompt_generator",
-                "sql_generation": "sql_generation"
+                "sql_generation": "sql_generation",
+                "FINISH": END
             }
         )
         self.graph.add_edge("data_prompt_generator", "data_prompt_supervisor")
@@ -96,7 +108,14 @@ class PostgreSQLChain:
         """Compile the combined chain from the constructed graph."""
         return self.graph.compile()
 
-    def enter_chain(self, message: str, chain, conversation_history: List[dict]):
+    def enter_chain(self, message: str, chain, conversation_history: List[dict], on_node=None,
+                    run_handle: RunHandle = None, thread_id: str = None):
+        """
+        Run the chain for a message. on_node is called with each node name as it completes.
+        Cancelling run_handle stops the run at the next LLM call, tool call or streamed token
+        and interrupts a running SQL query. thread_id is accepted for compatibility with
+        ParentGraph; the flat chain keeps no checkpoints.
+        """
         # Initialize messages with the user's input
         results = [HumanMessage(content=message)]
         print(f"Messages length: {len(results)}")
@@ -112,11 +131,31 @@ class PostgreSQLChain:
             "generated_prompt": "",
             "sql_query": "",
             "execution_results": None,
-            "next": None
+            "next": None,
+            "loop_counts": None
         }
 
+        run_handle = run_handle or RunHandle()
         # Execute the chain by invoking it with the input data
-        chain_result = chain.invoke(input_data)
+        start = time.perf_counter()
+        with trace_run(run_handle, "enter_chain", {"graph": "flat", "question": message}) as callbacks, \
+                bind_run(run_handle):
+            config = {
+                "callbacks": [CancellationCallbackHandler(run_handle)] + callbacks,
+                "recursion_limit": LOOP_CONFIG.recursion_limit,
+            }
+            if on_node is None:
+                chain_result = chain.invoke(input_data, config=config)
+            else:
+                # Stream node updates to report progress, keeping the latest full state as the result
+                chain_result = {}
+                for mode, chunk in chain.stream(input_data, config=config, stream_mode=["updates", "values"]):
+                    if mode == "values":
+                        chain_result = chunk
+                    else:
+                        for node in chunk:
+                            on_node(node)
+        print(f"Flat chain run took {time.perf_counter() - start:.2f}s, node visits: {loop_summary(chain_result)}")
 
         if "messages" in chain_result and chain_result["messages"]:
             # Extract the final output from the messages
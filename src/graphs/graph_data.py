@@ -1,9 +1,19 @@
 # graph_data.py
 from langgraph.graph import StateGraph, START, END
-from graph_state import CombinedTeamState
-from typing import List
+from graphs.graph_state import CombinedTeamState
 from teams.team_data import TeamDataRequirement
 
+REQUIREMENT_KEYS = ("purpose_of_data", "specific_data_needs", "time_frame", "filters_criteria")
+
+
+def ready_for_prompt_generation(state: CombinedTeamState) -> bool:
+    """True when every data requirement has been collected for the current question."""
+    requirements = state.get("data_requirements") or {}
+    if not isinstance(requirements, dict):
+        return False
+    return all(str(requirements.get(key) or "").strip() for key in REQUIREMENT_KEYS)
+
+
 class DataRequirementTeamSubgraph:
     def __init__(self, data_team: TeamDataRequirement):
         self.data_team = data_team
@@ -19,7 +29,6 @@ class DataRequirementTeamSubgraph:
             lambda x: x["next"],
             {
                 "FINISH": END,
-                "data_gather_information": "data_gather_information",
             }
         )
 
@@ -28,15 +37,11 @@ class DataRequirementTeamSubgraph:
 
     def data_gather_supervisor(self):
         def supervisor_agent(state: CombinedTeamState):
-            # Supervisor logic
-            # Decide next action based on state
-            # For example, if ready to proceed to prompt generation:
+            # Proceed to prompt generation once the requirements are complete. Otherwise the
+            # data_gather_information message is a question for the user, so end the run.
             if ready_for_prompt_generation(state):
-                state["next_subgraph"] = "prompt_subgraph"
-                state["next"] = "FINISH"  # Finish the subgraph
-            else:
-                state["next"] = "data_gather_information"  # Loop back
-            return state
+                return {"next": "FINISH", "next_subgraph": "prompt_subgraph"}
+            return {"next": "FINISH", "next_subgraph": "END"}
         return supervisor_agent
 
     def compile_graph(self):
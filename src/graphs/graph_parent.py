@@ -1,87 +1,209 @@
 # graph_parent.py
+import time
+from typing import List
+from langchain_core.messages import HumanMessage, RemoveMessage
+from langgraph.checkpoint.memory import MemorySaver
 from langgraph.graph import StateGraph, START, END
-from graph_state import CombinedTeamState
+from graphs.graph_state import CombinedTeamState
+from graphs.graph_data import DataRequirementTeamSubgraph, ready_for_prompt_generation
+from graphs.graph_prompt import PromptTeamSubgraph, ready_for_sql_generation
+from graphs.graph_sql import SQLTeamSubgraph
 from teams.team_sql import SQLTeam
-from teams.team_data import DataRequirementTeam
-from graph_data import DataRequirementTeamSubgraph
-from graph_prompt import PromptTeamSubgraph
-from graph_sql import SQLTeamSubgraph
+from teams.team_data import TeamDataRequirement
+from teams.team_prompt import TeamPromptGenerator
+from utilities.config import ModelConfig
+from utilities.loop_control import LOOP_CONFIG, loop_summary
+from utilities.run_context import RunHandle, bind_run
+from utilities.run_callbacks import CancellationCallbackHandler
+from utilities.speculation import SPECULATION_CONFIG
+from utilities.tracing import trace_run
 
 class ParentGraph:
-    def __init__(self, model):
-        self.sql_team = SQLTeam(model=model)
-        self.data_team = DataRequirementTeam(model=model)
-        
-        # Initialize subgraphs
-        self.data_subgraph = DataRequirementTeamSubgraph(self.data_team).compile_graph()
-        self.prompt_subgraph = PromptTeamSubgraph(self.data_team).compile_graph()
-        self.sql_subgraph = SQLTeamSubgraph(self.sql_team).compile_graph()
+    """
+    Production graph composed of the data requirement, prompt generation and SQL subgraphs.
 
+    Runs are checkpointed per thread. A subgraph whose outputs for the current question are
+    already in the checkpointed state is skipped, e.g. re-asking a question after a cancelled
+    or failed run goes straight to the SQL team when the prompt was already generated.
+
+    With [speculation] enabled, a run that starts with the data subgraph also starts generating
+    SQL from the raw question in the background, for the SQL team to reuse (see
+    SQLTeam.start_speculation).
+    """
+
+    def __init__(self, model, node_models=None, checkpointer=None):
+        # Resolve the model used by each node from the config file unless given explicitly
+        if node_models is None:
+            node_models = ModelConfig(model).node_models()
+        self.node_models = node_models
+
+        self.sql_team = SQLTeam(model=model, node_models=node_models)
+        self.data_team = TeamDataRequirement(model=model, node_models=node_models)
+        self.prompt_team = TeamPromptGenerator(model=model, node_models=node_models)
+
+        # Initialize subgraphs; each is compiled once and reused by every run
+        data_subgraph = DataRequirementTeamSubgraph(self.data_team)
+        prompt_subgraph = PromptTeamSubgraph(self.prompt_team)
+        sql_subgraph = SQLTeamSubgraph(self.sql_team)
+        self.data_team_members = data_subgraph.data_team_members + prompt_subgraph.team_members
+        self.sql_team_members = sql_subgraph.sql_team_members
+        self.data_subgraph = data_subgraph.compile_graph()
+        self.prompt_subgraph = prompt_subgraph.compile_graph()
+        self.sql_subgraph = sql_subgraph.compile_graph()
+
+        self.checkpointer = checkpointer or MemorySaver()
         self.graph = StateGraph(CombinedTeamState)
 
+    def timed_subgraph(self, name: str, subgraph):
+        """Wraps a compiled subgraph in a node that records how long it ran."""
+        def run_subgraph(state: CombinedTeamState, config):
+            start = time.perf_counter()
+            result = subgraph.invoke(state, config)
+            elapsed = time.perf_counter() - start
+            print(f"{name} took {elapsed:.2f}s")
+
+            # Messages already in the parent state are matched by id, so only new ones are appended
+            update = {key: value for key, value in result.items() if key != "subgraph_timings"}
+            update["subgraph_timings"] = {name: elapsed}
+            return update
+        return run_subgraph
+
+    def route_start(self, state: CombinedTeamState):
+        """Starts at the first subgraph whose outputs are missing from the checkpointed state."""
+        if not ready_for_prompt_generation(state):
+            return "data_subgraph"
+        if not ready_for_sql_generation(state):
+            print("Skipping data_subgraph: data requirements already collected")
+            return "prompt_subgraph"
+        print("Skipping data_subgraph and prompt_subgraph: prompt already generated")
+        return "sql_subgraph"
+
     def build_graph(self):
         # Add subgraphs as nodes
-        self.graph.add_node("data_subgraph", self.data_subgraph)
-        self.graph.add_node("prompt_subgraph", self.prompt_subgraph)
-        self.graph.add_node("sql_subgraph", self.sql_subgraph)
+        self.graph.add_node("data_subgraph", self.timed_subgraph("data_subgraph", self.data_subgraph))
+        self.graph.add_node("prompt_subgraph", self.timed_subgraph("prompt_subgraph", self.prompt_subgraph))
+        self.graph.add_node("sql_subgraph", self.timed_subgraph("sql_subgraph", self.sql_subgraph))
 
-        # Add conditional edges based on state["next_subgraph"]
+        # Start the graph at the first subgraph with work left to do
         self.graph.add_conditional_edges(
-            "data_subgraph",
-            lambda x: x.get("next_subgraph"),
+            START,
+            self.route_start,
             {
+                "data_subgraph": "data_subgraph",
                 "prompt_subgraph": "prompt_subgraph",
-                "END": END,
+                "sql_subgraph": "sql_subgraph",
             }
         )
 
+        # Add conditional edges based on state["next_subgraph"]
         self.graph.add_conditional_edges(
-            "prompt_subgraph",
+            "data_subgraph",
             lambda x: x.get("next_subgraph"),
             {
-                "sql_subgraph": "sql_subgraph",
+                "prompt_subgraph": "prompt_subgraph",
                 "END": END,
             }
         )
 
         self.graph.add_conditional_edges(
-            "sql_subgraph",
+            "prompt_subgraph",
             lambda x: x.get("next_subgraph"),
             {
+                "sql_subgraph": "sql_subgraph",
                 "END": END,
             }
         )
 
-        # Start the graph
-        self.graph.add_edge(START, "data_subgraph")
+        self.graph.add_edge("sql_subgraph", END)
 
     def compile_graph(self):
         self.build_graph()
-        return self.graph.compile()
+        return self.graph.compile(checkpointer=self.checkpointer)
 
-    def enter_chain(self, message: str, chain, conversation_history: List[dict]):
-        # Initialize messages with the user's input
-        results = [HumanMessage(content=message)]
+    def run_chain(self, message: str, chain, conversation_history: List[dict], on_node=None,
+                  run_handle: RunHandle = None, thread_id: str = None, callbacks: list = None) -> dict:
+        """
+        Run the graph for a message on a conversation thread and return the final state.
+        on_node is called with each node name as it completes; cancelling run_handle stops the run.
+        callbacks are added to the run's LangChain callbacks.
+        """
+        run_handle = run_handle or RunHandle()
+        config = {
+            "configurable": {"thread_id": thread_id or run_handle.run_id},
+            "callbacks": [CancellationCallbackHandler(run_handle)] + (callbacks or []),
+            "recursion_limit": LOOP_CONFIG.recursion_limit,
+        }
 
+        # Initialize messages with the user's input
         input_data = {
-            "messages": results,
+            "messages": [HumanMessage(content=message)],
             "chat_history": conversation_history,
             "team_members": self.data_team_members + self.sql_team_members,
             "data_team_members": self.data_team_members,
             "sql_team_members": self.sql_team_members,
             "agent_scratchpad": "",
             "intermediate_steps": [],
-            "data_requirements": [],
-            "generated_prompt": "",
-            "sql_query": "",
-            "execution_results": None,
+            "question": message,
             "next": None,
-            "next_subgraph": None
+            "next_subgraph": None,
+            "subgraph_timings": None,
+            "loop_counts": None
         }
 
+        # A new question starts from scratch. Re-asking the same question resumes from the
+        # subgraph outputs already checkpointed for it.
+        previous = chain.get_state(config).values
+        if previous.get("question") != message:
+            # The conversation so far is carried by chat_history, so the previous question's
+            # messages are dropped to keep the checkpointed state from growing every turn
+            input_data["messages"] = [
+                RemoveMessage(id=m.id) for m in previous.get("messages", [])
+            ] + input_data["messages"]
+            input_data.update({
+                "data_requirements": {},
+                "generated_prompt": "",
+                "sql_query": "",
+                "execution_results": None,
+            })
+
         # Execute the chain by invoking it with the input data
-        chain_result = chain.invoke(input_data)
+        start = time.perf_counter()
+        with bind_run(run_handle):
+            # The speculation overlaps the data and prompt subgraphs; sql_generation joins it
+            speculate = SPECULATION_CONFIG.enabled and not ready_for_prompt_generation({**previous, **input_data})
+            if speculate:
+                # Its state is the new question alone, without the removals of the previous messages
+                self.sql_team.start_speculation({**input_data, "messages": input_data["messages"][-1:]},
+                                                run_handle.run_id, {"callbacks": config["callbacks"]})
+            try:
+                chain_result = {}
+                for namespace, mode, chunk in chain.stream(input_data, config=config,
+                                                           stream_mode=["updates", "values"], subgraphs=True):
+                    if mode == "values":
+                        if not namespace:
+                            chain_result = chunk
+                    elif on_node is not None:
+                        for node in chunk:
+                            on_node(node)
+            finally:
+                if speculate:
+                    self.sql_team.discard_speculation(run_handle.run_id)
+        print(f"Parent graph run took {time.perf_counter() - start:.2f}s: {chain_result.get('subgraph_timings')}, "
+              f"node visits: {loop_summary(chain_result)}")
+        return chain_result
 
+    def enter_chain(self, message: str, chain, conversation_history: List[dict], on_node=None,
+                    run_handle: RunHandle = None, thread_id: str = None):
+        """
+        Run the graph for a message on a conversation thread and return the final answer.
+        on_node is called with each node name as it completes; cancelling run_handle stops the run.
+        With [tracing] enabled, the run's span tree is saved under its run id.
+        """
+        run_handle = run_handle or RunHandle()
+        with trace_run(run_handle, "enter_chain", {"graph": "parent", "question": message,
+                                                   "thread_id": thread_id}) as callbacks:
+            chain_result = self.run_chain(message, chain, conversation_history, on_node=on_node,
+                                          run_handle=run_handle, thread_id=thread_id, callbacks=callbacks)
         if "messages" in chain_result and chain_result["messages"]:
             # Extract the final output from the messages
             final_output = chain_result["messages"][-1].content
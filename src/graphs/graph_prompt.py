@@ -1,16 +1,22 @@
 # graph_prompt.py
 from langgraph.graph import StateGraph, START, END
-from graph_state import CombinedTeamState
+from graphs.graph_state import CombinedTeamState
 from teams.team_prompt import TeamPromptGenerator
 
+
+def ready_for_sql_generation(state: CombinedTeamState) -> bool:
+    """True when a prompt has been generated for the current question."""
+    return bool((state.get("generated_prompt") or "").strip())
+
+
 class PromptTeamSubgraph:
-    def __init__(self, data_team: TeamPromptGenerator):
-        self.data_team = data_team
+    def __init__(self, prompt_team: TeamPromptGenerator):
+        self.prompt_team = prompt_team
         self.graph = StateGraph(CombinedTeamState)
         self.team_members = ["data_prompt_generator"]
 
     def build_graph(self):
-        self.graph.add_node("data_prompt_generator", self.data_team.data_prompt_generator())
+        self.graph.add_node("data_prompt_generator", self.prompt_team.prompt_generator())
         self.graph.add_node("data_prompt_supervisor", self.data_prompt_supervisor())
 
         self.graph.add_conditional_edges(
@@ -18,7 +24,6 @@ class PromptTeamSubgraph:
             lambda x: x["next"],
             {
                 "FINISH": END,
-                "data_prompt_generator": "data_prompt_generator",
             }
         )
 
@@ -27,14 +32,11 @@ class PromptTeamSubgraph:
 
     def data_prompt_supervisor(self):
         def supervisor_agent(state: CombinedTeamState):
-            # Supervisor logic
-            # For example, if ready to proceed to SQL generation:
-            if some_condition_met(state):
-                state["next_subgraph"] = "sql_subgraph"
-                state["next"] = "FINISH"  # Finish the subgraph
-            else:
-                state["next"] = "data_prompt_generator"  # Loop back
-            return state
+            # Hand over to the SQL team once the prompt is generated; otherwise return the
+            # generator's message to the user
+            if ready_for_sql_generation(state):
+                return {"next": "FINISH", "next_subgraph": "sql_subgraph"}
+            return {"next": "FINISH", "next_subgraph": "END"}
         return supervisor_agent
 
     def compile_graph(self):
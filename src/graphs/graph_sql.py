@@ -1,6 +1,6 @@
 # graph_sql.py
 from langgraph.graph import StateGraph, START, END
-from graph_state import CombinedTeamState
+from graphs.graph_state import CombinedTeamState
 from teams.team_sql import SQLTeam
 
 class SQLTeamSubgraph:
@@ -23,10 +23,8 @@ class SQLTeamSubgraph:
 
     def sql_supervisor(self):
         def supervisor_agent(state: CombinedTeamState):
-            # Supervisor logic
-            # Decide whether to end or loop
-            state["next_subgraph"] = "END"
-            return state
+            # The SQL team is the last stage of the parent graph
+            return {"next_subgraph": "END"}
         return supervisor_agent
 
     def compile_graph(self):
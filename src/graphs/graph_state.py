@@ -1,10 +1,21 @@
 # state.py
-from typing import List, TypedDict, Annotated, Any
+from typing import List, TypedDict, Annotated, Any, Optional
 from langchain_core.messages import BaseMessage
-import operator
+from langgraph.graph.message import add_messages
+from utilities.payload_store import PayloadRef
+
+
+def merge_dicts(left: dict, right: dict) -> dict:
+    """Reducer that merges dictionary updates into the existing value. None resets it."""
+    if right is None:
+        return {}
+    return {**(left or {}), **right}
+
 
 class CombinedTeamState(TypedDict):
-    messages: Annotated[List[BaseMessage], operator.add]
+    # add_messages appends new messages and replaces/removes existing ones by id, which lets
+    # a new question drop the previous question's messages from the checkpointed thread
+    messages: Annotated[List[BaseMessage], add_messages]
     chat_history: List[str]
     team_members: List[str]
     data_team_members: List[str]
@@ -12,9 +23,12 @@ class CombinedTeamState(TypedDict):
     next: str
     next_subgraph: str
     agent_scratchpad: str
+    question: str  # The user message the requirements, prompt and query below belong to
     data_requirements: List[str]
     generated_prompt: str
     sql_query: str
-    execution_results: Any
+    execution_results: Optional[PayloadRef]  # Query result, kept in the ResultStore
     intermediate_steps: List[str]
-    metadata: List[dict]
+    metadata: Optional[PayloadRef]  # Database metadata, kept in the payload store
+    subgraph_timings: Annotated[dict, merge_dicts]  # Seconds spent in each subgraph this run
+    loop_counts: Annotated[dict, merge_dicts]  # Visits and output repeats of each node this run
@@ -0,0 +1,159 @@
+"""
+Durable queue of feedback for LangSmith.
+
+The /feedback endpoint only appends the feedback to a local SQLite file, so it returns
+without waiting for LangSmith and no feedback is lost while LangSmith is unreachable or the
+service restarts. A background task sends the queued feedback in batches with one reused
+client, retrying failed entries with exponential backoff. When more than max_pending entries
+are queued the endpoint refuses new feedback instead of growing the file without bound.
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import List, Optional, Tuple
+
+from utilities.config import load_config
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class QueueFull(Exception):
+    """Raised when the queue holds max_pending entries that have not been sent yet."""
+
+
+class FeedbackQueueConfig:
+    """Settings of the [feedback] section of config.ini."""
+
+    def __init__(self, config=None):
+        config = config if config is not None else load_config()
+        self.path = config.get("feedback", "path", fallback="temp/feedback_queue.db")
+        self.batch_size = config.getint("feedback", "batch_size", fallback=50)
+        self.flush_seconds = config.getfloat("feedback", "flush_seconds", fallback=2)
+        self.max_pending = config.getint("feedback", "max_pending", fallback=10000)
+        self.max_attempts = config.getint("feedback", "max_attempts", fallback=8)
+        self.max_backoff_seconds = config.getfloat("feedback", "max_backoff_seconds", fallback=600)
+
+
+class FeedbackQueue:
+    """Feedback entries in a SQLite file, kept until LangSmith has accepted them."""
+
+    def __init__(self, config: FeedbackQueueConfig = None, client=None):
+        self.config = config or FeedbackQueueConfig()
+        self.client = client
+        self.lock = threading.Lock()
+        # Relative paths are relative to src, whatever the working directory of the service
+        path = os.path.join(SRC_DIR, self.config.path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        # WAL with normal sync keeps an append to a fraction of a millisecond and survives a crash of the process
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS feedback ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, payload TEXT NOT NULL, created_at REAL NOT NULL, "
+            "attempts INTEGER NOT NULL DEFAULT 0, next_attempt_at REAL NOT NULL DEFAULT 0, last_error TEXT)"
+        )
+        self.pending = self.conn.execute(
+            "SELECT COUNT(*) FROM feedback WHERE attempts < ?", (self.config.max_attempts,)
+        ).fetchone()[0]
+        self.wakeup = asyncio.Event()
+
+    def put(self, run_id: str, key: str, score=None, **kwargs):
+        """Appends feedback to the queue. Raises QueueFull when the backlog is at its limit."""
+        payload = json.dumps({"run_id": str(run_id), "key": key, "score": score, "kwargs": kwargs}, default=str)
+        with self.lock:
+            if self.pending >= self.config.max_pending:
+                raise QueueFull(f"{self.pending} feedback entries are waiting to be sent")
+            self.conn.execute("INSERT INTO feedback (payload, created_at) VALUES (?, ?)", (payload, time.time()))
+            self.pending += 1
+        if self.pending >= self.config.batch_size:
+            self.wakeup.set()
+
+    def _due(self) -> List[Tuple[int, dict, int]]:
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT id, payload, attempts FROM feedback WHERE attempts < ? AND next_attempt_at <= ? "
+                "ORDER BY id LIMIT ?",
+                (self.config.max_attempts, time.time(), self.config.batch_size),
+            ).fetchall()
+        return [(row_id, json.loads(payload), attempts) for row_id, payload, attempts in rows]
+
+    def _get_client(self):
+        if self.client is None:
+            from langsmith import Client as LangsmithClient
+            self.client = LangsmithClient()
+        return self.client
+
+    def flush_batch(self) -> int:
+        """
+        Sends one batch of due feedback. Entries LangSmith accepted are deleted; failed ones
+        are retried with exponential backoff and kept, marked failed, after max_attempts.
+        Returns the number of entries sent.
+        """
+        batch = self._due()
+        if not batch:
+            return 0
+        client = self._get_client()
+        sent, failed = [], []
+        for row_id, entry, attempts in batch:
+            try:
+                client.create_feedback(run_id=entry["run_id"], key=entry["key"], score=entry["score"],
+                                       **entry["kwargs"])
+                sent.append((row_id,))
+            except Exception as e:
+                backoff = min(self.config.max_backoff_seconds, 2.0 ** attempts)
+                failed.append((time.time() + backoff, str(e)[:500], row_id))
+        with self.lock:
+            self.conn.execute("BEGIN")
+            self.conn.executemany("DELETE FROM feedback WHERE id = ?", sent)
+            self.conn.executemany(
+                "UPDATE feedback SET attempts = attempts + 1, next_attempt_at = ?, last_error = ? WHERE id = ?",
+                failed,
+            )
+            self.conn.execute("COMMIT")
+            self.pending = self.conn.execute(
+                "SELECT COUNT(*) FROM feedback WHERE attempts < ?", (self.config.max_attempts,)
+            ).fetchone()[0]
+        if failed:
+            print(f"Sending feedback failed for {len(failed)} of {len(batch)} entries: {failed[0][1]}")
+        return len(sent)
+
+    async def run(self):
+        """Flushes the queue until cancelled, every flush_seconds or as soon as a batch is full."""
+        while True:
+            try:
+                # A full batch is sent right away; the next one waits unless it is already full too
+                while await asyncio.to_thread(self.flush_batch) >= self.config.batch_size:
+                    pass
+            except Exception as e:
+                print(f"Error flushing feedback: {e}")
+            self.wakeup.clear()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=self.config.flush_seconds)
+            except asyncio.TimeoutError:
+                pass
+
+    def stats(self) -> dict:
+        with self.lock:
+            failed = self.conn.execute(
+                "SELECT COUNT(*) FROM feedback WHERE attempts >= ?", (self.config.max_attempts,)
+            ).fetchone()[0]
+        return {"pending": self.pending, "failed": failed}
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+_queue: Optional[FeedbackQueue] = None
+
+
+def get_feedback_queue() -> FeedbackQueue:
+    """Returns the service's feedback queue, opening its file on first use."""
+    global _queue
+    if _queue is None:
+        _queue = FeedbackQueue()
+    return _queue
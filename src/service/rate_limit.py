@@ -0,0 +1,242 @@
+"""
+Per-user rate limits and quotas for the service.
+
+Each caller (the authenticated bearer token, else the client address, and within it the
+X-User-Id header) has token buckets for requests per minute, LLM tokens per hour and
+database seconds per hour, plus a cap on concurrent graph runs. The requests of all the
+users of a token or address also share one bucket, so changing X-User-Id does not get a
+client more requests. Requests are admitted while the
+request bucket has a token and the usage buckets are not in debt; the LLM tokens and
+database time a run used are charged when it finishes, so a heavy run delays the
+caller's next one instead of being cut off midway.
+
+Buckets live in process memory by default. With backend = postgres in the
+[rate_limits] section of config.ini they are shared by every service instance
+through two tables in the application database, read through the shared [db_pool].
+"""
+import hashlib
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional, Tuple
+from uuid import uuid4
+
+from utilities.config import load_config
+
+
+class RateLimitConfig:
+    """Settings of the [rate_limits] section of config.ini."""
+
+    def __init__(self, config=None):
+        config = config if config is not None else load_config()
+        self.enabled = config.getboolean("rate_limits", "enabled", fallback=True)
+        self.backend = config.get("rate_limits", "backend", fallback="memory")
+        self.requests_per_minute = config.getfloat("rate_limits", "requests_per_minute", fallback=30)
+        # Requests of all the X-User-Id users of one token or address together
+        self.token_requests_per_minute = config.getfloat("rate_limits", "token_requests_per_minute", fallback=300)
+        self.llm_tokens_per_hour = config.getfloat("rate_limits", "llm_tokens_per_hour", fallback=200000)
+        self.concurrent_runs = config.getint("rate_limits", "concurrent_runs", fallback=2)
+        self.db_seconds_per_hour = config.getfloat("rate_limits", "db_seconds_per_hour", fallback=600)
+        run_paths = config.get("rate_limits", "run_paths", fallback="/invoke, /stream")
+        self.run_paths = {path.strip() for path in run_paths.split(",") if path.strip()}
+        # Leases of runs whose instance died without releasing them expire after this long
+        self.run_lease_seconds = config.getfloat("rate_limits", "run_lease_seconds", fallback=900)
+
+
+def caller_key(headers, client_host: Optional[str], authenticated: bool) -> str:
+    """
+    Identifies the caller a request is charged to: the bearer token when the service checked
+    it (authenticated), else the client address. X-User-Id, which the client chooses, only
+    names a user within it ("token:<hash>/user:<id>").
+    """
+    auth_header = headers.get("Authorization") or ""
+    if authenticated and auth_header.startswith("Bearer "):
+        key = "token:" + hashlib.sha256(auth_header[7:].encode()).hexdigest()[:16]
+    else:
+        key = f"ip:{client_host or 'unknown'}"
+    if user_id := headers.get("X-User-Id"):
+        key += f"/user:{user_id}"
+    return key
+
+
+def refill(tokens: float, updated_at: float, capacity: float, per_second: float, now: float) -> float:
+    return min(capacity, tokens + (now - updated_at) * per_second)
+
+
+class MemoryBackend:
+    """
+    Token buckets and run leases of this process. A bucket that has refilled to its capacity
+    is the same as no bucket, so such buckets are dropped every sweep_seconds and idle callers
+    take no memory.
+    """
+
+    def __init__(self, sweep_seconds: float = 60):
+        self.lock = threading.Lock()
+        self.buckets = {}  # key -> [tokens, updated_at, full_at]
+        self.leases = {}  # lease id -> (key, expires_at)
+        self.sweep_seconds = sweep_seconds
+        self.swept_at = time.monotonic()
+
+    def _store(self, key: str, tokens: float, capacity: float, per_second: float, now: float):
+        self.buckets[key] = [tokens, now, now + (capacity - tokens) / per_second]
+        if now - self.swept_at >= self.sweep_seconds:
+            self.swept_at = now
+            self.buckets = {key: bucket for key, bucket in self.buckets.items() if bucket[2] > now}
+
+    def take(self, key: str, capacity: float, per_second: float, amount: float) -> float:
+        """Takes amount tokens if the bucket holds them. Returns 0, or the seconds to wait."""
+        with self.lock:
+            now = time.monotonic()
+            tokens, updated_at, _ = self.buckets.get(key, (capacity, now, now))
+            tokens = refill(tokens, updated_at, capacity, per_second, now)
+            if tokens >= amount:
+                self._store(key, tokens - amount, capacity, per_second, now)
+                return 0.0
+            self._store(key, tokens, capacity, per_second, now)
+            return (amount - tokens) / per_second
+
+    def charge(self, key: str, capacity: float, per_second: float, amount: float):
+        """Takes amount tokens unconditionally; the bucket may go into debt of up to its capacity."""
+        with self.lock:
+            now = time.monotonic()
+            tokens, updated_at, _ = self.buckets.get(key, (capacity, now, now))
+            tokens = refill(tokens, updated_at, capacity, per_second, now)
+            self._store(key, max(-capacity, tokens - amount), capacity, per_second, now)
+
+    def acquire(self, key: str, limit: int, lease_seconds: float) -> Optional[str]:
+        """Returns a lease id if the key has fewer than limit active runs, else None."""
+        with self.lock:
+            now = time.monotonic()
+            self.leases = {lease: value for lease, value in self.leases.items() if value[1] > now}
+            if sum(1 for lease_key, _ in self.leases.values() if lease_key == key) >= limit:
+                return None
+            lease_id = str(uuid4())
+            self.leases[lease_id] = (key, now + lease_seconds)
+            return lease_id
+
+    def release(self, lease_id: str):
+        with self.lock:
+            self.leases.pop(lease_id, None)
+
+
+class PostgresBackend:
+    """Token buckets and run leases shared by all service instances through Postgres."""
+
+    def __init__(self):
+        with self._cursor() as cursor:
+            cursor.execute(
+                "CREATE TABLE IF NOT EXISTS rate_limit_buckets ("
+                "key TEXT PRIMARY KEY, tokens DOUBLE PRECISION NOT NULL, updated_at DOUBLE PRECISION NOT NULL)"
+            )
+            cursor.execute(
+                "CREATE TABLE IF NOT EXISTS rate_limit_leases ("
+                "lease_id TEXT PRIMARY KEY, key TEXT NOT NULL, expires_at DOUBLE PRECISION NOT NULL)"
+            )
+
+    @contextmanager
+    def _cursor(self):
+        """Yields a cursor of a connection of the shared pool and commits its transaction when the block succeeds."""
+        from utilities.db import pooled_connection
+        with pooled_connection() as conn:
+            cursor = conn.cursor()
+            try:
+                yield cursor
+                conn.commit()
+            finally:
+                cursor.close()
+
+    def _update(self, key: str, capacity: float, per_second: float, amount: float, force: bool) -> float:
+        with self._cursor() as cursor:
+            now = time.time()
+            cursor.execute(
+                "INSERT INTO rate_limit_buckets (key, tokens, updated_at) VALUES (%s, %s, %s) "
+                "ON CONFLICT (key) DO NOTHING", (key, capacity, now)
+            )
+            cursor.execute("SELECT tokens, updated_at FROM rate_limit_buckets WHERE key = %s FOR UPDATE", (key,))
+            tokens = refill(*cursor.fetchone(), capacity, per_second, now)
+            wait = 0.0
+            if force:
+                tokens = max(-capacity, tokens - amount)
+            elif tokens >= amount:
+                tokens -= amount
+            else:
+                wait = (amount - tokens) / per_second
+            cursor.execute("UPDATE rate_limit_buckets SET tokens = %s, updated_at = %s WHERE key = %s",
+                           (tokens, now, key))
+            return wait
+
+    def take(self, key: str, capacity: float, per_second: float, amount: float) -> float:
+        return self._update(key, capacity, per_second, amount, force=False)
+
+    def charge(self, key: str, capacity: float, per_second: float, amount: float):
+        self._update(key, capacity, per_second, amount, force=True)
+
+    def acquire(self, key: str, limit: int, lease_seconds: float) -> Optional[str]:
+        with self._cursor() as cursor:
+            now = time.time()
+            # Serializes acquisitions for the key across instances until the transaction ends
+            cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (key,))
+            cursor.execute("DELETE FROM rate_limit_leases WHERE key = %s AND expires_at < %s", (key, now))
+            cursor.execute("SELECT COUNT(*) FROM rate_limit_leases WHERE key = %s", (key,))
+            if cursor.fetchone()[0] >= limit:
+                return None
+            lease_id = str(uuid4())
+            cursor.execute("INSERT INTO rate_limit_leases (lease_id, key, expires_at) VALUES (%s, %s, %s)",
+                           (lease_id, key, now + lease_seconds))
+            return lease_id
+
+    def release(self, lease_id: str):
+        with self._cursor() as cursor:
+            cursor.execute("DELETE FROM rate_limit_leases WHERE lease_id = %s", (lease_id,))
+
+
+class RateLimiter:
+    """Admits or rejects requests and charges finished runs against the caller's quotas."""
+
+    def __init__(self, config: RateLimitConfig = None, backend=None):
+        self.config = config or RateLimitConfig()
+        if backend is None:
+            backend = PostgresBackend() if self.config.backend == "postgres" else MemoryBackend()
+        self.backend = backend
+
+    def admit_request(self, key: str) -> float:
+        """Takes a request token. Returns 0, or the seconds until the caller may retry."""
+        config = self.config
+        if "/" in key:
+            # The token or address the user belongs to
+            wait = self.backend.take(f"{key.split('/', 1)[0]}:requests", config.token_requests_per_minute,
+                                     config.token_requests_per_minute / 60, 1)
+            if wait:
+                return wait
+        return self.backend.take(f"{key}:requests", config.requests_per_minute,
+                                 config.requests_per_minute / 60, 1)
+
+    def admit_run(self, key: str) -> Tuple[Optional[str], float, str]:
+        """
+        Checks the usage quotas and takes a concurrent run slot.
+        Returns (lease id, 0, "") or (None, seconds to wait, the exhausted limit).
+        """
+        config = self.config
+        wait = self.backend.take(f"{key}:llm_tokens", config.llm_tokens_per_hour,
+                                 config.llm_tokens_per_hour / 3600, 0)
+        if wait:
+            return None, wait, "LLM tokens per hour"
+        wait = self.backend.take(f"{key}:db_seconds", config.db_seconds_per_hour,
+                                 config.db_seconds_per_hour / 3600, 0)
+        if wait:
+            return None, wait, "database seconds per hour"
+        lease_id = self.backend.acquire(f"{key}:runs", config.concurrent_runs, config.run_lease_seconds)
+        if lease_id is None:
+            return None, 1.0, "concurrent runs"
+        return lease_id, 0.0, ""
+
+    def finish_run(self, key: str, lease_id: str, llm_tokens: int, db_seconds: float):
+        """Releases the run slot and charges the LLM tokens and database time the run used."""
+        config = self.config
+        self.backend.release(lease_id)
+        if llm_tokens:
+            self.backend.charge(f"{key}:llm_tokens", config.llm_tokens_per_hour,
+                                config.llm_tokens_per_hour / 3600, llm_tokens)
+        if db_seconds:
+            self.backend.charge(f"{key}:db_seconds", config.db_seconds_per_hour,
+                                config.db_seconds_per_hour / 3600, db_seconds)
@@ -1,44 +1,137 @@
 import asyncio
-from contextlib import asynccontextmanager
-import json
+import importlib
+from contextlib import asynccontextmanager, AsyncExitStack
+from contextvars import ContextVar
+import math
 import os
-from typing import AsyncGenerator, Dict, Any, Tuple
+import time
+from typing import AsyncGenerator, Dict, Any, Optional, Tuple, TYPE_CHECKING
 from uuid import uuid4
 from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.responses import StreamingResponse
-from langchain_core.callbacks import AsyncCallbackHandler
-from langchain_core.runnables import RunnableConfig
-from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
-from langgraph.graph.graph import CompiledGraph
-from langsmith import Client as LangsmithClient
 
-from agent import research_assistant
 from schema import ChatMessage, Feedback, UserInput, StreamInput
+from feedback_queue import QueueFull, get_feedback_queue
+from rate_limit import MemoryBackend, RateLimitConfig, RateLimiter, caller_key
 
+if TYPE_CHECKING:
+    from langgraph.graph.graph import CompiledGraph
+    from utilities.run_callbacks import UsageCallbackHandler
 
-class TokenQueueStreamingHandler(AsyncCallbackHandler):
-    """LangChain callback handler for streaming LLM tokens to an asyncio queue."""
 
-    def __init__(self, queue: asyncio.Queue):
-        self.queue = queue
+async def load_agent(stack: AsyncExitStack):
+    """Imports the agent and opens its checkpointer. Runs after startup so the port opens immediately."""
+    # The LangChain/LangGraph imports are the bulk of the startup time, so they run in a thread
+    await asyncio.to_thread(importlib.import_module, "utilities.state_backend")
+    await asyncio.to_thread(importlib.import_module, "agent")
+    from utilities.state_backend import open_async_checkpointer
+    from agent import research_assistant
 
-    async def on_llm_new_token(self, token: str, **kwargs) -> None:
-        if token:
-            await self.queue.put(token)
+    # Construct agent with the checkpointer of the [state_backend], shared by all replicas unless it is memory
+    saver = await open_async_checkpointer(stack)
+    research_assistant.checkpointer = saver
+    return research_assistant
+
+
+async def get_agent() -> "CompiledGraph":
+    """Returns the agent, waiting for it to finish loading on the first requests after startup."""
+    return await app.state.agent_loader
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Construct agent with Sqlite checkpointer
-    async with AsyncSqliteSaver.from_conn_string("checkpoints.db") as saver:
-        research_assistant.checkpointer = saver
-        app.state.agent = research_assistant
+    async with AsyncExitStack() as stack:
+        app.state.agent_loader = asyncio.create_task(load_agent(stack))
+        feedback_queue = get_feedback_queue()
+        feedback_flusher = asyncio.create_task(feedback_queue.run())
         yield
-    # context manager will clean up the AsyncSqliteSaver on exit
+        app.state.agent_loader.cancel()
+        # Unsent feedback stays in the queue file and is sent after the next start
+        feedback_flusher.cancel()
+    # the exit stack will clean up the checkpointer on exit
 
 
 app = FastAPI(lifespan=lifespan)
 
+# LLM usage of the run handling the current request, charged to the caller's quota when it ends
+run_usage: ContextVar[Optional["UsageCallbackHandler"]] = ContextVar("run_usage", default=None)
+_rate_limiter = None
+
+
+async def get_rate_limiter() -> Optional[RateLimiter]:
+    """Returns the service's rate limiter, or None when rate limits are disabled."""
+    global _rate_limiter
+    if _rate_limiter is None:
+        config = RateLimitConfig()
+        if not config.enabled:
+            return None
+        # The shared backend connects to Postgres, which must not block the event loop
+        _rate_limiter = await asyncio.to_thread(RateLimiter, config)
+    return _rate_limiter
+
+
+async def call_limiter(limiter: RateLimiter, method, *args):
+    """Calls a limiter method, in a thread when its backend does blocking I/O."""
+    if isinstance(limiter.backend, MemoryBackend):
+        return method(*args)
+    return await asyncio.to_thread(method, *args)
+
+
+def too_many_requests(wait: float, limit: str) -> Response:
+    return Response(status_code=429, content=f"Rate limit exceeded: {limit}",
+                    headers={"Retry-After": str(max(1, math.ceil(wait)))})
+
+
+# Registered before the auth check so that it runs after it (the last registered middleware runs first)
+@app.middleware("http")
+async def enforce_rate_limits(request: Request, call_next):
+    limiter = await get_rate_limiter()
+    if limiter is None:
+        return await call_next(request)
+    # The token is only trusted when check_auth_header verified it
+    key = caller_key(request.headers, request.client.host if request.client else None,
+                     authenticated=bool(os.getenv("AUTH_SECRET")))
+    if wait := await call_limiter(limiter, limiter.admit_request, key):
+        return too_many_requests(wait, "requests per minute")
+    if request.url.path not in limiter.config.run_paths:
+        return await call_next(request)
+
+    lease_id, wait, limit = await call_limiter(limiter, limiter.admit_run, key)
+    if lease_id is None:
+        return too_many_requests(wait, limit)
+
+    from utilities.db import meter_db_time
+    from utilities.run_callbacks import UsageCallbackHandler
+    usage = UsageCallbackHandler()
+
+    async def finish_run():
+        totals = usage.totals()
+        await call_limiter(limiter, limiter.finish_run, key, lease_id,
+                           totals["input_tokens"] + totals["output_tokens"], db_meter.seconds)
+
+    token = run_usage.set(usage)
+    try:
+        with meter_db_time() as db_meter:
+            response = await call_next(request)
+    except BaseException:
+        await finish_run()
+        raise
+    finally:
+        run_usage.reset(token)
+
+    # A streamed run keeps going after the headers are sent, so it is charged when the body ends
+    body_iterator = response.body_iterator
+
+    async def charged_body():
+        try:
+            async for chunk in body_iterator:
+                yield chunk
+        finally:
+            await finish_run()
+
+    response.body_iterator = charged_body()
+    return response
+
 
 @app.middleware("http")
 async def check_auth_header(request: Request, call_next):
@@ -57,9 +150,10 @@ def _parse_input(user_input: UserInput) -> Tuple[Dict[str, Any], str]:
     input_message = ChatMessage(type="human", content=user_input.message)
     kwargs = dict(
         input={"messages": [input_message.to_langchain()]},
-        config=RunnableConfig(
+        config=dict(
             configurable={"thread_id": thread_id, "model": user_input.model},
             run_id=run_id,
+            callbacks=[usage] if (usage := run_usage.get()) is not None else [],
         ),
     )
     return kwargs, run_id
@@ -73,7 +167,7 @@ async def invoke(user_input: UserInput) -> ChatMessage:
     Use thread_id to persist and continue a multi-turn conversation. run_id kwarg
     is also attached to messages for recording feedback.
     """
-    agent: CompiledGraph = app.state.agent
+    agent = await get_agent()
     kwargs, run_id = _parse_input(user_input)
     try:
         response = await agent.ainvoke(**kwargs)
@@ -84,68 +178,134 @@ async def invoke(user_input: UserInput) -> ChatMessage:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-async def message_generator(user_input: StreamInput) -> AsyncGenerator[str, None]:
+async def message_generator(user_input: StreamInput, request: Optional[Request] = None) -> AsyncGenerator[bytes, None]:
     """
     Generate a stream of messages from the agent.
 
-    This is the workhorse method for the /stream endpoint.
+    This is the workhorse method for the /stream endpoint. Tokens are coalesced into frames
+    bounded by time and size, and the graph run is cancelled when the client disconnects.
     """
-    agent: CompiledGraph = app.state.agent
+    from streaming import (StreamConfig, StreamStats, TokenCoalescer, TokenQueueStreamingHandler,
+                           sse_event, sse_message_event)
+
+    agent = await get_agent()
     kwargs, run_id = _parse_input(user_input)
+    config = StreamConfig()
+    stats = StreamStats(run_id)
 
     # Use an asyncio queue to process both messages and tokens in
     # chronological order, so we can easily yield them to the client.
-    output_queue = asyncio.Queue(maxsize=10)
+    # It is bounded, so a slow client pauses the run instead of the queue growing.
+    output_queue = asyncio.Queue(maxsize=config.queue_size)
     if user_input.stream_tokens:
-        kwargs["config"]["callbacks"] = [TokenQueueStreamingHandler(queue=output_queue)]
+        kwargs["config"]["callbacks"].append(TokenQueueStreamingHandler(queue=output_queue))
 
     # Pass the agent's stream of messages to the queue in a separate task, so
     # we can yield the messages to the client in the main thread.
     async def run_agent_stream():
-        async for s in agent.astream(**kwargs, stream_mode="updates"):
-            await output_queue.put(s)
+        try:
+            async for s in agent.astream(**kwargs, stream_mode="updates"):
+                await output_queue.put(s)
+        except Exception as e:
+            await output_queue.put(e)
         await output_queue.put(None)
 
     stream_task = asyncio.create_task(run_agent_stream())
+    coalescer = TokenCoalescer(config.token_flush_seconds, config.token_flush_chars)
+    last_disconnect_check = time.monotonic()
+    outcome = "failed"
+    try:
+        while True:
+            if request is not None and time.monotonic() - last_disconnect_check >= config.disconnect_check_seconds:
+                last_disconnect_check = time.monotonic()
+                if await request.is_disconnected():
+                    outcome = "disconnected"
+                    return
 
-    # Process the queue and yield messages over the SSE stream.
-    while s := await output_queue.get():
-        if isinstance(s, str):
-            # str is an LLM token
-            yield f"data: {json.dumps({'type': 'token', 'content': s})}\n\n"
-            continue
-
-        # Otherwise, s should be a dict of state updates for each node in the graph.
-        # s could have updates for multiple nodes, so check each for messages.
-        new_messages = []
-        for _, state in s.items():
-            if "messages" in state:
-                new_messages.extend(state["messages"])
-        for message in new_messages:
             try:
-                chat_message = ChatMessage.from_langchain(message)
-                chat_message.run_id = str(run_id)
-            except Exception as e:
-                yield f"data: {json.dumps({'type': 'error', 'content': f'Error parsing message: {e}'})}\n\n"
+                s = output_queue.get_nowait()
+            except asyncio.QueueEmpty:
+                # Wake up when buffered tokens are due or the client should be checked again
+                timeout = coalescer.timeout()
+                if request is not None:
+                    timeout = min(timeout if timeout is not None else math.inf, config.disconnect_check_seconds)
+                try:
+                    s = await asyncio.wait_for(output_queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    s = ""
+            if s is None:
+                break
+
+            if isinstance(s, str):
+                # str is an LLM token; "" means no token arrived before the timeout
+                if s:
+                    coalescer.add(s)
+                    stats.tokens += 1
+                if coalescer.full() or coalescer.timeout() == 0:
+                    frame = coalescer.flush()
+                    stats.sent(frame)
+                    yield frame
                 continue
-            # LangGraph re-sends the input message, which feels weird, so drop it
-            if chat_message.type == "human" and chat_message.content == user_input.message:
+
+            # Buffered tokens go out before the message that follows them
+            if frame := coalescer.flush():
+                stats.sent(frame)
+                yield frame
+
+            if isinstance(s, Exception):
+                frame = sse_event({"type": "error", "content": f"Error running the agent: {s}"})
+                stats.sent(frame)
+                yield frame
                 continue
-            yield f"data: {json.dumps({'type': 'message', 'content': chat_message.dict()})}\n\n"
 
-    await stream_task
-    yield "data: [DONE]\n\n"
+            # Otherwise, s should be a dict of state updates for each node in the graph.
+            # s could have updates for multiple nodes, so check each for messages.
+            new_messages = []
+            for _, state in s.items():
+                if "messages" in state:
+                    new_messages.extend(state["messages"])
+            for message in new_messages:
+                try:
+                    chat_message = ChatMessage.from_langchain(message)
+                    chat_message.run_id = str(run_id)
+                except Exception as e:
+                    frame = sse_event({"type": "error", "content": f"Error parsing message: {e}"})
+                    stats.sent(frame)
+                    yield frame
+                    continue
+                # LangGraph re-sends the input message, which feels weird, so drop it
+                if chat_message.type == "human" and chat_message.content == user_input.message:
+                    continue
+                # pydantic serializes the message to JSON directly, without an intermediate dict
+                frame = sse_message_event(chat_message.model_dump_json())
+                stats.sent(frame)
+                yield frame
+
+        if frame := coalescer.flush():
+            stats.sent(frame)
+            yield frame
+        await stream_task
+        yield b"data: [DONE]\n\n"
+        outcome = "completed"
+    except asyncio.CancelledError:
+        # The response is cancelled when the client disconnects
+        outcome = "disconnected"
+        raise
+    finally:
+        stream_task.cancel()
+        if config.log_stats:
+            print(stats.report(outcome))
 
 
 @app.post("/stream")
-async def stream_agent(user_input: StreamInput):
+async def stream_agent(user_input: StreamInput, request: Request):
     """
     Stream the agent's response to a user input, including intermediate messages and tokens.
 
     Use thread_id to persist and continue a multi-turn conversation. run_id kwarg
     is also attached to all messages for recording feedback.
     """
-    return StreamingResponse(message_generator(user_input), media_type="text/event-stream")
+    return StreamingResponse(message_generator(user_input, request), media_type="text/event-stream")
 
 
 @app.post("/feedback")
@@ -153,16 +313,19 @@ async def feedback(feedback: Feedback):
     """
     Record feedback for a run to LangSmith.
 
-    This is a simple wrapper for the LangSmith create_feedback API, so the
-    credentials can be stored and managed in the service rather than the client.
+    The feedback is queued in a local file and sent to LangSmith in the background, so the
+    credentials can be stored and managed in the service rather than the client and the
+    request does not wait for LangSmith. Responds 503 while the queue is full.
     See: https://api.smith.langchain.com/redoc#tag/feedback/operation/create_feedback_api_v1_feedback_post
     """
-    client = LangsmithClient()
     kwargs = feedback.kwargs or {}
-    client.create_feedback(
-        run_id=feedback.run_id,
-        key=feedback.key,
-        score=feedback.score,
-        **kwargs,
-    )
-    return {"status": "success"}
\ No newline at end of file
+    try:
+        get_feedback_queue().put(
+            run_id=feedback.run_id,
+            key=feedback.key,
+            score=feedback.score,
+            **kwargs,
+        )
+    except QueueFull as e:
+        return Response(status_code=503, content=str(e), headers={"Retry-After": "60"})
+    return {"status": "success"}
@@ -0,0 +1,104 @@
+import asyncio
+import time
+
+import orjson
+from langchain_core.callbacks import AsyncCallbackHandler
+
+from utilities.config import load_config
+
+
+class TokenQueueStreamingHandler(AsyncCallbackHandler):
+    """LangChain callback handler for streaming LLM tokens to an asyncio queue."""
+
+    def __init__(self, queue: asyncio.Queue):
+        self.queue = queue
+
+    async def on_llm_new_token(self, token: str, **kwargs) -> None:
+        if token:
+            await self.queue.put(token)
+
+
+class StreamConfig:
+    """Settings of the [streaming] section of config.ini."""
+
+    def __init__(self, config=None):
+        config = config if config is not None else load_config()
+        self.queue_size = config.getint("streaming", "queue_size", fallback=256)
+        self.token_flush_seconds = config.getfloat("streaming", "token_flush_ms", fallback=50) / 1000
+        self.token_flush_chars = config.getint("streaming", "token_flush_chars", fallback=256)
+        self.disconnect_check_seconds = config.getfloat("streaming", "disconnect_check_seconds", fallback=1)
+        self.log_stats = config.getboolean("streaming", "log_stats", fallback=True)
+
+
+def sse_event(payload) -> bytes:
+    """Encodes a payload as one server-sent event."""
+    return b"data: " + orjson.dumps(payload) + b"\n\n"
+
+
+def sse_message_event(message_json: str) -> bytes:
+    """Encodes a message event around a message already serialized to JSON."""
+    return b'data: {"type":"message","content":' + message_json.encode() + b"}\n\n"
+
+
+class TokenCoalescer:
+    """
+    Buffers LLM tokens and releases them as one frame once the buffer holds flush_chars
+    characters or its first token is flush_seconds old, instead of one event per token.
+    """
+
+    def __init__(self, flush_seconds: float, flush_chars: int):
+        self.flush_seconds = flush_seconds
+        self.flush_chars = flush_chars
+        self.tokens = []
+        self.chars = 0
+        self.started_at = None
+
+    def add(self, token: str):
+        if not self.tokens:
+            self.started_at = time.monotonic()
+        self.tokens.append(token)
+        self.chars += len(token)
+
+    def full(self) -> bool:
+        return self.chars >= self.flush_chars
+
+    def timeout(self) -> float:
+        """Seconds until the buffered tokens are due, or None when the buffer is empty."""
+        if not self.tokens:
+            return None
+        return max(0.0, self.started_at + self.flush_seconds - time.monotonic())
+
+    def flush(self) -> bytes:
+        """Returns the buffered tokens as one token event and empties the buffer; b"" if empty."""
+        if not self.tokens:
+            return b""
+        frame = sse_event({"type": "token", "content": "".join(self.tokens)})
+        self.tokens = []
+        self.chars = 0
+        return frame
+
+
+class StreamStats:
+    """Throughput of one stream: frames, bytes and tokens sent, and the time to the first frame."""
+
+    def __init__(self, run_id):
+        self.run_id = run_id
+        self.started_at = time.monotonic()
+        self.first_frame_at = None
+        self.frames = 0
+        self.bytes = 0
+        self.tokens = 0
+
+    def sent(self, frame: bytes):
+        if self.first_frame_at is None:
+            self.first_frame_at = time.monotonic()
+        self.frames += 1
+        self.bytes += len(frame)
+
+    def report(self, outcome: str) -> str:
+        elapsed = max(time.monotonic() - self.started_at, 1e-6)
+        first = f"{self.first_frame_at - self.started_at:.2f}s" if self.first_frame_at else "-"
+        return (
+            f"Stream {self.run_id} {outcome} after {elapsed:.2f}s: {self.tokens} tokens in {self.frames} frames, "
+            f"{self.bytes} bytes, {self.tokens / elapsed:.1f} tokens/s, first frame {first}"
+        )
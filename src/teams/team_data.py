@@ -8,9 +8,10 @@ from tools.tool_metadata import fetch_metadata_as_json
 import operator
 
 class TeamDataRequirement:
-    def __init__(self, model):
-        self.llm = ChatOpenAI(model=model)
+    def __init__(self, model, node_models=None):
         self.utilities = HelperUtilities()
+        self.llm = self.utilities.get_llm(model)
+        self.node_models = node_models or {}
         self.tools = {
             'placeholder': placeholder_tool,
             'metadata': fetch_metadata_as_json
@@ -24,9 +25,8 @@ class TeamDataRequirement:
             Use the function 'fetch_metadata_as_json' to gather metadata about the database.
             Store the metadata in the 'metadata' list of dictionary, List[dict] for future reference.
             Below is an example of a metadata structure:
-            {{
             [
-                {
+                {{
                     "schema_name": "public",
                     "table_name": "employees",
                     "column_name": "employee_id",
@@ -34,8 +34,8 @@ class TeamDataRequirement:
                     "column_description": "Unique identifier for employees",
                     "constraint_name": "employees_pkey",
                     "constraint_type": "PRIMARY KEY"
-                },
-                {
+                }},
+                {{
                     "schema_name": "public",
                     "table_name": "employees",
                     "column_name": "first_name",
@@ -43,9 +43,8 @@ class TeamDataRequirement:
                     "column_description": "First name of the employee",
                     "constraint_name": None,
                     "constraint_type": None
-                }
+                }}
             ]
-            }}
 
             Here is the chat history, use it to gather the data requirements:
             {chat_history}
@@ -73,7 +72,7 @@ class TeamDataRequirement:
         )
 
         data_gather_information_agent = self.utilities.create_agent(
-            self.llm,
+            self.utilities.llm_for(self.node_models, "data_gather_information", self.llm),
             [self.tools['metadata']],
             system_prompt_template
         )
@@ -119,7 +118,7 @@ class TeamDataRequirement:
         )
 
         data_gather_supervisor = self.utilities.create_team_supervisor(
-            self.llm,
+            self.utilities.llm_for(self.node_models, "data_gather_supervisor", self.llm),
             system_prompt_template,
             members
         )
@@ -8,9 +8,10 @@ from tools.tool_metadata import fetch_metadata_as_json
 import operator
 
 class TeamPromptGenerator:
-    def __init__(self, model):
-        self.llm = ChatOpenAI(model=model)
+    def __init__(self, model, node_models=None):
         self.utilities = HelperUtilities()
+        self.llm = self.utilities.get_llm(model)
+        self.node_models = node_models or {}
         self.tools = {
             'placeholder': placeholder_tool,
             'metadata': fetch_metadata_as_json
@@ -42,14 +43,14 @@ class TeamPromptGenerator:
         )
 
         prompt_generator_agent = self.utilities.create_agent(
-            self.llm,
+            self.utilities.llm_for(self.node_models, "data_prompt_generator", self.llm),
             [self.tools['placeholder']],
             system_prompt_template
         )
         return functools.partial(
             self.utilities.agent_node,
             agent=prompt_generator_agent,
-            name="prompt_generator"
+            name="data_prompt_generator"
         )
 
 
@@ -65,7 +66,7 @@ class TeamPromptGenerator:
             """
         )
         prompt_human_proxy_agent = self.utilities.create_agent(
-            self.llm,
+            self.utilities.llm_for(self.node_models, "prompt_human_proxy", self.llm),
             [self.tools['placeholder']],
             system_prompt_template
         )
@@ -95,7 +96,7 @@ class TeamPromptGenerator:
         )
 
         data_prompt_supervisor = self.utilities.create_team_supervisor(
-            self.llm,
+            self.utilities.llm_for(self.node_models, "data_prompt_supervisor", self.llm),
             system_prompt_template,
             members
         )
@@ -1,12 +1,23 @@
+import contextvars
 import functools
-from typing import List, TypedDict, Annotated
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, TypedDict, Annotated
 from langchain.schema import BaseMessage
 from langchain_openai import ChatOpenAI
 from utilities.helper import HelperUtilities
+from utilities.loop_control import record_visit
 from tools.tool_empty import placeholder_tool
-from tools.tool_metadata import fetch_metadata_as_json
+from tools.tool_metadata import fetch_metadata, fetch_metadata_as_json
 from tools.tool_sql import execute_sql_query
+from utilities.result_profile import profile_run
+from utilities.run_context import RunCancelled, current_run
+from utilities.schema_graph import get_schema_graph
+from utilities.speculation import SPECULATION_CONFIG, clearly_specified, speculation_mismatch
+from utilities.value_index import get_value_index
+import json
 import operator
+import time
 
 class SQLTeamState(TypedDict):
     messages: Annotated[List[BaseMessage], operator.add]
@@ -14,17 +25,26 @@ class SQLTeamState(TypedDict):
     next: str
 
 class SQLTeam:
-    def __init__(self, model):
-        self.llm = ChatOpenAI(model=model)
+    def __init__(self, model, node_models=None):
         self.utilities = HelperUtilities()
+        self.llm = self.utilities.get_llm(model)
+        self.node_models = node_models or {}
         self.tools = {
             'sql': execute_sql_query,
             'placeholder': placeholder_tool
         }
+        self._sql_generation_executor = None
+        # Speculative SQL generation (see start_speculation), by run id
+        self.speculation_pool = ThreadPoolExecutor(max_workers=SPECULATION_CONFIG.workers,
+                                                   thread_name_prefix="speculation")
+        self.speculations = {}
+        self.speculations_lock = threading.Lock()
+
+    def sql_generation_executor(self):
+        """Returns the agent executor that generates SQL, shared by sql_generation and the speculation."""
+        if self._sql_generation_executor is not None:
+            return self._sql_generation_executor
 
-    def sql_generation_agent(self):
-        """Creates an agent that generates a PostgreSQL query based on user input and metadata."""
-        
         system_prompt_template = (
             """
             Your task is to create PostgreSQL queries based on the user's request and the metadata of the database. 
@@ -32,6 +52,9 @@ class SQLTeam:
             Based on the following generated prompt and the metadata, generate the appropriate SQL query:
 
             {generated_prompt}
+
+            Relevant tables, the join paths between them and the stored values matching the filters:
+            {schema_hint}
             
             Use your 'metadata' tool to gather metadata of the database and generate PostgreSQL queries that meet the user's requirements.
             Ensure the SQL code aligns with the PostgreSQL database schema and the user’s intent.
@@ -47,16 +70,127 @@ class SQLTeam:
             """
         )
 
-        sql_generation_agent = self.utilities.create_agent(
-            self.llm,
+        self._sql_generation_executor = self.utilities.create_agent(
+            self.utilities.llm_for(self.node_models, "sql_generation", self.llm),
             [self.tools['placeholder']],
             system_prompt_template
         )
-        return functools.partial(
-            self.utilities.agent_node,
-            agent=sql_generation_agent,
-            name="sql_generation"
-        )
+        return self._sql_generation_executor
+
+    def sql_generation_agent(self):
+        """Creates an agent that generates a PostgreSQL query based on user input and metadata."""
+        sql_generation_agent = self.sql_generation_executor()
+
+        def sql_generation_node(state, callback=None):
+            context = self.schema_context(state)
+            # The hint is only part of the agent's input, not of the graph state
+            state = {**state, "schema_hint": context["hint"]}
+            run = current_run()
+            speculative = self.join_speculation(run.run_id) if run is not None else None
+            if speculative:
+                reason = speculation_mismatch(speculative, state, context)
+                if reason is None:
+                    print("Committing the speculatively generated SQL")
+                    output = speculative["output"]
+                    update = {
+                        "messages": [self.utilities.compact_message(output, "sql_generation")],
+                        "sql_query": speculative["sql_query"],
+                        **record_visit(state, "sql_generation", output),
+                    }
+                    if callback:
+                        callback({**state, **update})
+                    return update
+                print(f"Discarding the speculatively generated SQL: {reason}")
+            return self.utilities.agent_node(state, agent=sql_generation_agent,
+                                             name="sql_generation", callback=callback)
+        return sql_generation_node
+
+    def start_speculation(self, state, run_id: str, config: dict):
+        """
+        Starts generating SQL straight from a clearly specified question, in a thread of its own
+        so that it overlaps the data and prompt subgraphs. The first sql_generation of the run
+        joins it and uses its SQL when the generated prompt agrees with it, which takes an LLM
+        call off the critical path. config holds the run's callbacks.
+        """
+        # The thread runs in a copy of the current context, so it sees the run's handle
+        future = self.speculation_pool.submit(contextvars.copy_context().run, self.speculate, state, config)
+        with self.speculations_lock:
+            self.speculations[run_id] = future
+
+    def join_speculation(self, run_id: str) -> Optional[dict]:
+        """Waits for the speculation of a run, if any, and returns it."""
+        with self.speculations_lock:
+            future = self.speculations.pop(run_id, None)
+        return future.result() if future is not None else None
+
+    def discard_speculation(self, run_id: str):
+        """Forgets the speculation of a run that ended without joining it."""
+        with self.speculations_lock:
+            future = self.speculations.pop(run_id, None)
+        if future is not None:
+            future.cancel()
+
+    def speculate(self, state, config: dict) -> Optional[dict]:
+        """Generates SQL from the raw question; returns None when the question is not clear enough."""
+        question = state.get("question") or ""
+        try:
+            tables = get_schema_graph(fetch_metadata()).relevant_tables(question)
+        except Exception as e:
+            print(f"Error recognizing tables: {e}")
+            tables = []
+        if not clearly_specified(question, tables):
+            return None
+
+        start = time.perf_counter()
+        # The raw question stands in for the prompt the prompt team has yet to generate
+        state = {**state, "generated_prompt": question, "data_requirements": {}}
+        context = self.schema_context(state)
+        try:
+            # The executor is invoked directly: agent_node would add messages and take the run's payloads
+            output = self.sql_generation_executor().invoke(
+                {**self.utilities.agent_input(state, "sql_generation"), "schema_hint": context["hint"]},
+                config,
+            )["output"]
+            sql_query = json.loads(output).get("sql_query", "")
+        except RunCancelled:
+            raise
+        except Exception as e:
+            # Speculation never fails the run; sql_generation runs as usual
+            print(f"Speculative SQL generation failed: {e}")
+            return None
+        print(f"speculative_sql_generation took {time.perf_counter() - start:.2f}s")
+        return {"question": question, "context": context, "output": output, "sql_query": sql_query}
+
+    def schema_context(self, state) -> dict:
+        """
+        Returns the tables and joins relevant to the question, the stored values matching its
+        filters and the hint describing them for the SQL generation prompt.
+        """
+        text = " ".join([
+            state.get("question") or "",
+            state.get("generated_prompt") or "",
+            json.dumps(state.get("data_requirements") or {}),
+        ])
+        context = {"tables": [], "joins": [], "values": [], "hint": ""}
+        try:
+            graph = get_schema_graph(fetch_metadata())
+            context["tables"], context["joins"] = graph.relevant_joins(text)
+            context["hint"] = graph.describe(context["tables"], context["joins"])
+        except Exception as e:
+            print(f"Error building schema hint: {e}")
+
+        # Map the user's filter literals to the values actually stored in the database
+        value_index = get_value_index(fetch_metadata)
+        if value_index is not None:
+            requirements = state.get("data_requirements") or {}
+            filters = requirements.get("filters_criteria") if isinstance(requirements, dict) else None
+            # Fuzzy matches are only looked for in the tables the question is about
+            context["values"] = value_index.resolve(str(filters or state.get("question") or ""),
+                                                    tables=set(context["tables"]) or None)
+            if context["values"]:
+                context["hint"] += "\nFilter values:\n" + "\n".join(f"- {value}" for value in context["values"])
+        context["hint"] = context["hint"].strip() or "No tables recognized; use the metadata."
+        return context
 
     def sql_execution_agent(self):
         """Creates an agent that executes a PostgreSQL query."""
@@ -73,7 +207,7 @@ class SQLTeam:
         )
 
         sql_execution_agent = self.utilities.create_agent(
-            self.llm,
+            self.utilities.llm_for(self.node_models, "sql_execution", self.llm),
             [self.tools['sql']],
             system_prompt_template
         )
@@ -91,19 +225,36 @@ class SQLTeam:
             Provide a concise summary that captures the key points of the data, including any notable trends, counts, or statistics.
             Ensure the summary is easy to understand and highlights the most relevant information for the user.
             Focus on PostgreSQL-specific data types and formatting when summarizing the results.
+
+            The following profile was computed from the complete result. Base counts, totals, trends
+            and outliers on it rather than on the preview rows in the messages:
+            {result_profile}
             """
         )
         
         sql_result_formatting_agent = self.utilities.create_agent(
-            self.llm,
+            self.utilities.llm_for(self.node_models, "sql_result_formatting", self.llm),
             [self.tools['placeholder']],
             system_prompt_template
         )
-        return functools.partial(
-            self.utilities.agent_node,
-            agent=sql_result_formatting_agent,
-            name="sql_result_formatting"
-        )
+
+        def sql_result_formatting_node(state, callback=None):
+            # The profile is only part of the agent's input, not of the graph state
+            state = {**state, "result_profile": self.result_profile(state)}
+            return self.utilities.agent_node(state, agent=sql_result_formatting_agent,
+                                             name="sql_result_formatting", callback=callback)
+        return sql_result_formatting_node
+
+    def result_profile(self, state) -> str:
+        """Profiles the full stored query result locally, so formatting cost does not grow with the row count."""
+        ref = state.get("execution_results")
+        profile = None
+        if ref is not None and ref.kind == "result":
+            try:
+                profile = profile_run(ref.handle)
+            except Exception as e:
+                print(f"Error profiling query result: {e}")
+        return profile or "No stored query result; use the messages."
 
     def sql_supervisor(self, members: List[str]):
         """Creates a supervisor agent that manages the PostgreSQL query execution workflow."""
@@ -134,7 +285,7 @@ class SQLTeam:
             return system_prompt_template
 
         sql_supervisor = self.utilities.create_team_supervisor(
-            self.llm,
+            self.utilities.llm_for(self.node_models, "sql_supervisor", self.llm),
             system_prompt_template,
             members
         )
@@ -0,0 +1,11 @@
+from utilities.cache import normalize_sql
+
+
+def test_normalize_sql_collapses_whitespace_outside_quotes():
+    assert normalize_sql("SELECT *\n  FROM t -- note\n WHERE a = 1;") == "SELECT * FROM t WHERE a = 1"
+
+
+def test_normalize_sql_keeps_literals():
+    assert normalize_sql("SELECT * FROM t WHERE city = 'New  York'") != \
+        normalize_sql("SELECT * FROM t WHERE city = 'New York'")
+    assert normalize_sql('SELECT "first  name" FROM t') == 'SELECT "first  name" FROM t'
@@ -0,0 +1,41 @@
+import threading
+import time
+
+import pytest
+
+from utilities.job_queue import CANCELLED, DONE, JobQueue, JobStore, QueueFullError
+from utilities.state_backend import SqliteStateStore
+
+
+def wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def gate():
+    gate = threading.Event()
+    yield gate
+    gate.set()
+
+
+@pytest.mark.parametrize("with_store", [False, True])
+def test_resubmit_after_cancel_is_queued(gate, tmp_path, with_store):
+    """A user re-asking while their run is stopping gets the new job queued, not rejected."""
+    store = JobStore(SqliteStateStore(str(tmp_path / "state.db"))) if with_store else None
+    # A blocking call that ignores cancellation, like an LLM request in flight
+    queue = JobQueue(lambda job: gate.wait() and "ok", workers=1, max_per_user=1, store=store)
+    first = queue.submit("user", {})
+    wait_for(lambda: first.started_at is not None)
+
+    assert queue.cancel_user_jobs("user") == 1
+    second = queue.submit("user", {})
+    assert first.cancel_requested and second.status != CANCELLED
+    with pytest.raises(QueueFullError):
+        queue.submit("user", {})
+
+    gate.set()
+    wait_for(lambda: second.finished)
+    assert first.status == CANCELLED and second.status == DONE
@@ -0,0 +1,18 @@
+from service.rate_limit import MemoryBackend, RateLimitConfig, RateLimiter, caller_key
+
+
+def test_caller_key_scopes_the_user_to_the_authenticated_token():
+    headers = {"Authorization": "Bearer secret", "X-User-Id": "alice"}
+    key = caller_key(headers, "10.0.0.1", authenticated=True)
+    assert key.startswith("token:") and key.endswith("/user:alice")
+    assert caller_key(headers, "10.0.0.1", authenticated=False) == "ip:10.0.0.1/user:alice"
+    assert caller_key({}, None, authenticated=True) == "ip:unknown"
+
+
+def test_changing_the_user_id_does_not_get_more_requests():
+    config = RateLimitConfig()
+    config.requests_per_minute, config.token_requests_per_minute = 2, 3
+    limiter = RateLimiter(config, MemoryBackend())
+    waits = [limiter.admit_request(f"token:abc/user:{i}") for i in range(4)]
+    assert waits[:3] == [0, 0, 0] and waits[3] > 0
+    assert limiter.admit_request("token:other/user:0") == 0
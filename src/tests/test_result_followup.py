@@ -0,0 +1,44 @@
+import pytest
+
+from utilities.result_followup import parse_followup
+
+COLUMNS = ["account_name", "region", "revenue", "product_category", "account_type"]
+
+
+@pytest.mark.parametrize("text, action, expected", [
+    ("show me the next 50 rows", "page", {"offset": 50, "limit": 50}),
+    ("next 20", "page", {"offset": 50, "limit": 20}),
+    ("more", "page", {"offset": 50, "limit": 50}),
+    ("first 10 rows of that", "page", {"offset": 0, "limit": 10}),
+    ("sort that by revenue descending", "sort", {"sort_by": "revenue", "ascending": False}),
+    ("order the results by region", "sort", {"sort_by": "region", "ascending": True}),
+    ("only region EMEA", "filter", {"filters": {"region": "emea"}}),
+    ("just the rows where account type is 'partner'", "filter", {"filters": {"account_type": "partner"}}),
+    ("total revenue by region in these results", "aggregate", {"column": "revenue", "func": "sum",
+                                                                "group_by": "region"}),
+    ("what is the average revenue of that?", "aggregate", {"column": "revenue", "func": "mean"}),
+    ("show me the raw rows", "raw", {}),
+])
+def test_followups(text, action, expected):
+    followup = parse_followup(text, COLUMNS, offset=0, page_size=50)
+    assert followup is not None and followup.action == action
+    for name, value in expected.items():
+        assert getattr(followup, name) == value
+
+
+@pytest.mark.parametrize("text", [
+    "what is the total revenue for Q3 2023",
+    "tell me more about customer churn",
+    "number of customers in EMEA last year",
+    "what is the highest revenue product category",
+    "where is the biggest customer",
+    "total revenue by region",
+    "top 10 customers by revenue",
+    "show me the next quarter's pipeline",
+    "sort accounts by revenue",
+    "only customers in EMEA",
+    "sort that by churn rate",
+    "average revenue by country in these results",
+])
+def test_new_questions_go_to_the_chain(text):
+    assert parse_followup(text, COLUMNS, offset=0, page_size=50) is None
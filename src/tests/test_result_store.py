@@ -0,0 +1,31 @@
+from utilities.result_store import ResultStore
+
+
+def test_pickled_rows_replace_a_parquet_result(tmp_path):
+    store = ResultStore(str(tmp_path))
+    store.save("run", ["region", "revenue"], [("EMEA", 10.0), ("APAC", 20.0)])
+    # Mixed types cannot be written as parquet, so the raw rows are pickled
+    store.save("run", ["region", "value"], [("EMEA", 1), ("APAC", "n/a")])
+
+    assert not (tmp_path / "run.parquet").exists()
+    reloaded = ResultStore(str(tmp_path)).load("run")
+    assert list(reloaded.columns) == ["region", "value"]
+    assert reloaded["value"].tolist() == [1, "n/a"]
+
+
+def test_results_of_other_replicas_replace_stale_files(tmp_path):
+    shared = {}
+
+    class SharedStore:
+        def set(self, namespace, key, value, ttl_seconds=None):
+            shared[(namespace, key)] = value
+
+        def get(self, namespace, key):
+            return shared.get((namespace, key))
+
+    writer = ResultStore(str(tmp_path / "a"), shared=SharedStore())
+    writer.save("run", ["value"], [(1,), ("n/a",)])
+    reader = ResultStore(str(tmp_path / "b"), shared=SharedStore())
+    (tmp_path / "b" / "run.parquet").write_bytes(b"stale")
+    reader._fetch_shared("run")
+    assert reader.load("run")["value"].tolist() == [1, "n/a"]
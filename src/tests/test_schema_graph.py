@@ -0,0 +1,27 @@
+from utilities.schema_graph import SchemaGraph
+
+
+def column(table, name, constraint=None):
+    return {"schema_name": "public", "table_name": table, "column_name": name, "data_type": "text",
+            "constraint_type": constraint}
+
+
+METADATA = [
+    column("accounts", "account_id", "PRIMARY KEY"), column("accounts", "industry"),
+    column("opportunities", "opportunity_id", "PRIMARY KEY"), column("opportunities", "account_id", "FOREIGN KEY"),
+    column("opportunities", "stage"), column("opportunities", "amount"),
+    column("activities", "activity_id", "PRIMARY KEY"), column("activities", "channel"),
+]
+
+
+def test_relevant_tables_rank_name_mentions_first():
+    graph = SchemaGraph(METADATA)
+    tables = graph.relevant_tables("amount and stage of opportunities by industry and channel")
+    assert tables == ["public.opportunities", "public.accounts", "public.activities"]
+
+
+def test_hint_keeps_the_most_relevant_tables():
+    hint = SchemaGraph(METADATA).hint("amount and stage of opportunities by industry of the account and channel", max_tables=2)
+    assert "- public.opportunities(" in hint and "- public.accounts(" in hint
+    assert "activities" not in hint
+    assert "public.opportunities.account_id = public.accounts.account_id" in hint
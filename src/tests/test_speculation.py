@@ -0,0 +1,57 @@
+import pytest
+
+from benchmarks.run import build_fixture, read_gold
+from utilities.speculation import SPECULATION_CONFIG, speculation_mismatch
+
+JOIN = ("public.opportunities", "account_id", "public.accounts", "account_id")
+
+
+def context(tables, joins=(), values=()):
+    return {"tables": list(tables), "joins": list(joins), "values": list(values), "hint": ""}
+
+
+SPECULATIVE = {
+    "question": "total amount of opportunities per account industry",
+    "sql_query": "SELECT 1",
+    "context": context(["public.opportunities", "public.accounts"], [JOIN],
+                       ['"won" -> public.opportunities.stage = \'Closed Won\'']),
+}
+
+
+@pytest.mark.parametrize("final, reason", [
+    (context(["public.accounts", "public.opportunities"], [JOIN]), None),
+    (context(["public.opportunities"], [], ['"closed won" -> public.opportunities.stage = \'Closed Won\'']), None),
+    (context(["public.opportunities", "public.activities"]), "the generated prompt involves public.activities"),
+    (context(["public.opportunities"], [], ["public.opportunities.stage = 'Prospecting'"]),
+     "the generated prompt filters on public.opportunities.stage = 'Prospecting'"),
+])
+def test_speculation_mismatch_compares_tables_joins_and_values(final, reason):
+    state = {"question": SPECULATIVE["question"], "generated_prompt": SPECULATIVE["question"]}
+    assert speculation_mismatch(SPECULATIVE, state, final) == reason
+
+
+def test_speculative_sql_is_committed(tmp_path, monkeypatch, capsys):
+    """A clearly specified question gets the SQL generated alongside the data and prompt subgraphs."""
+    import teams.team_sql
+    import utilities.result_store
+    from benchmarks.fake_llm import fake_llm_factory
+    from graphs.graph_parent import ParentGraph
+    from utilities.helper import set_llm_factory
+
+    monkeypatch.setenv("db_sqlite_path", build_fixture(str(tmp_path / "crm.db")))
+    monkeypatch.setattr(utilities.result_store, "_store", utilities.result_store.ResultStore(str(tmp_path / "results")))
+    monkeypatch.setattr(teams.team_sql, "get_value_index", lambda load_metadata: None)
+    monkeypatch.setattr(SPECULATION_CONFIG, "enabled", True)
+    gold = read_gold()
+    set_llm_factory(fake_llm_factory(gold))
+    try:
+        graph = ParentGraph("gpt-4-1106-preview")
+        chain = graph.compile_graph()
+        item = next(item for item in gold if item["id"] == "won_amount")
+        state = graph.run_chain(item["question"], chain, [], thread_id="speculation-test")
+    finally:
+        set_llm_factory()
+
+    assert state["sql_query"] == item["sql"]
+    assert "Committing the speculatively generated SQL" in capsys.readouterr().out
+    assert graph.sql_team.speculations == {}
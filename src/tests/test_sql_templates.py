@@ -0,0 +1,94 @@
+import itertools
+from collections import OrderedDict
+from contextlib import nullcontext
+from decimal import Decimal
+
+from utilities.sql_templates import TemplateStats, parameterize
+
+
+def test_literals_become_parameters():
+    template, params = parameterize("SELECT * FROM deals WHERE region = 'EMEA' AND amount > 10.5;")
+    assert template == "SELECT * FROM deals WHERE region = $1 AND amount > $2::numeric"
+    assert params == ["EMEA", Decimal("10.5")]
+
+
+def test_repeated_literals_share_a_parameter():
+    template, params = parameterize(
+        "SELECT date_trunc('month', closed_at), count(*) FROM deals "
+        "WHERE amount > 1 GROUP BY date_trunc('month', closed_at) HAVING count(*) > 1"
+    )
+    assert template == (
+        "SELECT date_trunc($1, closed_at), count(*) FROM deals "
+        "WHERE amount > $2::integer GROUP BY date_trunc($1, closed_at) HAVING count(*) > $2::integer"
+    )
+    assert params == ["month", 1]
+
+
+def test_positions_and_typed_literals_stay_constants():
+    template, params = parameterize("SELECT a, b FROM t WHERE d > now() - INTERVAL '7 days' ORDER BY 2")
+    assert template == "SELECT a, b FROM t WHERE d > now() - INTERVAL '7 days' ORDER BY 2"
+    assert params == []
+
+
+def test_unpreparable_templates_are_bounded():
+    stats = TemplateStats(max_templates=2)
+    for template in ("a", "b", "c"):
+        stats.mark_unpreparable(template)
+    assert not stats.is_unpreparable("a") and stats.is_unpreparable("c")
+    assert stats.stats()["unpreparable"] == 2
+
+
+class FakeCursor:
+    """Cursor of a fake Postgres connection that records the statements it was given."""
+
+    def __init__(self, statements):
+        self.statements = statements
+        self.description = [("amount",)]
+
+    def execute(self, sql, params=None):
+        self.statements.append(sql)
+        self.explained = sql.startswith("EXPLAIN")
+
+    def fetchone(self):
+        return [[{"Plan": {"Plan Rows": 10}}]] if self.explained else None
+
+    def fetchall(self):
+        return [(1,)]
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    closed = 0
+
+    def __init__(self):
+        self.statements = []
+        self.prepared = OrderedDict()
+        self.statement_ids = itertools.count(1)
+
+    def cursor(self):
+        return FakeCursor(self.statements)
+
+    def rollback(self):
+        pass
+
+
+def test_recurring_template_is_planned_once_with_pushdown(monkeypatch):
+    import tools.tool_sql as tool_sql
+
+    conn = FakeConnection()
+    monkeypatch.setattr(tool_sql, "pooled_connection", lambda: nullcontext(conn))
+    monkeypatch.setattr(tool_sql, "is_sqlite", lambda conn: False)
+    monkeypatch.setattr(tool_sql, "low_cardinality_columns", set)
+    monkeypatch.setattr(tool_sql.PUSHDOWN_CONFIG, "enabled", True)
+    for region in ("EMEA", "APAC", "AMER", "LATAM", "EMEA"):
+        tool_sql.run_query(f"SELECT amount FROM planner_count_deals WHERE region = '{region}'")
+
+    # Statements Postgres plans from the literal SQL; EXECUTE and EXPLAIN EXECUTE use the
+    # statement's cached plan
+    literal = [sql for sql in conn.statements
+               if not sql.startswith(("PREPARE", "EXECUTE", "EXPLAIN (FORMAT JSON) EXECUTE"))]
+    assert literal == ["EXPLAIN (FORMAT JSON) SELECT amount FROM planner_count_deals WHERE region = 'EMEA'",
+                       "SELECT amount FROM planner_count_deals WHERE region = 'EMEA'"]
+    assert sum(sql.startswith("PREPARE") for sql in conn.statements) == 1
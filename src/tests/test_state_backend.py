@@ -0,0 +1,29 @@
+import datetime
+from decimal import Decimal
+
+from utilities.job_queue import DONE, Job, JobStore
+from utilities.state_backend import SharedCache, SqliteStateStore, dump_value, load_value
+
+
+def test_cache_values_round_trip_through_json():
+    value = [["region", "revenue"], [["EMEA", Decimal("10.50"), datetime.date(2024, 1, 31)]], None]
+    assert load_value(dump_value(value)) == value
+    assert load_value(dump_value((b"body", "etag"))) == [b"body", "etag"]
+
+
+def test_shared_cache_keeps_values_json_cannot_hold_local(tmp_path):
+    cache = SharedCache(SqliteStateStore(str(tmp_path / "state.db")), "test", ttl_seconds=60)
+    cache.set("key", object)
+    assert cache.get("key") is object
+    assert cache.store.scan(cache.namespace) == []
+
+
+def test_unfinished_jobs_of_a_user(tmp_path):
+    store = JobStore(SqliteStateStore(str(tmp_path / "state.db")))
+    mine, other, done = Job("me", {}), Job("other", {}), Job("me", {})
+    for job in (mine, other, done):
+        store.save(job)
+    done.status = DONE
+    store.save(done)
+    assert [record.id for record in store.unfinished_jobs("me")] == [mine.id]
+    assert store.load(done.id).status == DONE
@@ -0,0 +1,59 @@
+import sqlite3
+from contextlib import contextmanager
+
+from utilities.value_index import ValueIndex
+
+
+def column(table, name):
+    return {"schema_name": "main", "table_name": table, "column_name": name, "data_type": "text"}
+
+
+METADATA = [column("accounts", "country"), column("accounts", "name"), column("deals", "stage")]
+
+
+def make_index(tmp_path, max_values=3):
+    path = str(tmp_path / "crm.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE accounts (country TEXT, name TEXT)")
+    conn.execute("CREATE TABLE deals (stage TEXT)")
+    conn.executemany("INSERT INTO accounts VALUES (?, ?)",
+                     [("Germany", "Acme"), ("France", "Globex"), ("Germany", "Initech"), (None, "Umbrella")])
+    conn.executemany("INSERT INTO deals VALUES (?)", [("Closed Won",), ("Closed Lost",), ("Prospecting",)])
+    conn.commit()
+    conn.close()
+    reads = []
+
+    @contextmanager
+    def connection():
+        conn = sqlite3.connect(path)
+        conn.set_trace_callback(reads.append)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    index = ValueIndex(lambda: METADATA, connection, max_values=max_values, refresh_seconds=0)
+    for _ in range(2 * len(METADATA)):
+        # With a refresh_seconds of 0 the indexed columns are due again right away
+        index.refresh_column(index._next_column())
+    return index, reads
+
+
+def test_columns_over_the_limit_are_skipped_and_not_read_again(tmp_path):
+    index, reads = make_index(tmp_path)
+    assert index.low_cardinality_columns() == {"main.accounts.country", "main.deals.stage"}
+    assert index.stats()["skipped_columns"] == 1
+    assert sum('"name"' in sql for sql in reads) == 1
+
+
+def test_lookup_prefers_exact_and_prefix_matches(tmp_path):
+    index, _ = make_index(tmp_path)
+    assert index.lookup("germany") == [("main.accounts.country", "Germany")]
+    assert index.lookup("closed w") == [("main.deals.stage", "Closed Won")]
+    assert index.lookup("prospectin") == [("main.deals.stage", "Prospecting")]
+
+
+def test_fuzzy_lookup_is_limited_to_the_given_tables(tmp_path):
+    index, _ = make_index(tmp_path)
+    assert index.lookup("germnay") == [("main.accounts.country", "Germany")]
+    assert index.lookup("germnay", tables={"main.deals"}) == []
@@ -1,26 +1,50 @@
 import json
+import time
 from langchain_core.tools import tool
-import psycopg2
-from dotenv import load_dotenv
-import os
+from utilities.cache import get_cache
+from utilities.db import pooled_connection, record_db_time
+from utilities.payload_store import get_payload_store
+from utilities.run_context import publish_payload
 
-load_dotenv()
+def query_metadata() -> list:
+    """Fetches the rows of the metadata_table as a list of dictionaries."""
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        start = time.perf_counter()
+        try:
+            # Fetch metadata from the metadata_table
+            query = """
+            SELECT
+                schema_name,
+                table_name,
+                column_name,
+                data_type,
+                column_description,
+                constraint_name,
+                constraint_type
+            FROM public.metadata_table;
+            """
+            cursor.execute(query)
+            rows = cursor.fetchall()
+
+            # Get column names from cursor description
+            col_names = [desc[0] for desc in cursor.description]
 
-# Retrieve DB credentials from environment variables
-db_host = os.getenv("db_host")
-db_database = os.getenv("db_database")
-db_user = os.getenv("db_user")
-db_password = os.getenv("db_password")
+            # Convert rows to list of dictionaries
+            return [dict(zip(col_names, row)) for row in rows]
+        finally:
+            record_db_time(time.perf_counter() - start)
+            cursor.close()
 
-def get_db_connection():
-    """Establishes and returns a connection to the PostgreSQL database."""
-    conn = psycopg2.connect(
-        host=db_host,
-        database=db_database,
-        user=db_user,
-        password=db_password
-    )
-    return conn
+def fetch_metadata() -> list:
+    """
+    Returns the metadata rows, shared between runs for the [cache] metadata TTL so that
+    concurrent runs (e.g. the questions of a batch) fetch it from the database only once.
+    """
+    cache = get_cache("metadata")
+    if cache is None:
+        return query_metadata()
+    return cache.get_or_compute("metadata_table", query_metadata)
 
 @tool
 def fetch_metadata_as_json():
@@ -28,44 +52,18 @@ def fetch_metadata_as_json():
     Connects to the PostgreSQL database, fetches metadata from the metadata_table,
     and returns it as a JSON string.
 
-    Parameters:
-    - db_config (dict): A dictionary containing database connection parameters:
-        {
-            'dbname': 'your_database_name',
-            'user': 'your_username',
-            'password': 'your_password',
-            'host': 'your_host',
-            'port': 'your_port'  # usually 5432
-        }
-
     Returns:
     - str: A JSON-formatted string containing the metadata.
     """
     try:
-        # Establish a connection to the PostgreSQL database
-        conn = get_db_connection()
-        cursor = conn.cursor()
-
-        # Fetch metadata from the metadata_table
-        query = """
-        SELECT
-            schema_name,
-            table_name,
-            column_name,
-            data_type,
-            column_description,
-            constraint_name,
-            constraint_type
-        FROM public.metadata_table;
-        """
-        cursor.execute(query)
-        rows = cursor.fetchall()
-
-        # Get column names from cursor description
-        col_names = [desc[0] for desc in cursor.description]
+        metadata_list = fetch_metadata()
 
-        # Convert rows to list of dictionaries
-        metadata_list = [dict(zip(col_names, row)) for row in rows]
+        # Keep the metadata in the side store; the graph state only holds a reference
+        tables = {(row["schema_name"], row["table_name"]) for row in metadata_list}
+        publish_payload("metadata", get_payload_store().put(
+            metadata_list, kind="metadata", size=len(metadata_list),
+            preview=f"{len(metadata_list)} columns across {len(tables)} tables"
+        ))
 
         # Serialize the list of dictionaries to a JSON-formatted string
         metadata_json = json.dumps(metadata_list, indent=4)
@@ -75,10 +73,3 @@ def fetch_metadata_as_json():
     except Exception as e:
         print(f"Error fetching metadata: {e}")
         return None
-
-    finally:
-        # Clean up the database connection
-        if cursor:
-            cursor.close()
-        if conn:
-            conn.close()
@@ -1,59 +1,138 @@
-import os
-import pickle
+import time
 import yaml
-from dotenv import load_dotenv
+from contextlib import nullcontext
+from uuid import uuid4
 from langchain_core.tools import tool
-import psycopg2
+from tools.tool_metadata import fetch_metadata
+from utilities.db import is_sqlite, pooled_connection, record_db_time
+from utilities.cache import get_cache, normalize_sql
+from utilities.config import StateConfig
+from utilities.payload_store import PayloadRef
+from utilities.run_context import current_run, publish_payload, RunCancelled
+from utilities.result_store import get_result_store
+from utilities.sql_pushdown import PushdownConfig, run_pushdown
+from utilities.sql_templates import execute_query, prepare_query
+from utilities.tracing import traced
+from utilities.value_index import get_value_index
+STATE_CONFIG = StateConfig()
+PUSHDOWN_CONFIG = PushdownConfig()
 
-load_dotenv()
+def low_cardinality_columns() -> set:
+    """Text columns known to have few distinct values, which the aggregation pushdown groups by."""
+    value_index = get_value_index(fetch_metadata)
+    return value_index.low_cardinality_columns() if value_index is not None else set()
 
-# Retrieve DB credentials from environment variables
-db_host = os.getenv("db_host")
-db_database = os.getenv("db_database")
-db_user = os.getenv("db_user")
-db_password = os.getenv("db_password")
+def run_query(query: str, run=None, pushdown: bool = True):
+    """
+    Runs a query and returns its column names, rows and, when the query was estimated to return
+    more than the [pushdown] row threshold, the details of the aggregation that replaced it.
+    """
+    requested = time.perf_counter()
+    with traced(run, "db.query", attributes={"db.statement": query}) as span, pooled_connection() as conn:
+        cursor = conn.cursor()
+        start = time.perf_counter()
+        span.update({"db.system": "sqlite" if is_sqlite(conn) else "postgresql",
+                     "db.wait_ms": round((start - requested) * 1000, 1)})
+        try:
+            # Cancelling the run sends a cancel request for the running statement to Postgres
+            # (SQLite connections, used for the benchmark fixture, are interrupted instead)
+            scope = run.cancel_scope(getattr(conn, "cancel", None) or conn.interrupt) if run is not None else nullcontext()
+            with scope:
+                # The estimate of the pushdown explains the prepared statement when there is one
+                statement = prepare_query(conn, cursor, query)
+                # SQLite has no row estimates; it only serves the local fixture
+                if pushdown and PUSHDOWN_CONFIG.enabled and not is_sqlite(conn):
+                    with traced(run, "db.pushdown"):
+                        aggregated = run_pushdown(conn, query, low_cardinality_columns(), PUSHDOWN_CONFIG,
+                                                  statement)
+                    if aggregated is not None:
+                        span.update({"db.rows": len(aggregated["rows"]), "db.aggregated": True})
+                        return aggregated["columns"], aggregated["rows"], aggregated
+                    if run is not None:
+                        run.check()
+                execute_query(conn, cursor, query, statement)
+                data = cursor.fetchall()
+            span["db.rows"] = len(data)
+            column_names = [desc[0] for desc in cursor.description]  # Get column names
+            return column_names, data, None
+        finally:
+            record_db_time(time.perf_counter() - start)
+            cursor.close()
 
-def get_db_connection():
-    """Establishes and returns a connection to the PostgreSQL database."""
-    conn = psycopg2.connect(
-        host=db_host,
-        database=db_database,
-        user=db_user,
-        password=db_password
-    )
-    return conn
+def load_raw_result(run_id: str, run=None):
+    """
+    Runs the raw query behind an aggregated result and stores its rows under the run id in place
+    of the aggregate. Returns the rows as a DataFrame, or None if the result was not aggregated.
+    Cancelling run interrupts the query.
+    """
+    store = get_result_store()
+    meta = store.load_meta(run_id)
+    if not meta or not meta.get("aggregated"):
+        return None
+    column_names, data, _ = run_query(meta["query"], run, pushdown=False)
+    df = store.save(run_id, column_names, data)
+    store.save_meta(run_id, {**meta, "aggregated": False})
+    return df
 
 @tool
 def execute_sql_query(query: str) -> str:
-    """Executes the given SQL query on the PostgreSQL database, saves the results as a Pickle file, 
-    and returns the results as a YAML string."""
+    """Executes the given SQL query on the PostgreSQL database, stores the full results under the
+    current run id, and returns the row count and a preview of the rows as a YAML string."""
     
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    run = current_run()
     
     try:
-        cursor.execute(query)
-        data = cursor.fetchall()
-        column_names = [desc[0] for desc in cursor.description]  # Get column names
-        cursor.close()
-        conn.close()
+        # In batch mode identical queries from different questions are executed only once
+        cache = get_cache("sql_results")
+        if cache is not None:
+            column_names, data, aggregated = cache.get_or_compute(normalize_sql(query), lambda: run_query(query, run))
+        else:
+            column_names, data, aggregated = run_query(query, run)
 
-        # Combine column names with data
-        data_with_columns = {
-            "columns": column_names,
-            "data": data
-        }
+        # Store the result so paging/sorting follow-ups can be answered without re-running the query
+        run_id = run.run_id if run is not None else str(uuid4())
+        store = get_result_store()
+        store.save(run_id, column_names, data)
+        store.save_meta(run_id, {"query": query, "aggregated": aggregated is not None})
 
-        # Save data to a Pickle file
-        with open('src/temp/sql_output.pkl', 'wb') as file:
-            pickle.dump(data_with_columns, file)
-        
-        # Convert the data to YAML format for returning as a string
-        yaml_data = yaml.dump(data_with_columns, default_flow_style=False)
-        return yaml_data
+        # Only a preview goes back to the agent and into the graph state
+        preview_rows = STATE_CONFIG.preview_rows
+        if aggregated is None:
+            preview = yaml.dump({
+                "columns": column_names,
+                "row_count": len(data),
+                "data": [list(row) for row in data[:preview_rows]],
+            }, default_flow_style=False, allow_unicode=True)
+            if len(data) > preview_rows:
+                preview += f"# Showing {preview_rows} of {len(data)} rows\n"
+        else:
+            # Only the aggregate and a sample left the database; the raw rows can be loaded with load_raw_result
+            preview = yaml.dump({
+                "aggregated": True,
+                "estimated_raw_rows": aggregated["estimated_rows"],
+                "group_by": aggregated["group_by"],
+                "columns": column_names,
+                "row_count": len(data),
+                "data": [list(row) for row in data[:preview_rows]],
+                "sample_columns": aggregated["sample_columns"],
+                "sample": [list(row) for row in aggregated["sample_rows"][:preview_rows]],
+                **({"totals": aggregated["totals"]} if aggregated["truncated"] else {}),
+            }, default_flow_style=False, allow_unicode=True)
+            preview += (
+                f"# The query was estimated to return {aggregated['estimated_rows']} rows, so it was "
+                "summarized in the database: row_count and the _sum/_min/_max columns aggregate the raw rows\n"
+            )
+            if aggregated["truncated"]:
+                preview += (
+                    f"# Only the {len(data)} largest groups are listed; use totals, not the sum of the groups, "
+                    "for figures over all raw rows\n"
+                )
+        publish_payload("execution_results", PayloadRef(
+            handle=run_id, kind="result", size=len(data), preview=preview
+        ))
+        return preview
     
     except Exception as e:
-        cursor.close()
-        conn.close()
+        if run is not None and run.cancelled.is_set():
+            raise RunCancelled(run.run_id) from e
         return str(e)
-
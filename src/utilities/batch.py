@@ -0,0 +1,145 @@
+"""
+Batch evaluation mode for the SQL chain.
+
+Reads questions from a JSON lines file (one ``{"id": ..., "question": ...}`` object
+per line; ``id`` is optional), runs them through the production graph with bounded
+parallelism and writes one JSON line per question with the answer, the generated
+SQL, the row count and the timings. Questions run on their own conversation
+threads. The metadata fetch is shared by all questions, and identical generated
+SQL is executed once for the whole batch.
+
+Run from the src directory:
+    python -m utilities.batch questions.jsonl --output answers.jsonl [--workers 4] [--model gpt-4o]
+
+The command exits with status 1 when any question fails.
+"""
+import argparse
+import json
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from uuid import uuid4
+
+from utilities.cache import configure_cache, get_cache
+from utilities.loop_control import loop_summary
+from utilities.run_context import RunHandle
+
+DEFAULT_MODEL = "gpt-4-1106-preview"
+
+
+def read_questions(path: str) -> list:
+    """Reads the questions file, numbering questions that have no id."""
+    questions = []
+    with open(path) as file:
+        for line in file:
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            if isinstance(item, str):
+                item = {"question": item}
+            item.setdefault("id", len(questions) + 1)
+            questions.append(item)
+    return questions
+
+
+def answer_question(chain_sql, compiled_chain, item: dict, batch_id: str) -> dict:
+    """Runs one question through the graph and returns its output record."""
+    run_handle = RunHandle()
+    record = {"id": item["id"], "question": item["question"], "run_id": run_handle.run_id}
+    start = time.perf_counter()
+    try:
+        state = chain_sql.run_chain(item["question"], compiled_chain, item.get("conversation_history", []),
+                                    run_handle=run_handle, thread_id=f"{batch_id}-{item['id']}")
+        messages = state.get("messages") or []
+        results = state.get("execution_results")
+        record.update({
+            "status": "ok" if state.get("sql_query") else "no_sql",
+            "answer": messages[-1].content if messages else None,
+            "sql_query": state.get("sql_query") or None,
+            "row_count": results.size if results is not None else None,
+            "subgraph_timings": state.get("subgraph_timings") or {},
+            "node_visits": loop_summary(state),
+        })
+    except Exception as e:
+        record.update({"status": "failed", "error": f"{type(e).__name__}: {e}"})
+    record["seconds"] = round(time.perf_counter() - start, 3)
+    return record
+
+
+def run_batch(questions: list, model: str = DEFAULT_MODEL, workers: int = 4, on_record=None) -> dict:
+    """
+    Answers the questions with at most `workers` graph runs in flight and returns a summary.
+    on_record is called with each output record as soon as its question finishes.
+    """
+    from graphs.chain_cache import get_chain
+
+    chain_sql, compiled_chain = get_chain(model, "parent")
+    # Share query results between the questions of the batch, keeping the interactive setting otherwise
+    previous_sql_cache = get_cache("sql_results")
+    sql_cache = configure_cache("sql_results", ttl_seconds=24 * 3600)
+    batch_id = f"batch-{uuid4()}"
+    records = []
+
+    start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(answer_question, chain_sql, compiled_chain, item, batch_id)
+                for item in questions
+            ]
+            for future in as_completed(futures):
+                record = future.result()
+                records.append(record)
+                print(f"[{len(records)}/{len(questions)}] {record['id']}: {record['status']} in {record['seconds']:.1f}s")
+                if on_record is not None:
+                    on_record(record)
+    finally:
+        configure_cache("sql_results", previous_sql_cache.ttl_seconds if previous_sql_cache else 0)
+    wall = time.perf_counter() - start
+
+    latencies = sorted(record["seconds"] for record in records)
+    metadata_cache = get_cache("metadata")
+    return {
+        "questions": len(records),
+        "ok": sum(record["status"] == "ok" for record in records),
+        "no_sql": sum(record["status"] == "no_sql" for record in records),
+        "failed": sum(record["status"] == "failed" for record in records),
+        "workers": workers,
+        "wall_seconds": round(wall, 3),
+        "questions_per_minute": round(len(records) / wall * 60, 2) if wall > 0 else None,
+        "p50_seconds": statistics.median(latencies) if latencies else None,
+        "p95_seconds": latencies[int(0.95 * (len(latencies) - 1))] if latencies else None,
+        "metadata_cache": metadata_cache.stats() if metadata_cache else None,
+        "sql_cache": sql_cache.stats(),
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Answer a file of questions with the SQL chain.")
+    parser.add_argument("questions", help="JSON lines file with one {\"id\", \"question\"} object per line")
+    parser.add_argument("--output", required=True, help="JSON lines file for the answers")
+    parser.add_argument("--workers", type=int, default=4, help="Maximum number of questions run in parallel")
+    parser.add_argument("--model", default=DEFAULT_MODEL, help="Default model of the graph nodes")
+    args = parser.parse_args(argv)
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    questions = read_questions(args.questions)
+
+    def write_record(record):
+        output.write(json.dumps(record, default=str) + "\n")
+        output.flush()
+
+    with open(args.output, "w") as output:
+        summary = run_batch(questions, model=args.model, workers=args.workers, on_record=write_record)
+
+    print(json.dumps(summary, indent=2))
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,115 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Optional
+
+from utilities.config import load_config
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache with per-entry expiry. get_or_compute is single-flight: concurrent
+    callers asking for the same missing key wait for one computation instead of repeating it.
+    """
+
+    def __init__(self, ttl_seconds: float, max_items: int = 1024):
+        self.ttl_seconds = ttl_seconds
+        self.max_items = max_items
+        self.items = OrderedDict()  # key -> (expires_at, value)
+        self.inflight = {}  # key -> threading.Event set when the computation finishes
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _lookup(self, key) -> Any:
+        """Returns a fresh cached value or _MISSING. Must be called with the lock held."""
+        entry = self.items.get(key)
+        if entry is None:
+            return _MISSING
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self.items[key]
+            return _MISSING
+        self.items.move_to_end(key)
+        return value
+
+    def get(self, key, default=None) -> Any:
+        with self.lock:
+            value = self._lookup(key)
+        return default if value is _MISSING else value
+
+    def set(self, key, value):
+        with self.lock:
+            self.items[key] = (time.monotonic() + self.ttl_seconds, value)
+            self.items.move_to_end(key)
+            while len(self.items) > self.max_items:
+                self.items.popitem(last=False)
+
+    def get_or_compute(self, key, compute: Callable[[], Any]) -> Any:
+        """Returns the cached value for key, computing and caching it once if it is missing."""
+        while True:
+            with self.lock:
+                value = self._lookup(key)
+                if value is not _MISSING:
+                    self.hits += 1
+                    return value
+                waiter = self.inflight.get(key)
+                owner = waiter is None
+                if owner:
+                    waiter = self.inflight[key] = threading.Event()
+                    self.misses += 1
+            if not owner:
+                # Another caller is computing the value; if it fails, one of the waiters retries
+                waiter.wait()
+                continue
+            try:
+                value = compute()
+                self.set(key, value)
+                return value
+            finally:
+                with self.lock:
+                    self.inflight.pop(key).set()
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"items": len(self.items), "hits": self.hits, "misses": self.misses}
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(name: str) -> Optional[TTLCache]:
+    """
+    Returns the named process-wide cache, configured by `<name>_ttl_seconds` in the [cache]
+    section of config.ini. Returns None when the cache is disabled (a TTL of 0). The cache
+    is a SharedCache, with the same interface, when a [state_backend] other than memory is set.
+    """
+    with _caches_lock:
+        if name not in _caches:
+            ttl = load_config().getfloat("cache", f"{name}_ttl_seconds", fallback=0)
+            _caches[name] = None
+            if ttl > 0:
+                # With a shared state backend the entries are shared by every replica
+                from utilities.state_backend import SharedCache, get_state_store
+                store = get_state_store()
+                _caches[name] = SharedCache(store, name, ttl) if store is not None else TTLCache(ttl)
+        return _caches[name]
+
+
+def configure_cache(name: str, ttl_seconds: float) -> Optional[TTLCache]:
+    """Replaces the named cache, e.g. to share SQL results between the questions of a batch."""
+    with _caches_lock:
+        _caches[name] = TTLCache(ttl_seconds) if ttl_seconds > 0 else None
+        return _caches[name]
+
+
+def normalize_sql(query: str) -> str:
+    """
+    Normalizes whitespace and comments outside quotes, and the trailing semicolon, so identical
+    queries share a cache key while queries differing inside a literal do not.
+    """
+    from utilities.sql_templates import normalize_whitespace
+    return normalize_whitespace(query)
@@ -0,0 +1,54 @@
+import configparser
+import os
+
+# The config file lives next to app.py unless overridden through the environment
+CONFIG_PATH = os.getenv(
+    "CRMGPT_CONFIG",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "config.ini")
+)
+
+
+def load_config(path: str = CONFIG_PATH) -> configparser.ConfigParser:
+    """Reads the crmGPT config file. Missing files yield an empty config."""
+    config = configparser.ConfigParser()
+    config.read(path)
+    return config
+
+
+class ModelConfig:
+    """Resolves graph node names to model names using the [model_tiers] and [node_models] sections."""
+
+    def __init__(self, default_model: str, config: configparser.ConfigParser = None):
+        config = config if config is not None else load_config()
+        self.default_model = default_model
+        self.tiers = dict(config["model_tiers"]) if config.has_section("model_tiers") else {}
+        self.node_tiers = dict(config["node_models"]) if config.has_section("node_models") else {}
+
+    def model_for(self, node: str) -> str:
+        """Returns the model name configured for a node, falling back to the default model."""
+        tier = self.node_tiers.get(node, "default")
+        model = self.tiers.get(tier, tier)
+        if model == "default":
+            return self.default_model
+        return model
+
+    def node_models(self) -> dict:
+        """Returns a mapping of every configured node to its model name."""
+        return {node: self.model_for(node) for node in self.node_tiers}
+
+
+class StateConfig:
+    """Limits that keep the graph state and the per-node prompts compact ([state] and [message_window])."""
+
+    def __init__(self, config: configparser.ConfigParser = None):
+        config = config if config is not None else load_config()
+        self.windows = dict(config["message_window"]) if config.has_section("message_window") else {}
+        self.max_message_chars = config.getint("state", "max_message_chars", fallback=4000)
+        self.preview_chars = config.getint("state", "preview_chars", fallback=500)
+        self.preview_rows = config.getint("state", "preview_rows", fallback=20)
+        full_output_nodes = config.get("state", "full_output_nodes", fallback="sql_result_formatting")
+        self.full_output_nodes = {node.strip() for node in full_output_nodes.split(",") if node.strip()}
+
+    def window_for(self, node: str) -> int:
+        """Number of recent messages the node's prompt includes besides the user's question."""
+        return int(self.windows.get(node, self.windows.get("default", 6)))
@@ -0,0 +1,145 @@
+import os
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import lru_cache
+from typing import Optional
+
+
+@lru_cache(maxsize=1)
+def get_db_settings() -> dict:
+    """Loads the .env file once and returns the PostgreSQL connection settings."""
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    # Retrieve DB credentials from environment variables
+    return {
+        "host": os.getenv("db_host"),
+        "database": os.getenv("db_database"),
+        "user": os.getenv("db_user"),
+        "password": os.getenv("db_password"),
+    }
+
+
+def get_db_connection():
+    """
+    Establishes and returns a connection to the PostgreSQL database, or to the SQLite database
+    named by db_sqlite_path (such as the benchmark fixture) when that variable is set.
+    """
+    settings = get_db_settings()
+    sqlite_path = os.getenv("db_sqlite_path")
+    if sqlite_path:
+        return connect_sqlite(sqlite_path)
+
+    import psycopg2
+    return psycopg2.connect(**settings)
+
+
+_pool = None
+_pool_slots = None
+_pool_lock = threading.Lock()
+
+
+def get_db_pool():
+    """
+    Returns the process-wide Postgres connection pool, sized by the [db_pool] section of
+    config.ini, together with a semaphore that makes callers wait for a free connection.
+    """
+    global _pool, _pool_slots
+    with _pool_lock:
+        if _pool is None:
+            from psycopg2.pool import ThreadedConnectionPool
+            from utilities.config import load_config
+            from utilities.sql_templates import pooled_connection_class
+            config = load_config()
+            max_connections = config.getint("db_pool", "max_connections", fallback=10)
+            _pool = ThreadedConnectionPool(
+                config.getint("db_pool", "min_connections", fallback=1), max_connections,
+                connection_factory=pooled_connection_class(), **get_db_settings()
+            )
+            # ThreadedConnectionPool raises instead of waiting when all connections are in use
+            _pool_slots = threading.BoundedSemaphore(max_connections)
+        return _pool, _pool_slots
+
+
+@contextmanager
+def pooled_connection():
+    """
+    Borrows a connection from the shared pool for the block. The connection is rolled back
+    when it is returned, and discarded if it broke. SQLite databases are opened per block.
+    """
+    get_db_settings()  # Loads .env, which may set db_sqlite_path
+    sqlite_path = os.getenv("db_sqlite_path")
+    if sqlite_path:
+        conn = connect_sqlite(sqlite_path)
+        try:
+            yield conn
+        finally:
+            conn.close()
+        return
+
+    pool, slots = get_db_pool()
+    slots.acquire()
+    try:
+        conn = pool.getconn()
+        try:
+            yield conn
+        finally:
+            broken = bool(conn.closed)
+            if not broken:
+                try:
+                    # The next borrower must not inherit an open transaction or a failed one
+                    conn.rollback()
+                except Exception:
+                    broken = True
+            pool.putconn(conn, close=broken)
+    finally:
+        slots.release()
+
+
+def connect_sqlite(path: str):
+    """Opens a SQLite database attached as schema "public", so queries written for Postgres resolve."""
+    import sqlite3
+    # Tools run in worker threads and may be interrupted from another thread on cancellation
+    conn = sqlite3.connect(":memory:", check_same_thread=False)
+    conn.execute("ATTACH DATABASE ? AS public", (path,))
+    return conn
+
+
+def is_sqlite(conn) -> bool:
+    """Returns whether a connection is a SQLite connection rather than a Postgres one."""
+    import sqlite3
+    return isinstance(conn, sqlite3.Connection)
+
+
+class DbMeter:
+    """Accumulates the seconds spent in database queries, e.g. for the per-user quotas of the service."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.seconds = 0.0
+
+    def add(self, seconds: float):
+        with self.lock:
+            self.seconds += seconds
+
+
+_db_meter: ContextVar[Optional[DbMeter]] = ContextVar("db_meter", default=None)
+
+
+@contextmanager
+def meter_db_time():
+    """Meters the database time of the queries run in the block, including tasks and threads it starts."""
+    meter = DbMeter()
+    token = _db_meter.set(meter)
+    try:
+        yield meter
+    finally:
+        _db_meter.reset(token)
+
+
+def record_db_time(seconds: float):
+    """Called after a query to add its duration to the current meter, if any."""
+    meter = _db_meter.get()
+    if meter is not None:
+        meter.add(seconds)
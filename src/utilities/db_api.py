@@ -1,37 +1,171 @@
-from flask import Flask, jsonify, request
-import psycopg2  # or any other DB connector for your DB
-from dotenv import load_dotenv
-import os
+import base64
+import hashlib
+import time
+from typing import Dict, List, Optional, Tuple
 
-# Load environment variables from .env file
-load_dotenv()
+import orjson
+from flask import Flask, Response, abort, request
 
-# Retrieve DB credentials from environment variables
-db_host = os.getenv("db_host")
-db_database = os.getenv("db_database")
-db_user = os.getenv("db_user")
-db_password = os.getenv("db_password")
+from utilities.cache import get_cache
+from utilities.config import load_config
+from utilities.db import is_sqlite, pooled_connection
+from utilities.sql_pushdown import quote
 
 app = Flask(__name__)
 
-def get_db_connection():
-    conn = psycopg2.connect(
-        host=db_host,
-        database=db_database,
-        user=db_user,
-        password=db_password
-    )
-    return conn
+
+class DataApiConfig:
+    """Settings of the [data_api] section of config.ini."""
+
+    def __init__(self, config=None):
+        config = config if config is not None else load_config()
+        self.default_limit = config.getint("data_api", "default_limit", fallback=50)
+        self.max_limit = config.getint("data_api", "max_limit", fallback=5000)
+        # Pages with more rows are encoded as they are sent instead of being built, cached and tagged
+        self.stream_rows = config.getint("data_api", "stream_rows", fallback=500)
+        self.tables_ttl_seconds = config.getfloat("data_api", "tables_ttl_seconds", fallback=300)
+
+
+CONFIG = DataApiConfig()
+_tables: Tuple[float, Dict[Tuple[str, str], List[str]]] = (0.0, {})
+
+
+def dumps(value) -> bytes:
+    # Decimals and other types JSON has no equivalent for are sent as strings
+    return orjson.dumps(value, default=str)
+
+
+def list_tables() -> Dict[Tuple[str, str], List[str]]:
+    """Returns the tables of the metadata_table with their primary key columns, refreshed every tables_ttl_seconds."""
+    global _tables
+    loaded_at, tables = _tables
+    if time.monotonic() - loaded_at < CONFIG.tables_ttl_seconds:
+        return tables
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT schema_name, table_name, column_name, constraint_type FROM public.metadata_table")
+            rows = cursor.fetchall()
+        finally:
+            cursor.close()
+    tables = {}
+    for schema, table, column, constraint in rows:
+        keys = tables.setdefault((schema, table), [])
+        if (constraint or "").upper() == "PRIMARY KEY" and column not in keys:
+            keys.append(column)
+    _tables = (time.monotonic(), tables)
+    return tables
+
+
+def encode_cursor(values) -> str:
+    return base64.urlsafe_b64encode(dumps(list(values))).decode().rstrip("=")
+
+
+def decode_cursor(token: str) -> list:
+    try:
+        return orjson.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+    except (ValueError, orjson.JSONDecodeError):
+        abort(400, description="Invalid cursor")
+
+
+def page_query(conn, schema: str, table: str, keys: List[str], after: Optional[list], limit: int):
+    """
+    Builds the keyset query of a page: rows ordered by the primary key, after the key of the
+    previous page's last row. Tables without a primary key are ordered by the row's physical
+    location (ctid in Postgres, rowid in SQLite). The key columns come last in each row.
+    """
+    if keys:
+        key_exprs = [quote(key) for key in keys]
+    else:
+        key_exprs = ["rowid" if is_sqlite(conn) else "ctid"]
+    placeholder = "?" if is_sqlite(conn) else "%s"
+    sql = f"SELECT *, {', '.join(key_exprs)} FROM {quote(schema)}.{quote(table)}"
+    params = []
+    if after is not None:
+        if len(after) != len(key_exprs):
+            abort(400, description="Invalid cursor")
+        cast = "" if keys or is_sqlite(conn) else "::tid"
+        sql += f" WHERE ({', '.join(key_exprs)}) > ({', '.join(placeholder + cast for _ in key_exprs)})"
+        params = after
+    sql += f" ORDER BY {', '.join(key_exprs)} LIMIT {int(limit)}"
+    return sql, params, len(key_exprs)
+
+
+def read_page(schema: str, table: str, keys: List[str], after: Optional[list], limit: int):
+    """
+    Reads a page into memory and returns its columns, rows and the cursor of the next page
+    (None on the last page). The pooled connection is released before the page is sent, so
+    a slow client never holds it.
+    """
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            sql, params, key_count = page_query(conn, schema, table, keys, after, limit)
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+            columns = [column[0] for column in cursor.description][:-key_count]
+        finally:
+            cursor.close()
+    next_cursor = encode_cursor(rows[-1][-key_count:]) if len(rows) == limit else None
+    return columns, [row[:-key_count] for row in rows], next_cursor
+
+
+def fetch_page(schema: str, table: str, keys: List[str], after: Optional[list], limit: int) -> bytes:
+    """Returns a page as a JSON document: columns, rows and the cursor of the next page (null on the last page)."""
+    columns, rows, next_cursor = read_page(schema, table, keys, after, limit)
+    return dumps({"columns": columns, "rows": rows, "next": next_cursor})
+
+
+def stream_page(columns: List[str], rows: list, next_cursor: Optional[str]):
+    """Yields a page read by read_page as the same JSON document as fetch_page, encoded stream_rows rows at a time."""
+    yield b'{"columns":' + dumps(columns) + b',"rows":['
+    for start in range(0, len(rows), CONFIG.stream_rows):
+        chunk = rows[start:start + CONFIG.stream_rows]
+        yield (b"," if start else b"") + b",".join(dumps(row) for row in chunk)
+    yield b'],"next":' + dumps(next_cursor) + b"}"
+
 
 @app.route('/data', methods=['GET'])
-def get_data():
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM public.supplier LIMIT 10;')
-    data = cursor.fetchall()
-    cursor.close()
-    conn.close()
-    return jsonify(data)
+def get_tables():
+    """Lists the tables that can be previewed."""
+    tables = list_tables()
+    return Response(dumps([{"schema": schema, "table": table, "primary_key": keys}
+                           for (schema, table), keys in sorted(tables.items())]),
+                    mimetype="application/json")
+
+
+@app.route('/data/<schema>/<table>', methods=['GET'])
+def get_data(schema: str, table: str):
+    """
+    Returns a page of a table listed in the metadata_table. ?limit sets the page size and
+    ?after the cursor returned as "next" by the previous page. Pages are cached for the
+    [cache] data_api TTL and tagged, so unchanged pages are answered with 304 Not Modified.
+    """
+    keys = list_tables().get((schema, table))
+    if keys is None:
+        abort(404, description="Unknown table")
+    limit = request.args.get("limit", CONFIG.default_limit, type=int)
+    if not 1 <= limit <= CONFIG.max_limit:
+        abort(400, description=f"limit must be between 1 and {CONFIG.max_limit}")
+    after = decode_cursor(request.args["after"]) if request.args.get("after") else None
+
+    if limit > CONFIG.stream_rows:
+        # The page is read before the response starts; only its encoding is streamed
+        return Response(stream_page(*read_page(schema, table, keys, after, limit)), mimetype="application/json")
+
+    def build():
+        body = fetch_page(schema, table, keys, after, limit)
+        return body, hashlib.sha256(body).hexdigest()[:32]
+
+    cache = get_cache("data_api")
+    cache_key = (schema, table, limit, request.args.get("after"))
+    body, etag = cache.get_or_compute(cache_key, build) if cache is not None else build()
+    response = Response(body, mimetype="application/json")
+    response.set_etag(etag)
+    if cache is not None:
+        response.cache_control.max_age = int(cache.ttl_seconds)
+    return response.make_conditional(request)
+
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000)
@@ -1,13 +1,74 @@
 from langchain.agents import AgentExecutor, create_openai_functions_agent
 from langchain.output_parsers.openai_functions import JsonOutputFunctionsParser
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain_core.runnables import RunnableLambda
 from langchain_openai import ChatOpenAI
-from langchain_core.messages import HumanMessage, AIMessage
+from langchain_core.messages import HumanMessage, AIMessage, BaseMessage
+from utilities.config import StateConfig
+from utilities.loop_control import LOOP_CONFIG, record_visit
+from utilities.payload_store import get_payload_store
+from utilities.prompt_compaction import compact_prompt, compaction_enabled, format_chat_history
+from utilities.run_context import current_run
 import json
 
+def openai_llm_factory(model: str) -> ChatOpenAI:
+    """Creates an OpenAI chat model client for a model name."""
+    # Streaming lets a cancelled run abort generation between tokens; stream_usage reports token counts
+    return ChatOpenAI(model=model, streaming=True, stream_usage=True)
+
+def default_llm_factory(model: str) -> ChatOpenAI:
+    """Creates the chat model client for a model name, going through the LLM cache when it is on."""
+    from utilities.llm_cache import get_llm_cache, cached_llm_factory
+    cache = get_llm_cache()
+    if cache is not None:
+        return cached_llm_factory(cache)(model)
+    return openai_llm_factory(model)
+
+_llm_factory = default_llm_factory
+
+def set_llm_factory(factory=None):
+    """
+    Replaces the function used to create chat model clients, e.g. with one that records or
+    replays responses. Only affects clients created afterwards; None restores the default.
+    """
+    global _llm_factory
+    _llm_factory = factory or default_llm_factory
+
 class HelperUtilities:
     def __init__(self):
-        pass
+        self.llms = {}
+        self.state_config = StateConfig()
+        # Whether the prompts of the agents and supervisors built by this instance are compacted
+        self.compact_prompts = compaction_enabled()
+
+    def get_llm(self, model: str) -> ChatOpenAI:
+        """
+        Return a ChatOpenAI client for the given model, reusing clients created for the same model.
+
+        Args:
+            model: The OpenAI model name.
+
+        Returns:
+            ChatOpenAI: The shared client for the model.
+        """
+        if model not in self.llms:
+            self.llms[model] = _llm_factory(model)
+        return self.llms[model]
+
+    def llm_for(self, node_models: dict, node: str, default: ChatOpenAI) -> ChatOpenAI:
+        """
+        Return the client of the model configured for a graph node.
+
+        Args:
+            node_models: Graph node names mapped to model names.
+            node: The graph node name.
+            default: The client used for nodes without a configured model.
+
+        Returns:
+            ChatOpenAI: The shared client for the node's model, or default.
+        """
+        model = node_models.get(node)
+        return self.get_llm(model) if model else default
 
     def create_agent(self, llm: ChatOpenAI, tools: list, system_prompt: str) -> AgentExecutor:
         """
@@ -27,6 +88,8 @@ class HelperUtilities:
             " Your other team members (and other teams) will collaborate with you with their own specialties."
             " You are chosen for a reason! You are one of the following team members: {team_members}."
         )
+        if self.compact_prompts:
+            system_prompt = compact_prompt(system_prompt)
         prompt = ChatPromptTemplate.from_messages(
             [
                 ("system", system_prompt),
@@ -35,7 +98,8 @@ class HelperUtilities:
             ]
         )
         agent = create_openai_functions_agent(llm, tools, prompt)
-        executor = AgentExecutor(agent=agent, tools=tools)
+        # Bounds the agent's own LLM/tool loop; past the limit it returns what it has
+        executor = AgentExecutor(agent=agent, tools=tools, max_iterations=LOOP_CONFIG.max_agent_iterations)
         return executor
 
     def agent_node(self, state, agent: AgentExecutor, name: str, callback=None) -> dict:
@@ -49,39 +113,112 @@ class HelperUtilities:
             callback: Optional callback function to handle the result after invocation.
 
         Returns:
-            dict: The updated state.
+            dict: The state update (the agent's message plus any parsed structured output).
         """
         # Invoke the agent with the current state
-        result = agent.invoke(state)
+        result = agent.invoke(self.agent_input(state, name))
         agent_output = result["output"]
+        update = {"messages": [self.compact_message(agent_output, name)]}
+        # Visit counts and output hashes let the loop guards detect agents that make no progress
+        update.update(record_visit(state, name, agent_output))
 
-        # Attempt to parse the output as JSON and update the state
+        # Large tool outputs (query results, metadata) are added to the state as references
+        run = current_run()
+        if run is not None:
+            update.update(run.take_payloads())
+
+        # Attempt to parse the output as JSON and store it in the state
         try:
             output_data = json.loads(agent_output)
+        except json.JSONDecodeError:
+            # Not structured output (e.g. a clarifying question for the user); only the message is kept
+            output_data = None
+        if isinstance(output_data, dict):
             if name == "data_gather_information":
-                state['data_requirements'] = output_data
+                update['data_requirements'] = output_data
             elif name == "data_prompt_generator":
-                state['generated_prompt'] = output_data.get('generated_prompt', '')
+                update['generated_prompt'] = output_data.get('generated_prompt', '')
+            elif name == "sql_generation":
+                update['sql_query'] = output_data.get('sql_query', '')
             # Add more elif blocks for other agents as needed
-        except json.JSONDecodeError:
-            # Handle parsing error (e.g., log the error or store the raw output)
-            # For this example, we'll store the raw output in the state under a 'raw_outputs' key
-            state.setdefault('raw_outputs', {})[name] = agent_output
-
-        # Update the messages in the state
-        if 'messages' not in state:
-            state['messages'] = []
-        #state['messages'].append(AIMessage(content=agent_output, name=name))
 
         # If a callback is provided, execute it
         if callback:
-            callback(state)
+            callback({**state, **update})
 
-        return {"messages": [HumanMessage(content=result["output"], name=name)]}
-        # Return the updated state
-        #return state
-    
+        # Return the state update for LangGraph to merge
+        return update
 
+    def agent_input(self, state, name: str) -> dict:
+        """
+        Return the input of an agent for the current state.
+
+        Args:
+            state: The current state of the graph.
+            name: The name of the agent, which selects its message window.
+
+        Returns:
+            dict: The state without the executor's own keys, with the messages pruned.
+        """
+        # The agent executor manages its own scratchpad and intermediate steps
+        agent_input = {
+            key: value for key, value in state.items()
+            if key not in ("intermediate_steps", "agent_scratchpad")
+        }
+        if self.compact_prompts and "chat_history" in agent_input:
+            agent_input["chat_history"] = format_chat_history(agent_input["chat_history"])
+        # Each agent only sees the user's question and its configured window of recent messages
+        agent_input["messages"] = self.prune_messages(
+            state.get("messages", []), self.state_config.window_for(name)
+        )
+        return agent_input
+
+    def prune_messages(self, messages: list, window: int) -> list:
+        """
+        Return the messages a node's prompt should include: the latest user question plus the
+        last `window` messages, with long contents cut down to a preview.
+
+        Args:
+            messages: The messages in the graph state.
+            window: The number of recent messages to keep.
+
+        Returns:
+            list: The pruned messages, in their original order.
+        """
+        recent = messages[-window:] if window > 0 else []
+        # The latest message without a name is the user's input
+        question = next((m for m in reversed(messages) if isinstance(m, HumanMessage) and not m.name), None)
+        if question is not None and all(m is not question for m in recent):
+            recent = [question] + recent
+
+        limit = self.state_config.preview_chars
+        return [
+            m if not isinstance(m.content, str) or len(m.content) <= limit
+            else m.model_copy(update={"content": m.content[:limit] + " ...[truncated]"})
+            for m in recent
+        ]
+
+    def compact_message(self, content: str, name: str) -> BaseMessage:
+        """
+        Create the message an agent adds to the state. Oversized outputs are kept in the payload
+        store and the message carries a preview and the payload handle.
+
+        Args:
+            content: The agent's output.
+            name: The name of the agent.
+
+        Returns:
+            BaseMessage: The message to add to the state.
+        """
+        config = self.state_config
+        if len(content) <= config.max_message_chars or name in config.full_output_nodes:
+            return HumanMessage(content=content, name=name)
+        ref = get_payload_store().put(content, kind="message", size=len(content),
+                                      preview=content[:config.preview_chars])
+        return HumanMessage(
+            content=f"{ref.preview} ...[truncated {ref.size} characters, full output: {ref.handle}]",
+            name=name
+        )
 
     def create_team_supervisor(self, llm: ChatOpenAI, system_prompt: str, members: list) -> JsonOutputFunctionsParser:
         """
@@ -96,6 +233,8 @@ class HelperUtilities:
             JsonOutputFunctionsParser: The parser that routes tasks based on the conversation.
         """
         options = ["FINISH"] + members
+        if self.compact_prompts:
+            system_prompt = compact_prompt(system_prompt)
         function_def = {
             "name": "route",
             "description": "Select the next role.",
@@ -118,8 +257,16 @@ class HelperUtilities:
             ]
         ).partial(options=str(options), team_members=", ".join(members))
 
+        def prune(state):
+            window = self.state_config.window_for("supervisor")
+            pruned = {**state, "messages": self.prune_messages(state.get("messages", []), window)}
+            if self.compact_prompts and "chat_history" in state:
+                pruned["chat_history"] = format_chat_history(state["chat_history"])
+            return pruned
+
         return (
-            prompt
+            RunnableLambda(prune)
+            | prompt
             | llm.bind_functions(functions=[function_def], function_call="route")
             | JsonOutputFunctionsParser()
         )
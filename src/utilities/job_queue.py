@@ -0,0 +1,356 @@
+import json
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Callable, Optional
+from utilities.run_context import RunHandle, RunCancelled
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+
+class QueueFullError(Exception):
+    """Raised when a job is rejected by admission control."""
+
+
+class JobError(Exception):
+    """Error of a job that failed on another replica, as recorded in the job store."""
+
+
+class Job:
+    """A single chain run submitted to the JobQueue."""
+
+    def __init__(self, user_id: str, payload: dict, store: "JobStore" = None):
+        self.handle = RunHandle()
+        self.store = store
+        self.id = self.handle.run_id
+        self.user_id = user_id
+        self.payload = payload
+        self.status = QUEUED
+        # Set when a running job is cancelled; it stays RUNNING, and holds its worker, until the
+        # worker returns, but no longer counts against the user's quota
+        self.cancel_requested = False
+        self.progress = []  # Names of the graph nodes completed so far
+        self.output = None
+        self.error = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.last_seen = self.submitted_at  # Last time a client polled the job
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (DONE, FAILED, CANCELLED)
+
+    def report_node(self, node: str):
+        """Records a completed graph node and stops the run if it was cancelled."""
+        self.progress.append(node)
+        if self.store is not None:
+            try:
+                self.store.save(self)
+                # The job may have been cancelled through another replica
+                if self.store.cancel_requested(self.id):
+                    self.handle.cancel()
+            except Exception as e:
+                print(f"Error recording job {self.id}: {e}")
+        self.handle.check()
+
+
+class JobRecord:
+    """Read-only snapshot of a job run by another replica, as recorded in the job store."""
+
+    def __init__(self, record: dict):
+        self.id = record["id"]
+        self.user_id = record["user_id"]
+        self.status = record["status"]
+        self.cancel_requested = record.get("cancel_requested", False)
+        self.progress = record["progress"]
+        self.output = record["output"]
+        self.error = JobError(record["error"]) if record["error"] else None
+        self.submitted_at = record["submitted_at"]
+        self.started_at = record["started_at"]
+        self.finished_at = record["finished_at"]
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (DONE, FAILED, CANCELLED)
+
+
+class JobStore:
+    """
+    Records of the jobs in the shared state store ([state_backend]), so that any replica can
+    report on and cancel any job and a user's quota applies across replicas. Jobs still run
+    on the replica that accepted them.
+    """
+
+    def __init__(self, store, retention_seconds: int = 600, heartbeat_seconds: int = 60):
+        self.store = store
+        self.retention_seconds = retention_seconds
+        # Records of unfinished jobs expire unless their replica refreshes them, e.g. after it died
+        self.heartbeat_seconds = heartbeat_seconds
+
+    def save(self, job: Job):
+        record = {
+            "id": job.id, "user_id": job.user_id, "status": job.status, "cancel_requested": job.cancel_requested,
+            "progress": list(job.progress),
+            "output": job.output if isinstance(job.output, str) else None,
+            "error": f"{type(job.error).__name__}: {job.error}" if job.error is not None else None,
+            "submitted_at": job.submitted_at, "started_at": job.started_at, "finished_at": job.finished_at,
+        }
+        ttl = self.retention_seconds if job.finished else 2 * self.heartbeat_seconds
+        data = json.dumps(record).encode()
+        self.store.set("jobs", job.id, data, ttl)
+        # The user's unfinished jobs are also kept in a namespace of their own, which the quota
+        # check reads without going through the jobs of every other user
+        if job.finished:
+            self.store.delete(f"user_jobs:{job.user_id}", job.id)
+        else:
+            self.store.set(f"user_jobs:{job.user_id}", job.id, data, ttl)
+
+    def load(self, job_id: str) -> Optional[JobRecord]:
+        data = self.store.get("jobs", job_id)
+        return JobRecord(json.loads(data)) if data is not None else None
+
+    def unfinished_jobs(self, user_id: str) -> list:
+        records = (JobRecord(json.loads(data)) for _, data in self.store.scan(f"user_jobs:{user_id}"))
+        return [record for record in records if not record.finished]
+
+    def request_cancel(self, job_id: str):
+        self.store.set("job_cancels", job_id, b"1", self.retention_seconds)
+
+    def cancel_requested(self, job_id: str) -> bool:
+        return self.store.get("job_cancels", job_id) is not None
+
+    def touch(self, job_id: str):
+        """Records that a client polled the job through this replica."""
+        self.store.set("job_seen", job_id, str(time.time()).encode(), self.retention_seconds)
+
+    def last_seen(self, job_id: str) -> float:
+        data = self.store.get("job_seen", job_id)
+        return float(data) if data is not None else 0.0
+
+
+class JobQueue:
+    """
+    Bounded worker pool that runs chain jobs off the Streamlit script thread.
+
+    Jobs are queued per user and workers pick users round-robin, so one user
+    submitting many questions cannot starve the others. Submissions are
+    rejected with QueueFullError once the queue or the user's quota is full.
+    Jobs that no client has polled for abandon_seconds are cancelled. With a JobStore, jobs
+    are also recorded for the other replicas, which can poll and cancel them.
+    """
+
+    def __init__(self, runner: Callable[[Job], str], workers: int = 4, max_pending: int = 32,
+                 max_per_user: int = 2, retention_seconds: int = 600, abandon_seconds: int = 30,
+                 store: JobStore = None):
+        self.runner = runner
+        self.store = store
+        self.max_pending = max_pending
+        self.max_per_user = max_per_user
+        self.retention_seconds = retention_seconds
+        self.abandon_seconds = abandon_seconds
+        self.jobs = {}
+        self.user_queues = OrderedDict()  # user_id -> deque of queued jobs
+        self.pending = 0
+        self.condition = threading.Condition()
+        self.workers = [
+            threading.Thread(target=self._work, name=f"chain-worker-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for worker in self.workers:
+            worker.start()
+        threading.Thread(target=self._reap_abandoned, name="chain-reaper", daemon=True).start()
+
+    def submit(self, user_id: str, payload: dict) -> Job:
+        """Queues a job for the user, applying admission control."""
+        # The user's jobs on every replica count against their quota, except jobs being
+        # cancelled: a user who re-asks while a run is stopping gets the slot right away, and the
+        # new job waits in the queue for a free worker
+        remote = 0
+        if self.store is not None:
+            remote = sum(1 for record in self.store.unfinished_jobs(user_id)
+                         if not record.cancel_requested and not self.store.cancel_requested(record.id))
+        with self.condition:
+            self._expire_finished()
+            if self.pending >= self.max_pending:
+                raise QueueFullError("The service is busy, please try again shortly.")
+            active = [job for job in self.jobs.values()
+                      if job.user_id == user_id and not job.finished and not job.cancel_requested]
+            if max(len(active), remote) >= self.max_per_user:
+                raise QueueFullError("You already have queries running, please wait for them to finish.")
+
+            job = Job(user_id, payload, self.store)
+            self.jobs[job.id] = job
+            self.user_queues.setdefault(user_id, deque()).append(job)
+            self.pending += 1
+            self.condition.notify()
+        self._record(job)
+        return job
+
+    def _record(self, job: Job):
+        """Saves the job to the job store, if any."""
+        if self.store is not None:
+            try:
+                self.store.save(job)
+            except Exception as e:
+                print(f"Error recording job {job.id}: {e}")
+
+    def get(self, job_id: str) -> Job:
+        """
+        Returns the job and records that a client is still waiting for it. Jobs of other
+        replicas are returned as a JobRecord read from the job store.
+        """
+        with self.condition:
+            job = self.jobs.get(job_id)
+            if job is not None:
+                job.last_seen = time.time()
+                return job
+        if self.store is None:
+            return None
+        record = self.store.load(job_id)
+        if record is not None and not record.finished:
+            self.store.touch(job_id)
+        return record
+
+    def cancel(self, job_id: str) -> bool:
+        """
+        Cancels a job. Queued jobs are dropped; running jobs have their pending LLM
+        calls and database query interrupted through the job's RunHandle, and are reported as
+        cancelled once their worker returns. Returns False if the job was already finished or
+        being cancelled.
+        """
+        with self.condition:
+            local = job_id in self.jobs
+        if not local and self.store is not None:
+            # The job runs on another replica, which stops it when it sees the request
+            record = self.store.load(job_id)
+            if record is None or record.finished:
+                return False
+            self.store.request_cancel(job_id)
+            return True
+
+        with self.condition:
+            job = self.jobs.get(job_id)
+            if job is None or job.finished or job.cancel_requested:
+                return False
+            if job.status == QUEUED:
+                queue = self.user_queues.get(job.user_id)
+                if queue is not None and job in queue:
+                    queue.remove(job)
+                    self.pending -= 1
+                    if not queue:
+                        del self.user_queues[job.user_id]
+                job.status = CANCELLED
+                job.finished_at = time.time()
+            else:
+                # The worker stops at the next checkpoint, e.g. after a blocking LLM call returns;
+                # until then the job holds its worker, but no longer the user's quota
+                job.cancel_requested = True
+        job.handle.cancel()
+        self._record(job)
+        return True
+
+    def cancel_user_jobs(self, user_id: str) -> int:
+        """Cancels every unfinished job of a user, e.g. when they ask a new question."""
+        with self.condition:
+            job_ids = [job.id for job in self.jobs.values() if job.user_id == user_id and not job.finished]
+        if self.store is not None:
+            job_ids += [record.id for record in self.store.unfinished_jobs(user_id) if record.id not in job_ids]
+        return sum(1 for job_id in job_ids if self.cancel(job_id))
+
+    def position(self, job_id: str) -> int:
+        """Returns how many queued jobs are ahead of the given job (0 when running or done)."""
+        with self.condition:
+            job = self.jobs.get(job_id)
+            if job is None or job.status != QUEUED:
+                return 0
+            ahead = 0
+            for queue in self.user_queues.values():
+                for queued in queue:
+                    if queued is job:
+                        break
+                    if queued.submitted_at <= job.submitted_at:
+                        ahead += 1
+            return ahead
+
+    def stats(self) -> dict:
+        with self.condition:
+            running = [job for job in self.jobs.values() if job.status == RUNNING]
+            return {"pending": self.pending, "running": len(running),
+                    "cancelling": sum(1 for job in running if job.cancel_requested), "workers": len(self.workers)}
+
+    def _next_job(self) -> Job:
+        """Takes the next job round-robin across users. Must be called with the lock held."""
+        user_id, queue = next(iter(self.user_queues.items()))
+        job = queue.popleft()
+        del self.user_queues[user_id]
+        if queue:
+            # Move the user to the back of the rotation
+            self.user_queues[user_id] = queue
+        self.pending -= 1
+        return job
+
+    def _expire_finished(self):
+        """Forgets finished jobs older than the retention window. Must be called with the lock held."""
+        cutoff = time.time() - self.retention_seconds
+        expired = [job_id for job_id, job in self.jobs.items() if job.finished and job.finished_at < cutoff]
+        for job_id in expired:
+            del self.jobs[job_id]
+
+    def _work(self):
+        while True:
+            with self.condition:
+                while not self.user_queues:
+                    self.condition.wait()
+                job = self._next_job()
+                job.status = RUNNING
+                job.started_at = time.time()
+            self._record(job)
+
+            try:
+                output = self.runner(job)
+                status, error = DONE, None
+            except RunCancelled:
+                output, status, error = None, CANCELLED, None
+            except Exception as e:
+                output, status, error = None, FAILED, e
+            # Finished jobs are kept for retention_seconds; their payload (e.g. the conversation) is not needed
+            job.payload = None
+
+            with self.condition:
+                if job.cancel_requested:
+                    output, status, error = None, CANCELLED, None
+                job.output = output
+                job.error = error
+                job.status = status
+                job.finished_at = time.time()
+            self._record(job)
+
+    def _reap_abandoned(self):
+        """Cancels jobs whose client stopped polling, e.g. because the browser tab was closed."""
+        while True:
+            time.sleep(max(1, self.abandon_seconds / 3))
+            cutoff = time.time() - self.abandon_seconds
+            with self.condition:
+                unfinished = [job for job in self.jobs.values() if not job.finished]
+            for job in unfinished:
+                last_seen = job.last_seen
+                if self.store is not None:
+                    try:
+                        # Clients may poll through other replicas, and cancel the job there
+                        last_seen = max(last_seen, self.store.last_seen(job.id))
+                        if self.store.cancel_requested(job.id):
+                            self.cancel(job.id)
+                            continue
+                    except Exception as e:
+                        print(f"Error reading job store: {e}")
+                if last_seen < cutoff:
+                    print(f"Cancelling abandoned job {job.id}")
+                    self.cancel(job.id)
+                else:
+                    # Keeps the job's record from expiring while it runs
+                    self._record(job)
@@ -0,0 +1,203 @@
+import hashlib
+import json
+import os
+import re
+import threading
+from typing import Any, Optional
+
+from langchain_core.messages import AIMessageChunk
+from langchain_core.outputs import ChatGenerationChunk
+from langchain_openai import ChatOpenAI
+
+from utilities.config import load_config
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODES = ("off", "record", "replay", "auto")
+MATCHES = ("strict", "lenient")
+
+_UUID = re.compile(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}")
+
+
+class LLMCacheMiss(Exception):
+    """Raised in replay mode when no response was recorded for a request."""
+
+
+def request_key(model: str, messages: list, kwargs: dict, lenient: bool = False) -> str:
+    """
+    Hashes a chat request. The strict key covers the model, every message field and the
+    function schemas; the lenient key only the model, the message roles and contents (with
+    whitespace collapsed and run ids masked) and the function names.
+    """
+    if lenient:
+        request = {
+            "model": model,
+            "messages": [
+                [m.type, _UUID.sub("<id>", re.sub(r"\s+", " ", str(m.content)).strip())]
+                for m in messages
+            ],
+            "functions": sorted(f.get("name", "") for f in kwargs.get("functions") or []),
+        }
+    else:
+        request = {
+            "model": model,
+            "messages": [[m.type, m.content, m.name, m.additional_kwargs] for m in messages],
+            "functions": kwargs.get("functions"),
+            "function_call": kwargs.get("function_call"),
+            "tools": kwargs.get("tools"),
+            "stop": kwargs.get("stop"),
+        }
+    return hashlib.sha256(json.dumps(request, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class LLMCache:
+    """
+    Local store of recorded chat responses, kept as a JSON lines file so recordings can be
+    committed and diffed. Modes:
+        record  always call the model and store the response
+        replay  only answer from the store; a miss raises LLMCacheMiss
+        auto    answer from the store, calling the model and recording on a miss
+    With match="lenient", a request whose strict key is unknown falls back to its lenient key.
+    """
+
+    def __init__(self, path: str, mode: str = "auto", match: str = "strict"):
+        if mode not in MODES or mode == "off":
+            raise ValueError(f"Invalid LLM cache mode: {mode}")
+        if match not in MATCHES:
+            raise ValueError(f"Invalid LLM cache match: {match}")
+        self.path = path
+        self.mode = mode
+        self.match = match
+        self.lock = threading.Lock()
+        self.strict = {}  # strict key -> response
+        self.lenient = {}  # lenient key -> response
+        self.hits = 0
+        self.misses = 0
+        if os.path.exists(path):
+            with open(path) as file:
+                for line in file:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.strict[entry["key"]] = entry["response"]
+                        self.lenient[entry["lenient_key"]] = entry["response"]
+
+    def lookup(self, model: str, messages: list, kwargs: dict) -> Optional[dict]:
+        """Returns the recorded response for a request, or None when the model should be called."""
+        if self.mode == "record":
+            return None
+        with self.lock:
+            response = self.strict.get(request_key(model, messages, kwargs))
+            if response is None and self.match == "lenient":
+                response = self.lenient.get(request_key(model, messages, kwargs, lenient=True))
+            if response is not None:
+                self.hits += 1
+                return response
+            self.misses += 1
+        if self.mode == "replay":
+            raise LLMCacheMiss(f"No recorded {model} response for this request in {self.path}")
+        return None
+
+    def store(self, model: str, messages: list, kwargs: dict, message):
+        response = {
+            "content": message.content,
+            "additional_kwargs": message.additional_kwargs,
+            "usage_metadata": message.usage_metadata,
+        }
+        entry = {
+            "key": request_key(model, messages, kwargs),
+            "lenient_key": request_key(model, messages, kwargs, lenient=True),
+            "model": model,
+            "response": response,
+        }
+        with self.lock:
+            self.strict[entry["key"]] = response
+            self.lenient[entry["lenient_key"]] = response
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(self.path, "a") as file:
+                file.write(json.dumps(entry, default=str) + "\n")
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"entries": len(self.strict), "hits": self.hits, "misses": self.misses}
+
+
+def _response_chunk(response: dict) -> ChatGenerationChunk:
+    return ChatGenerationChunk(message=AIMessageChunk(
+        content=response["content"],
+        additional_kwargs=response["additional_kwargs"],
+        usage_metadata=response["usage_metadata"],
+    ))
+
+
+class CachedChatOpenAI(ChatOpenAI):
+    """ChatOpenAI that answers from an LLMCache and records the responses of the calls it makes."""
+
+    cache: Any = None
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        request = {**kwargs, "stop": stop}
+        response = self.cache.lookup(self.model_name, messages, request)
+        if response is not None:
+            chunk = _response_chunk(response)
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+            return
+
+        merged = None
+        for chunk in super()._stream(messages, stop=stop, run_manager=run_manager, **kwargs):
+            merged = chunk if merged is None else merged + chunk
+            yield chunk
+        if merged is not None:
+            self.cache.store(self.model_name, messages, request, merged.message)
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        request = {**kwargs, "stop": stop}
+        response = self.cache.lookup(self.model_name, messages, request)
+        if response is not None:
+            chunk = _response_chunk(response)
+            if run_manager:
+                await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+            return
+
+        merged = None
+        async for chunk in super()._astream(messages, stop=stop, run_manager=run_manager, **kwargs):
+            merged = chunk if merged is None else merged + chunk
+            yield chunk
+        if merged is not None:
+            self.cache.store(self.model_name, messages, request, merged.message)
+
+
+def cached_llm_factory(cache: LLMCache):
+    """Returns an LLM factory for utilities.helper.set_llm_factory that goes through the cache."""
+    def factory(model: str) -> ChatOpenAI:
+        # Replay never reaches OpenAI, so it works without an API key
+        kwargs = {"api_key": "replay"} if cache.mode == "replay" and not os.getenv("OPENAI_API_KEY") else {}
+        return CachedChatOpenAI(model=model, streaming=True, stream_usage=True, cache=cache, **kwargs)
+    return factory
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_llm_cache() -> Optional[LLMCache]:
+    """
+    Returns the process-wide LLM cache configured by the [llm_cache] section of config.ini,
+    or None when it is off. CRMGPT_LLM_CACHE overrides the configured mode.
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            config = load_config()
+            mode = os.getenv("CRMGPT_LLM_CACHE") or config.get("llm_cache", "mode", fallback="off")
+            if mode == "off":
+                return None
+            path = config.get("llm_cache", "path", fallback="temp/llm_cache.jsonl")
+            _cache = LLMCache(
+                os.path.join(SRC_DIR, path),
+                mode=mode,
+                match=config.get("llm_cache", "match", fallback="strict"),
+            )
+        return _cache
@@ -0,0 +1,114 @@
+import hashlib
+import re
+from typing import Callable, Dict, Iterable, Optional
+
+from langchain_core.messages import AIMessage
+
+from utilities.config import load_config
+
+
+class LoopConfig:
+    """Limits on the loops between supervisors and their agents ([loop_control])."""
+
+    def __init__(self, config=None):
+        config = config if config is not None else load_config()
+        self.enabled = config.getboolean("loop_control", "enabled", fallback=True)
+        # Routing decisions a supervisor makes per run before it ends the loop
+        self.max_supervisor_turns = config.getint("loop_control", "max_supervisor_turns", fallback=3)
+        # Visits of one agent per run
+        self.max_node_visits = config.getint("loop_control", "max_node_visits", fallback=3)
+        # Identical consecutive outputs of an agent after which it is considered stuck
+        self.max_repeats = config.getint("loop_control", "max_repeats", fallback=1)
+        # LLM/tool steps of one agent executor, and LangGraph's superstep limit for a run
+        self.max_agent_iterations = config.getint("loop_control", "max_agent_iterations", fallback=5)
+        self.recursion_limit = config.getint("loop_control", "recursion_limit", fallback=25)
+
+
+LOOP_CONFIG = LoopConfig()
+
+
+def output_digest(output: str) -> str:
+    """Hashes an agent output with whitespace and case normalized, so trivial rewording still matches."""
+    return hashlib.sha256(re.sub(r"\s+", " ", output).strip().lower().encode()).hexdigest()[:16]
+
+
+def record_visit(state, name: str, output: Optional[str] = None) -> dict:
+    """
+    Returns the state update recording a visit of a node this run and, for agents, whether
+    its output repeats its previous one. Merged into the loop_counts state key.
+    """
+    previous = (state.get("loop_counts") or {}).get(name) or {}
+    entry = {"visits": previous.get("visits", 0) + 1, "repeats": 0}
+    if output is not None:
+        entry["digest"] = output_digest(output)
+        if previous.get("digest") == entry["digest"]:
+            entry["repeats"] = previous.get("repeats", 0) + 1
+    return {"loop_counts": {name: entry}}
+
+
+def loop_summary(state) -> Dict[str, int]:
+    """Visits per node in a run's final state, for logging."""
+    return {name: entry.get("visits", 0) for name, entry in (state.get("loop_counts") or {}).items()}
+
+
+class LoopGuard:
+    """
+    Wraps an LLM supervisor that routes between agents in a loop. The loop ends early, without
+    calling the supervisor again, once the supervisor has routed max_supervisor_turns times or
+    one of its agents is stuck (repeated its output) or was visited max_node_visits times.
+    It then takes the fallback route with a best-effort answer instead of bouncing on until
+    LangGraph's recursion limit.
+    """
+
+    def __init__(self, name: str, supervisor, agents: Iterable[str], routes: Iterable[str],
+                 fallback: Callable[[dict], str], config: LoopConfig = None):
+        self.name = name
+        self.supervisor = supervisor
+        self.agents = list(agents)
+        self.routes = set(routes)
+        self.fallback = fallback
+        self.config = config or LOOP_CONFIG
+
+    def stop_reason(self, state, choice: Optional[str] = None) -> Optional[str]:
+        config = self.config
+        counts = state.get("loop_counts") or {}
+        turns = (counts.get(self.name) or {}).get("visits", 0)
+        if turns >= config.max_supervisor_turns:
+            return f"{self.name} routed {turns} times"
+        for agent in self.agents:
+            entry = counts.get(agent) or {}
+            if entry.get("repeats", 0) >= config.max_repeats:
+                return f"{agent} repeated its output"
+            if agent == choice and entry.get("visits", 0) >= config.max_node_visits:
+                return f"{agent} ran {entry['visits']} times"
+        return None
+
+    def __call__(self, state) -> dict:
+        update = record_visit(state, self.name)
+        reason = self.stop_reason(state) if self.config.enabled else None
+        if reason is None:
+            choice = self.supervisor.invoke(state).get("next")
+            if choice not in self.routes:
+                reason = f"{self.name} chose an unknown route {choice!r}"
+            elif self.config.enabled:
+                reason = self.stop_reason(state, choice)
+            if reason is None:
+                return {**update, "next": choice}
+
+        route = self.fallback(state)
+        print(f"Ending loop at {self.name} ({reason}), routing to {route}")
+        update["next"] = route
+        if route == "FINISH":
+            update["messages"] = [AIMessage(content=best_effort_answer(state), name=self.name)]
+        return update
+
+
+def best_effort_answer(state) -> str:
+    """The answer of a run whose loop was ended early: what was understood so far and what is missing."""
+    requirements = state.get("data_requirements") or {}
+    understood = "; ".join(f"{key.replace('_', ' ')}: {value}" for key, value in requirements.items()
+                           if isinstance(requirements, dict) and str(value or "").strip())
+    answer = "I could not complete this request."
+    if understood:
+        answer += f" So far I understood: {understood}."
+    return answer + " Could you rephrase the question or add the missing details?"
@@ -0,0 +1,142 @@
+"""
+Memory instrumentation for long-running app processes.
+
+With [memory] enabled (or CRMGPT_MEMORY_PROFILE=1), each chain run ends with a checkpoint
+that records the process RSS, the memory traced by tracemalloc, the source lines whose
+allocations grew most since the previous checkpoint and the change in the number of live
+LangChain, LangGraph, OpenAI and pandas objects. Checkpoints are printed and appended to
+the [memory] path as JSON lines. benchmarks/soak.py uses the same checkpoints to fail when
+memory keeps growing over hundreds of turns.
+"""
+import gc
+import json
+import os
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from typing import Optional
+
+from utilities.config import load_config
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MB = 1024 * 1024
+
+
+class MemoryConfig:
+    """Settings of the [memory] section of config.ini."""
+
+    def __init__(self, config=None):
+        config = config if config is not None else load_config()
+        self.enabled = config.getboolean("memory", "enabled", fallback=False)
+        if os.getenv("CRMGPT_MEMORY_PROFILE"):
+            self.enabled = os.getenv("CRMGPT_MEMORY_PROFILE").lower() not in ("0", "false", "off")
+        self.path = config.get("memory", "path", fallback="temp/memory.jsonl")
+        # Stack frames kept per traced allocation; more frames cost more memory and time
+        self.frames = config.getint("memory", "frames", fallback=1)
+        self.top = config.getint("memory", "top", fallback=10)
+        types = config.get("memory", "object_modules", fallback="langchain, langgraph, openai, pandas")
+        self.object_modules = tuple(module.strip() for module in types.split(",") if module.strip())
+        # Bounds of a Streamlit session's conversation and of the result tables it keeps
+        self.max_session_messages = config.getint("memory", "max_session_messages", fallback=200)
+        self.max_session_tables = config.getint("memory", "max_session_tables", fallback=3)
+
+
+def rss_bytes() -> Optional[int]:
+    """Returns the resident set size of the process, or None where /proc is not available."""
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def count_objects(modules: tuple) -> Counter:
+    """Counts the live objects gc tracks whose type is defined in one of the modules (or their submodules)."""
+    counts = Counter()
+    for obj in gc.get_objects():
+        cls = type(obj)
+        module = getattr(cls, "__module__", None) or ""
+        if module.startswith(modules):
+            counts[f"{module}.{cls.__qualname__}"] += 1
+    return counts
+
+
+class MemoryProfiler:
+    """Takes memory checkpoints and reports what grew since the previous one."""
+
+    def __init__(self, config: MemoryConfig = None):
+        self.config = config or MemoryConfig()
+        self.lock = threading.Lock()
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.config.frames)
+        self.snapshot = None
+        self.objects = None
+        self.checkpoints = 0
+
+    def measure(self) -> dict:
+        """Collects garbage and returns the current RSS and traced memory in MB."""
+        gc.collect()
+        current, peak = tracemalloc.get_traced_memory()
+        rss = rss_bytes()
+        return {
+            "rss_mb": round(rss / MB, 2) if rss is not None else None,
+            "traced_mb": round(current / MB, 2),
+            "traced_peak_mb": round(peak / MB, 2),
+        }
+
+    def checkpoint(self, label: str, record: bool = True) -> dict:
+        """
+        Returns the memory now and the allocations and objects that grew since the previous
+        checkpoint, printing a summary and appending it to the [memory] path when record is set.
+        """
+        with self.lock:
+            result = {"label": label, "time": time.time(), **self.measure()}
+            snapshot = tracemalloc.take_snapshot().filter_traces([
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+            ])
+            objects = count_objects(self.config.object_modules)
+            if self.snapshot is not None:
+                stats = snapshot.compare_to(self.snapshot, "lineno")
+                result["top_growth"] = [
+                    {"where": str(stat.traceback), "size_kb": round(stat.size_diff / 1024, 1),
+                     "count": stat.count_diff}
+                    for stat in stats[:self.config.top] if stat.size_diff > 0
+                ]
+                deltas = Counter(objects)
+                deltas.subtract(self.objects)
+                result["object_deltas"] = dict(
+                    [(name, delta) for name, delta in deltas.most_common() if delta > 0][:self.config.top]
+                )
+            result["objects"] = sum(objects.values())
+            self.snapshot = snapshot
+            self.objects = objects
+            self.checkpoints += 1
+
+        if record:
+            grown = ", ".join(f"{name} +{delta}" for name, delta in list(result.get("object_deltas", {}).items())[:3])
+            print(f"Memory at {label}: RSS {result['rss_mb']} MB, traced {result['traced_mb']} MB, "
+                  f"{result['objects']} tracked objects" + (f", grown: {grown}" if grown else ""))
+            path = os.path.join(SRC_DIR, self.config.path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with self.lock, open(path, "a") as file:
+                file.write(json.dumps(result) + "\n")
+        return result
+
+
+_profiler = None
+_profiler_lock = threading.Lock()
+
+
+def get_memory_profiler() -> Optional[MemoryProfiler]:
+    """Returns the process-wide memory profiler, or None when [memory] instrumentation is off."""
+    global _profiler
+    with _profiler_lock:
+        if _profiler is None:
+            config = MemoryConfig()
+            if not config.enabled:
+                return None
+            _profiler = MemoryProfiler(config)
+        return _profiler
@@ -0,0 +1,55 @@
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any
+from uuid import uuid4
+
+
+@dataclass(frozen=True, slots=True)
+class PayloadRef:
+    """Reference to a large payload kept outside the graph state, with a short preview."""
+    handle: str
+    kind: str  # "result" (ResultStore run id), "metadata" or "message"
+    size: int  # Rows for results, items or characters otherwise
+    preview: str
+
+
+class PayloadStore:
+    """Bounded in-memory side store for large payloads referenced from the graph state."""
+
+    def __init__(self, max_items: int = 256):
+        self.max_items = max_items
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def put(self, value: Any, kind: str, size: int, preview: str) -> PayloadRef:
+        ref = PayloadRef(handle=f"{kind}:{uuid4()}", kind=kind, size=size, preview=preview)
+        with self.lock:
+            self.items[ref.handle] = value
+            while len(self.items) > self.max_items:
+                self.items.popitem(last=False)
+        return ref
+
+    def get(self, handle: str) -> Any:
+        """Returns the payload for a handle, or None once it has been evicted."""
+        with self.lock:
+            return self.items.get(handle)
+
+
+_store = None
+
+
+def get_payload_store() -> PayloadStore:
+    """Returns the process-wide PayloadStore."""
+    global _store
+    if _store is None:
+        _store = PayloadStore()
+    return _store
+
+
+def resolve(ref: PayloadRef) -> Any:
+    """Loads the full payload behind a reference (a DataFrame for query results)."""
+    if ref.kind == "result":
+        from utilities.result_store import get_result_store
+        return get_result_store().load(ref.handle)
+    return get_payload_store().get(ref.handle)
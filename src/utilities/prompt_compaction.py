@@ -0,0 +1,132 @@
+import functools
+import re
+import textwrap
+from typing import List, Optional
+
+from utilities.config import load_config
+
+# A template variable: {name} but not the escaped braces {{ ... }} of JSON examples
+_VARIABLE = re.compile(r"(?<!\{)\{([A-Za-z_][A-Za-z0-9_]*)\}(?!\})")
+# Lines with fewer words are structure (JSON braces, headings), not instructions to deduplicate
+_MIN_INSTRUCTION_WORDS = 5
+
+
+class PromptConfig:
+    """Settings of the [prompts] section of config.ini."""
+
+    def __init__(self, config=None):
+        config = config if config is not None else load_config()
+        self.compact = config.getboolean("prompts", "compact", fallback=False)
+        # Variables with the same value on every call, which may stay in the static prefix
+        static = config.get("prompts", "static_variables", fallback="team_members, options")
+        self.static_variables = {name.strip() for name in static.split(",") if name.strip()}
+        # Encoding used to count tokens of models tiktoken does not know
+        self.encoding = config.get("prompts", "encoding", fallback="cl100k_base")
+
+
+PROMPT_CONFIG = PromptConfig()
+_compact = None
+
+
+def set_prompt_compaction(enabled: Optional[bool] = None):
+    """
+    Turns prompt compaction on or off, e.g. to benchmark both variants. Only affects prompts
+    built afterwards; None restores the [prompts] compact setting.
+    """
+    global _compact
+    _compact = enabled
+
+
+def compaction_enabled() -> bool:
+    return PROMPT_CONFIG.compact if _compact is None else _compact
+
+
+def compact_prompt(template: str, static_variables=None) -> str:
+    """
+    Compacts a system prompt template without changing its instructions:
+    - whitespace: the indentation of the triple-quoted source, trailing spaces and runs of
+      blank lines and spaces are removed;
+    - duplicates: an instruction line repeating an earlier one is dropped;
+    - order: the paragraphs interpolating per-call values (e.g. {chat_history}), with the
+      lead-in line naming them, move to the end, so the static instructions form a prefix
+      that stays the same between calls and can be served from the provider's prompt cache.
+    """
+    static_variables = PROMPT_CONFIG.static_variables if static_variables is None else static_variables
+    # Paragraphs are dedented separately: text appended to a template (e.g. by create_agent) is not indented
+    seen = set()
+    paragraphs: List[List[str]] = []
+    for block in re.split(r"\n\s*\n", template):
+        paragraph = []
+        for line in textwrap.dedent(block).splitlines():
+            line = re.sub(r"(?<=\S) {2,}", " ", line.rstrip())
+            key = re.sub(r"\W+", " ", line).strip().lower()
+            if not key and not line.strip():
+                continue
+            if len(key.split()) >= _MIN_INSTRUCTION_WORDS:
+                if key in seen:
+                    continue
+                seen.add(key)
+            paragraph.append(line)
+        if paragraph:
+            paragraphs.append(paragraph)
+
+    def dynamic(line: str) -> bool:
+        return any(name not in static_variables for name in _VARIABLE.findall(line))
+
+    static, moved = [], []
+    for paragraph in paragraphs:
+        kept, block = [], []
+        for line in paragraph:
+            if dynamic(line):
+                # The lines ending in ":" right before the value introduce it and move with it
+                lead = []
+                while kept and kept[-1].endswith(":"):
+                    lead.insert(0, kept.pop())
+                # So does a one-line paragraph introducing a value that is a paragraph of its own
+                if not lead and not kept and len(paragraph) == 1 and static and len(static[-1]) == 1 \
+                        and static[-1][0].endswith(":"):
+                    lead = static.pop()
+                block.extend(lead + [line])
+            else:
+                kept.append(line)
+        if kept:
+            static.append(kept)
+        if block:
+            moved.append(block)
+
+    return "\n\n".join("\n".join(paragraph) for paragraph in static + moved)
+
+
+def format_chat_history(history) -> str:
+    """Renders the chat history as "role: content" lines instead of the repr of its list of dicts."""
+    if isinstance(history, str):
+        return history
+    lines = []
+    for entry in history or []:
+        if isinstance(entry, dict):
+            lines.append(f"{entry.get('role', 'user')}: {entry.get('content', '')}")
+        else:
+            lines.append(str(entry))
+    return "\n".join(lines) or "(none)"
+
+
+@functools.lru_cache(maxsize=None)
+def _encoding(model: str):
+    """The model's tiktoken encoding, or None when it cannot be loaded (its file is downloaded on first use)."""
+    try:
+        import tiktoken
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding(PROMPT_CONFIG.encoding)
+    except Exception as e:
+        print(f"Estimating token counts of {model}, tiktoken encoding unavailable: {e}")
+        return None
+
+
+def count_tokens(text: str, model: str = "gpt-4") -> int:
+    """Counts the tokens of a text with the model's encoding, else estimates them as 4 characters a token."""
+    encoding = _encoding(model)
+    if encoding is None:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text, disallowed_special=()))
@@ -0,0 +1,131 @@
+import re
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+from utilities.result_store import ResultStore
+
+DEFAULT_PAGE_SIZE = 50
+
+AGGREGATION_WORDS = {
+    "total": "sum", "sum": "sum", "average": "mean", "avg": "mean", "mean": "mean",
+    "minimum": "min", "min": "min", "lowest": "min", "maximum": "max", "max": "max",
+    "highest": "max", "count": "count", "number": "count",
+}
+
+
+@dataclass
+class FollowUp:
+    """A follow-up request that can be answered from the stored result of the previous run."""
+    action: str  # "page", "sort", "filter", "aggregate" or "raw"
+    offset: int = 0
+    limit: int = DEFAULT_PAGE_SIZE
+    sort_by: Optional[str] = None
+    ascending: bool = True
+    filters: dict = field(default_factory=dict)
+    column: Optional[str] = None
+    func: Optional[str] = None
+    group_by: Optional[str] = None
+
+
+# Phrases that refer back to the previous result
+_REFERENCE = r"(?:it|them|(?:that|this|these|those|the(?: last| previous)?)(?: results?| table| rows| data)?)"
+_REQUEST = r"(?:(?:please|now|ok|okay|and|then)\s+)*(?:(?:can|could) you\s+)?(?:(?:show|give|list|display|get)(?:\s+me)?\s+)?"
+_DIRECTIONS = r"asc|ascending|desc|descending|highest first|lowest first"
+
+
+def match_column(text: str, columns: List[str]) -> Optional[str]:
+    """Finds the result column a user names, ignoring case, underscores and plurals."""
+    def normalize(value):
+        return re.sub(r"[\s_]+", " ", value.strip().lower()).rstrip("s")
+
+    wanted = normalize(text)
+    for column in columns:
+        if wanted and normalize(column) == wanted:
+            return column
+    return None
+
+
+def parse_followup(text: str, columns: List[str], offset: int = 0,
+                   page_size: int = DEFAULT_PAGE_SIZE) -> Optional[FollowUp]:
+    """
+    Recognizes follow-ups such as "show me the next 50 rows", "sort that by revenue descending",
+    "only region EMEA" or "total revenue by region in these results". The whole message must
+    be the follow-up, refer to the previous result and name only its columns; anything else,
+    such as a year, a quarter or a word that is not a column, returns None so the question
+    goes through the full chain.
+    """
+    text = re.sub(r"\s+", " ", text.strip().lower().rstrip("?.! "))
+
+    # Results summarized in the database (see utilities/sql_pushdown.py) can be expanded to the raw rows
+    if re.fullmatch(_REQUEST + r"(?:the )?(?:raw|underlying|detailed|individual) (?:rows|records|data|results)"
+                    r"(?: (?:of|for|behind) " + _REFERENCE + ")?", text):
+        return FollowUp("raw", limit=page_size)
+
+    match = re.fullmatch(_REQUEST + r"(?:the )?(?:(next|previous|more)(?: (\d+))?(?: (?:rows|records|results|page))?"
+                         r"|(first|top) (\d+) (?:rows|records|results))(?: (?:of|from|in) " + _REFERENCE + ")?", text)
+    if match:
+        word = match.group(1) or match.group(3)
+        count = int(match.group(2) or match.group(4) or page_size)
+        if word in ("next", "more"):
+            return FollowUp("page", offset=offset + page_size, limit=count)
+        if word == "previous":
+            return FollowUp("page", offset=max(0, offset - count), limit=count)
+        return FollowUp("page", offset=0, limit=count)
+
+    match = re.fullmatch(r"(?:(?:please|now|and|then) )*(?:sort|order) " + _REFERENCE +
+                         rf" by (.+?)(?: ({_DIRECTIONS}))?", text)
+    if match and (column := match_column(match.group(1), columns)):
+        direction = match.group(2) or "asc"
+        return FollowUp("sort", sort_by=column, ascending=direction in ("asc", "ascending", "lowest first"),
+                        limit=page_size)
+
+    match = re.fullmatch(r"(?:only|just|filter " + _REFERENCE + r" (?:to|on|by|where)) (?:(?:the )?(?:rows|ones) "
+                         r"(?:with|where) )?(.+)", text)
+    if match:
+        filters = split_filter(match.group(1), columns)
+        if filters is not None:
+            return FollowUp("filter", filters=filters, limit=page_size)
+
+    match = re.fullmatch(r"(?:what(?: is|'s) )?(?:the )?(" + "|".join(AGGREGATION_WORDS) + r") (?:of )?(?:the )?(.+?)"
+                         r"(?: (?:by|per) (.+?))? (?:of|in|for|across) " + _REFERENCE, text)
+    if match and (column := match_column(match.group(2), columns)):
+        group_by = match_column(match.group(3), columns) if match.group(3) else None
+        if match.group(3) and group_by is None:
+            return None
+        return FollowUp("aggregate", column=column, func=AGGREGATION_WORDS[match.group(1)], group_by=group_by)
+
+    return None
+
+
+def split_filter(text: str, columns: List[str]) -> Optional[dict]:
+    """
+    Splits "region EMEA", "region is 'EMEA'" or "account type = partner" into a filter on a
+    result column. Returns None when the text does not start with a column name followed by a value.
+    """
+    words = text.split(" ")
+    for end in range(len(words) - 1, 0, -1):
+        column = match_column(" ".join(words[:end]), columns)
+        if column is None:
+            continue
+        value = re.sub(r"^(?:=|is|equals|equal to)\s*", "", " ".join(words[end:])).strip().strip("'\"")
+        return {column: value} if value else None
+    return None
+
+
+def answer_followup(store: ResultStore, run_id: str, followup: FollowUp):
+    """Runs a follow-up against the stored result. Returns (description, DataFrame)."""
+    if followup.action == "aggregate":
+        df = store.aggregate(run_id, followup.column, followup.func, followup.group_by)
+        grouping = f" by {followup.group_by}" if followup.group_by else ""
+        return f"{followup.func} of {followup.column}{grouping}:", df
+
+    df = store.page(run_id, offset=followup.offset, limit=followup.limit, sort_by=followup.sort_by,
+                    ascending=followup.ascending, filters=followup.filters)
+    if followup.action == "raw":
+        return f"Raw rows 1-{len(df)} of {len(store.load(run_id))}:", df
+    if followup.action == "filter":
+        return f"{len(df)} rows where {', '.join(f'{k} = {v}' for k, v in followup.filters.items())}:", df
+    total = len(store.load(run_id))
+    if df.empty:
+        return f"No more rows (the result has {total} rows).", df
+    return f"Rows {followup.offset + 1}-{followup.offset + len(df)} of {total}:", df
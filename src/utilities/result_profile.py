@@ -0,0 +1,112 @@
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+
+
+def _format(value) -> str:
+    if isinstance(value, (float, np.floating)):
+        return f"{value:,.2f}"
+    if isinstance(value, pd.Timestamp):
+        return value.strftime("%Y-%m-%d")
+    return str(value)
+
+
+def _date_columns(df: pd.DataFrame) -> List[str]:
+    """Returns datetime columns, including text/date columns whose values all parse as dates."""
+    columns = []
+    for column in df.columns:
+        series = df[column]
+        if pd.api.types.is_datetime64_any_dtype(series):
+            columns.append(column)
+        elif series.dtype == object and len(series.dropna()):
+            sample = series.dropna().head(20)
+            if all(hasattr(value, "year") for value in sample) or (
+                sample.astype(str).str.match(r"^\d{4}-\d{2}-\d{2}").all()
+            ):
+                columns.append(column)
+    return columns
+
+
+def profile_result(df: pd.DataFrame, top_n: int = 5, max_columns: int = 12,
+                   max_categories: int = 50) -> str:
+    """
+    Summarizes a query result locally so the formatting agent reads a profile of bounded size
+    instead of the rows: column statistics, top values, group totals, period-over-period
+    changes of date columns and outliers. The size of the output does not depend on the
+    number of rows.
+
+    Args:
+        df: The full query result.
+        top_n: Number of top values, groups and periods listed.
+        max_columns: Number of columns profiled.
+        max_categories: Text columns with more distinct values are not used for grouping.
+
+    Returns:
+        str: The profile as indented text.
+    """
+    lines = [f"Rows: {len(df)}", f"Columns: {', '.join(map(str, df.columns))}"]
+    if df.empty:
+        return "\n".join(lines)
+    df = df.iloc[:, :max_columns]
+
+    date_columns = _date_columns(df)
+    numeric = [c for c in df.columns if pd.api.types.is_numeric_dtype(df[c]) and not pd.api.types.is_bool_dtype(df[c])]
+    # Identifier columns are numeric but summing them means nothing
+    measures = [c for c in numeric if not (str(c).lower() == "id" or str(c).lower().endswith("_id"))]
+    categories = [
+        c for c in df.columns
+        if c not in numeric and c not in date_columns and df[c].nunique(dropna=True) <= max_categories
+    ]
+
+    for column in measures:
+        values = df[column].dropna().astype(float)
+        if values.empty:
+            continue
+        lines.append(
+            f"{column}: sum {_format(values.sum())}, mean {_format(values.mean())}, "
+            f"min {_format(values.min())}, max {_format(values.max())}, nulls {int(df[column].isna().sum())}"
+        )
+        # Outliers by the interquartile range rule
+        q1, q3 = np.percentile(values, [25, 75])
+        spread = q3 - q1
+        if spread > 0:
+            outliers = values[(values < q1 - 1.5 * spread) | (values > q3 + 1.5 * spread)]
+            if len(outliers):
+                shown = ", ".join(_format(v) for v in outliers.sort_values(ascending=False).head(top_n))
+                lines.append(f"  outliers ({len(outliers)}): {shown}")
+
+    for column in categories:
+        counts = df[column].value_counts(dropna=False)
+        shown = ", ".join(f"{value} ({count})" for value, count in counts.head(top_n).items())
+        lines.append(f"{column}: {len(counts)} distinct; top {shown}")
+        # Group totals of the first measure by this column
+        if measures:
+            totals = df.groupby(column, dropna=False)[measures[0]].sum().sort_values(ascending=False)
+            shown = ", ".join(f"{value} {_format(total)}" for value, total in totals.head(top_n).items())
+            lines.append(f"  {measures[0]} by {column}: {shown}")
+
+    for column in date_columns:
+        dates = pd.to_datetime(df[column], errors="coerce")
+        if dates.notna().sum() == 0:
+            continue
+        lines.append(f"{column}: from {_format(dates.min())} to {_format(dates.max())}")
+        if measures:
+            # Monthly totals of the first measure and their change from the previous month
+            monthly = df[measures[0]].groupby(dates.dt.to_period("M")).sum()
+            if len(monthly) > 1:
+                change = monthly.pct_change() * 100
+                shown = ", ".join(
+                    f"{period} {_format(total)}" + (f" ({change[period]:+.0f}%)" if np.isfinite(change[period]) else "")
+                    for period, total in monthly.tail(top_n).items()
+                )
+                lines.append(f"  {measures[0]} by month (last {min(top_n, len(monthly))}): {shown}")
+
+    return "\n".join(lines)
+
+
+def profile_run(run_id: str, **kwargs) -> Optional[str]:
+    """Profiles the stored result of a run, or returns None if it has no stored result."""
+    from utilities.result_store import get_result_store
+    df = get_result_store().load(run_id)
+    return profile_result(df, **kwargs) if df is not None else None
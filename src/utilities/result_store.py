@@ -0,0 +1,162 @@
+import io
+import json
+import os
+import threading
+from collections import OrderedDict
+from decimal import Decimal
+from typing import List, Optional
+import pandas as pd
+
+# Query results are spilled next to the app so follow-ups can be answered locally
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "temp", "results")
+
+AGGREGATIONS = ("sum", "mean", "min", "max", "count")
+
+
+class ResultStore:
+    """
+    Stores SQL query results on disk by run id and answers paging, sorting,
+    filtering and aggregation follow-ups over them with pandas, so a follow-up
+    question neither regenerates SQL nor queries Postgres again.
+    """
+
+    def __init__(self, directory: str = RESULTS_DIR, cache_size: int = 8, shared=None,
+                 shared_ttl_seconds: float = 86400):
+        self.directory = directory
+        self.cache_size = cache_size
+        # State store of a shared [state_backend]: results are also kept there for the other replicas
+        self.shared = shared
+        self.shared_ttl_seconds = shared_ttl_seconds
+        self.cache = OrderedDict()  # run_id -> DataFrame, most recently used last
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, run_id: str, extension: str) -> str:
+        return os.path.join(self.directory, f"{run_id}.{extension}")
+
+    def _write(self, run_id: str, extension: str, content: bytes):
+        """
+        Writes a result file, first removing the run's file of the other format: load() prefers
+        parquet, so a stale one would hide pickled rows saved in place of it (e.g. raw rows
+        replacing an aggregate).
+        """
+        for other in ("parquet", "pkl"):
+            if other != extension and os.path.exists(self._path(run_id, other)):
+                os.remove(self._path(run_id, other))
+        with open(self._path(run_id, extension), "wb") as file:
+            file.write(content)
+
+    def save(self, run_id: str, columns: List[str], rows: list) -> pd.DataFrame:
+        """Persists a result set under the run id and returns it as a DataFrame."""
+        df = pd.DataFrame.from_records(rows, columns=columns)
+        # Postgres numeric columns arrive as Decimal objects; store them as floats for local analysis
+        for column in df.columns[df.dtypes == object]:
+            values = df[column].dropna()
+            if len(values) and all(isinstance(value, Decimal) for value in values):
+                df[column] = df[column].astype(float)
+        buffer = io.BytesIO()
+        try:
+            df.to_parquet(buffer, index=False)
+            extension = "parquet"
+        except Exception:
+            # Columns pyarrow can't represent (e.g. mixed types) fall back to pickle
+            buffer = io.BytesIO()
+            df.to_pickle(buffer, compression=None)
+            extension = "pkl"
+        self._write(run_id, extension, buffer.getvalue())
+        if self.shared is not None:
+            self.shared.set("results", run_id, extension.encode() + b"\n" + buffer.getvalue(), self.shared_ttl_seconds)
+        with self.lock:
+            self._remember(run_id, df)
+        return df
+
+    def save_meta(self, run_id: str, meta: dict):
+        """Stores details about how a run's result was produced, such as the query behind an aggregate."""
+        with open(self._path(run_id, "json"), "w") as file:
+            json.dump(meta, file, default=str)
+        if self.shared is not None:
+            self.shared.set("result_meta", run_id, json.dumps(meta, default=str).encode(), self.shared_ttl_seconds)
+
+    def load_meta(self, run_id: str) -> Optional[dict]:
+        if not os.path.exists(self._path(run_id, "json")):
+            data = self.shared.get("result_meta", run_id) if self.shared is not None else None
+            return json.loads(data) if data is not None else None
+        with open(self._path(run_id, "json")) as file:
+            return json.load(file)
+
+    def exists(self, run_id: str) -> bool:
+        if any(os.path.exists(self._path(run_id, ext)) for ext in ("parquet", "pkl")):
+            return True
+        return self._fetch_shared(run_id)
+
+    def _fetch_shared(self, run_id: str) -> bool:
+        """Copies a result stored by another replica from the shared store to the local directory."""
+        data = self.shared.get("results", run_id) if self.shared is not None else None
+        if data is None:
+            return False
+        extension, content = data.split(b"\n", 1)
+        self._write(run_id, extension.decode(), content)
+        return True
+
+    def load(self, run_id: str) -> Optional[pd.DataFrame]:
+        """Returns the stored result of a run, or None if there is none."""
+        with self.lock:
+            if run_id in self.cache:
+                self.cache.move_to_end(run_id)
+                return self.cache[run_id]
+
+        if not self.exists(run_id):
+            return None
+        if os.path.exists(self._path(run_id, "parquet")):
+            df = pd.read_parquet(self._path(run_id, "parquet"))
+        else:
+            df = pd.read_pickle(self._path(run_id, "pkl"))
+
+        with self.lock:
+            self._remember(run_id, df)
+        return df
+
+    def _remember(self, run_id: str, df: pd.DataFrame):
+        """Caches a loaded result, evicting the least recently used. Must be called with the lock held."""
+        self.cache[run_id] = df
+        self.cache.move_to_end(run_id)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def page(self, run_id: str, offset: int = 0, limit: int = 50, sort_by: str = None,
+             ascending: bool = True, filters: dict = None) -> Optional[pd.DataFrame]:
+        """Returns rows [offset, offset + limit) of a run's result after optional filtering and sorting."""
+        df = self.load(run_id)
+        if df is None:
+            return None
+        for column, value in (filters or {}).items():
+            df = df[df[column].astype(str).str.lower() == str(value).lower()]
+        if sort_by:
+            df = df.sort_values(sort_by, ascending=ascending, kind="stable")
+        return df.iloc[offset:offset + limit]
+
+    def aggregate(self, run_id: str, column: str, func: str = "sum",
+                  group_by: str = None) -> Optional[pd.DataFrame]:
+        """Aggregates a column of a run's result, optionally grouped by another column."""
+        if func not in AGGREGATIONS:
+            raise ValueError(f"Unsupported aggregation '{func}', expected one of {AGGREGATIONS}")
+        df = self.load(run_id)
+        if df is None:
+            return None
+        if group_by:
+            result = df.groupby(group_by, dropna=False)[column].agg(func).reset_index()
+            return result.sort_values(column, ascending=False)
+        return pd.DataFrame({column: [df[column].agg(func)]})
+
+
+_store = None
+
+
+def get_result_store() -> ResultStore:
+    """Returns the process-wide ResultStore shared by the SQL tool and the UI."""
+    global _store
+    if _store is None:
+        from utilities.state_backend import StateBackendConfig, get_state_store
+        _store = ResultStore(shared=get_state_store(),
+                             shared_ttl_seconds=StateBackendConfig().result_ttl_seconds)
+    return _store
@@ -0,0 +1,108 @@
+import os
+import threading
+from langchain_core.callbacks import BaseCallbackHandler
+from utilities.run_context import RunHandle
+
+
+class CancellationCallbackHandler(BaseCallbackHandler):
+    """Stops a cancelled run at the next chain, LLM, tool or streamed token boundary."""
+
+    raise_error = True
+
+    def __init__(self, handle: RunHandle):
+        self.handle = handle
+
+    def on_chain_start(self, serialized, inputs, **kwargs):
+        self.handle.check()
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        self.handle.check()
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        self.handle.check()
+
+    def on_llm_new_token(self, token, **kwargs):
+        self.handle.check()
+
+    def on_tool_start(self, serialized, input_str, **kwargs):
+        self.handle.check()
+
+
+class UsageCallbackHandler(BaseCallbackHandler):
+    """Counts the LLM calls of a run and the tokens they used."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.llm_calls = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+
+    def on_llm_end(self, response, **kwargs):
+        input_tokens = output_tokens = 0
+        for generations in response.generations:
+            for generation in generations:
+                # Chat models report usage on the message; streamed OpenAI calls need stream_usage
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                input_tokens += usage.get("input_tokens", 0)
+                output_tokens += usage.get("output_tokens", 0)
+        with self.lock:
+            self.llm_calls += 1
+            self.input_tokens += input_tokens
+            self.output_tokens += output_tokens
+
+    def totals(self) -> dict:
+        with self.lock:
+            return {
+                "llm_calls": self.llm_calls,
+                "input_tokens": self.input_tokens,
+                "output_tokens": self.output_tokens,
+            }
+
+
+class PromptProfileCallbackHandler(BaseCallbackHandler):
+    """
+    Counts the prompt tokens sent by each graph node, split into the system prompt and the
+    conversation messages, and the tokens of the system prompt prefix that stayed the same
+    across the node's calls (the part a provider's prompt cache can serve).
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.nodes = {}
+
+    def on_chat_model_start(self, serialized, messages, *, metadata=None, **kwargs):
+        from utilities.prompt_compaction import count_tokens
+        node = (metadata or {}).get("langgraph_node") or "unknown"
+        model = ((kwargs.get("invocation_params") or {}).get("model_name")
+                 or (kwargs.get("invocation_params") or {}).get("model") or "gpt-4")
+        for prompt in messages:
+            system = "".join(str(m.content) for m in prompt if m.type == "system")
+            system_tokens = count_tokens(system, model)
+            message_tokens = sum(count_tokens(str(m.content), model) for m in prompt if m.type != "system")
+            with self.lock:
+                entry = self.nodes.setdefault(node, {"calls": 0, "system_tokens": 0, "message_tokens": 0,
+                                                     "max_tokens": 0, "model": model, "prefix": system})
+                entry["calls"] += 1
+                entry["system_tokens"] += system_tokens
+                entry["message_tokens"] += message_tokens
+                entry["max_tokens"] = max(entry["max_tokens"], system_tokens + message_tokens)
+                entry["prefix"] = os.path.commonprefix([entry["prefix"], system])
+
+    def report(self) -> dict:
+        """Returns the prompt tokens per node, largest total first."""
+        from utilities.prompt_compaction import count_tokens
+        with self.lock:
+            nodes = {node: dict(entry) for node, entry in self.nodes.items()}
+        report = {}
+        for node, entry in sorted(nodes.items(), key=lambda item: -(item[1]["system_tokens"] + item[1]["message_tokens"])):
+            total = entry["system_tokens"] + entry["message_tokens"]
+            report[node] = {
+                "calls": entry["calls"],
+                "system_tokens": entry["system_tokens"],
+                "message_tokens": entry["message_tokens"],
+                "total_tokens": total,
+                "mean_tokens": round(total / entry["calls"]),
+                "max_tokens": entry["max_tokens"],
+                "static_prefix_tokens": count_tokens(entry["prefix"], entry["model"]),
+            }
+        return report
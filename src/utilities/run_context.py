@@ -0,0 +1,90 @@
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Optional
+from uuid import uuid4
+
+
+class RunCancelled(Exception):
+    """Raised when a graph run is cancelled while it is still executing."""
+
+
+class RunHandle:
+    """
+    Handle for a single graph run, used for cooperative cancellation.
+
+    Code that starts a blocking operation (such as a database query) registers
+    a cancel function for its duration so that cancel() can interrupt it.
+    """
+
+    def __init__(self, run_id: str = None):
+        self.run_id = run_id or str(uuid4())
+        self.cancelled = threading.Event()
+        self.lock = threading.Lock()
+        self.cancel_functions = []
+        self.payloads = {}  # State field -> PayloadRef published by tools, see publish_payload
+        self.trace = None  # RunTrace of the run while it is traced, see utilities/tracing.py
+
+    def cancel(self):
+        """Marks the run as cancelled and interrupts any registered in-flight operation."""
+        with self.lock:
+            self.cancelled.set()
+            cancel_functions = list(self.cancel_functions)
+        for cancel_function in cancel_functions:
+            try:
+                cancel_function()
+            except Exception as e:
+                print(f"Error cancelling run {self.run_id}: {e}")
+
+    def check(self):
+        """Raises RunCancelled if the run has been cancelled."""
+        if self.cancelled.is_set():
+            raise RunCancelled(self.run_id)
+
+    def take_payloads(self) -> dict:
+        """Returns and clears the payload references published since the last call."""
+        with self.lock:
+            payloads, self.payloads = self.payloads, {}
+        return payloads
+
+    @contextmanager
+    def cancel_scope(self, cancel_function: Callable[[], None]):
+        """Registers cancel_function for the duration of the block."""
+        with self.lock:
+            self.cancel_functions.append(cancel_function)
+        try:
+            # The run may have been cancelled before the operation registered itself
+            self.check()
+            yield
+        finally:
+            with self.lock:
+                self.cancel_functions.remove(cancel_function)
+
+
+_current_run: ContextVar[Optional[RunHandle]] = ContextVar("current_run", default=None)
+
+
+def current_run() -> Optional[RunHandle]:
+    """Returns the handle of the run executing in the current context, if any."""
+    return _current_run.get()
+
+
+@contextmanager
+def bind_run(handle: RunHandle):
+    """Makes handle the current run for the duration of the block."""
+    token = _current_run.set(handle)
+    try:
+        yield handle
+    finally:
+        _current_run.reset(token)
+
+
+def publish_payload(field: str, ref):
+    """
+    Called by tools to hand a PayloadRef for a state field (e.g. execution_results) to the
+    agent node running them, which adds it to the graph state update.
+    """
+    run = current_run()
+    if run is not None:
+        with run.lock:
+            run.payloads[field] = ref
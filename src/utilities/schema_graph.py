@@ -0,0 +1,177 @@
+import hashlib
+import json
+import re
+import threading
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+# Columns that appear in most tables and say nothing about which table a question is about
+GENERIC_COLUMNS = {"id", "name", "description", "status", "type", "created_at", "updated_at"}
+
+
+def metadata_version(metadata: List[dict]) -> str:
+    """Hashes the metadata rows, so a schema graph is rebuilt only when the metadata changes."""
+    rows = sorted(
+        json.dumps([row.get(key) for key in ("schema_name", "table_name", "column_name", "constraint_type")])
+        for row in metadata
+    )
+    return hashlib.sha256("\n".join(rows).encode()).hexdigest()
+
+
+def singular(word: str) -> str:
+    if word.endswith("ies"):
+        return word[:-3] + "y"
+    if word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+class SchemaGraph:
+    """
+    Tables of the metadata_table as nodes and their foreign key relations as edges.
+
+    metadata_table records that a column has a FOREIGN KEY constraint but not which table it
+    references, so the target is the table whose primary key column has the same name
+    (orders.account_id -> accounts.account_id).
+    """
+
+    def __init__(self, metadata: List[dict]):
+        self.columns: Dict[str, List[Tuple[str, str]]] = {}  # table -> [(column, data type)]
+        primary_keys: Dict[str, List[str]] = {}  # primary key column -> tables
+        foreign_keys = []  # (table, column)
+        for row in metadata:
+            table = f"{row['schema_name']}.{row['table_name']}"
+            self.columns.setdefault(table, []).append((row["column_name"], row.get("data_type")))
+            constraint = (row.get("constraint_type") or "").upper()
+            if constraint == "PRIMARY KEY":
+                primary_keys.setdefault(row["column_name"], []).append(table)
+            elif constraint == "FOREIGN KEY":
+                foreign_keys.append((table, row["column_name"]))
+
+        # table -> [(other table, column in table, column in other table)]
+        self.edges: Dict[str, List[Tuple[str, str, str]]] = {table: [] for table in self.columns}
+        for table, column in foreign_keys:
+            for target in primary_keys.get(column, []):
+                if target != table:
+                    self.edges[table].append((target, column, column))
+                    self.edges[target].append((table, column, column))
+
+        # Words that identify a table in a question: its name, singular name and distinctive columns
+        column_tables: Dict[str, set] = {}
+        for table, columns in self.columns.items():
+            for column, _ in columns:
+                column_tables.setdefault(column.lower(), set()).add(table)
+        self.keywords: Dict[str, set] = {}
+        self.names: Dict[str, set] = {}  # Keywords that are a table's own name -> tables
+        for table in self.columns:
+            name = table.split(".", 1)[1].lower()
+            for word in {name, singular(name), name.replace("_", " "), singular(name).replace("_", " ")}:
+                self.keywords.setdefault(word, set()).add(table)
+                self.names.setdefault(word, set()).add(table)
+        for column, tables in column_tables.items():
+            if len(tables) == 1 and column not in GENERIC_COLUMNS and not column.endswith("_id"):
+                self.keywords.setdefault(column, set()).update(tables)
+                self.keywords.setdefault(column.replace("_", " "), set()).update(tables)
+
+    def relevant_tables(self, text: str) -> List[str]:
+        """
+        Returns the tables a question mentions by name, singular name or a column unique to
+        them, most relevant first: a mention of the table's name scores 2 and of a column 1.
+        """
+        words = re.findall(r"[a-z0-9_]+", text.lower())
+        phrases = set(words) | {f"{a} {b}" for a, b in zip(words, words[1:])}
+        phrases |= {singular(word) for word in words}
+        scores: Dict[str, int] = {}
+        for phrase in phrases:
+            for table in self.keywords.get(phrase, set()):
+                scores[table] = scores.get(table, 0) + (2 if table in self.names.get(phrase, ()) else 1)
+        return sorted(scores, key=lambda table: (-scores[table], table))
+
+    def shortest_path(self, start: str, targets: set) -> Optional[List[Tuple[str, str, str, str]]]:
+        """Breadth-first search from start to the nearest target; returns the joins along the path."""
+        previous = {start: None}
+        queue = deque([start])
+        while queue:
+            table = queue.popleft()
+            if table in targets:
+                joins = []
+                while previous[table] is not None:
+                    parent, column, other_column = previous[table]
+                    joins.append((parent, column, table, other_column))
+                    table = parent
+                return list(reversed(joins))
+            for other, column, other_column in self.edges.get(table, []):
+                if other not in previous:
+                    previous[other] = (table, column, other_column)
+                    queue.append(other)
+        return None
+
+    def join_path(self, tables: List[str]) -> List[Tuple[str, str, str, str]]:
+        """
+        Returns the joins (table, column, other table, other column) connecting the tables,
+        growing a tree from the first table by repeatedly adding the nearest remaining table.
+        Intermediate tables needed to connect them are included.
+        """
+        if not tables:
+            return []
+        connected = {tables[0]}
+        remaining = set(tables[1:])
+        joins = []
+        while remaining:
+            best = None
+            for table in connected:
+                path = self.shortest_path(table, remaining)
+                if path is not None and (best is None or len(path) < len(best)):
+                    best = path
+            if best is None:
+                break  # The remaining tables are not connected by foreign keys
+            for join in best:
+                if join[2] not in connected:
+                    joins.append(join)
+                    connected.add(join[2])
+            remaining -= connected
+        return joins
+
+    def relevant_joins(self, text: str, max_tables: int = 8) -> Tuple[List[str], List[Tuple[str, str, str, str]]]:
+        """Returns the max_tables most relevant tables of a question and the joins connecting them."""
+        tables = self.relevant_tables(text)[:max_tables]
+        return tables, self.join_path(tables)
+
+    def hint(self, text: str, max_tables: int = 8) -> str:
+        """
+        Returns a compact description of the tables relevant to a question and the joins
+        between them, for the SQL generation prompt. Empty when no table is recognized.
+        Beyond max_tables tables, the least relevant ones are left out.
+        """
+        return self.describe(*self.relevant_joins(text, max_tables))
+
+    def describe(self, tables: List[str], joins: List[Tuple[str, str, str, str]]) -> str:
+        """Describes tables and joins returned by relevant_joins, as hint() does."""
+        if not tables:
+            return ""
+        involved = list(dict.fromkeys(tables + [join[2] for join in joins]))
+        lines = ["Tables:"]
+        for table in involved:
+            columns = ", ".join(f"{column} {data_type}" if data_type else column
+                                for column, data_type in self.columns[table])
+            lines.append(f"- {table}({columns})")
+        if joins:
+            lines.append("Joins:")
+            lines.extend(f"- {table}.{column} = {other}.{other_column}" for table, column, other, other_column in joins)
+        return "\n".join(lines)
+
+
+_graphs = {}  # metadata version -> SchemaGraph
+_graphs_lock = threading.Lock()
+
+
+def get_schema_graph(metadata: List[dict]) -> SchemaGraph:
+    """Returns the schema graph for the metadata, building it once per metadata version."""
+    version = metadata_version(metadata)
+    with _graphs_lock:
+        if version not in _graphs:
+            # Only the latest few versions are kept; older ones belong to replaced metadata
+            while len(_graphs) >= 4:
+                _graphs.pop(next(iter(_graphs)))
+            _graphs[version] = SchemaGraph(metadata)
+        return _graphs[version]
@@ -0,0 +1,90 @@
+import re
+from typing import List, Optional
+
+from utilities.config import load_config
+
+# Words that refer to earlier turns; such questions depend on the chat history the raw question lacks
+_REFERENCES = {"it", "that", "those", "them", "these", "same", "above", "previous", "again"}
+_MONTHS = "january|february|march|april|june|july|august|september|october|november|december"
+# Values that constrain a query: numbers and dates, quoted strings, months, quarters and relative periods
+_CONSTRAINT = re.compile(
+    r"\d+(?:[.,:/-]\d+)*|'[^']+'|\"[^\"]+\""
+    rf"|\b(?:{_MONTHS})\b|\bmay\s+\d+|\bq[1-4]\b|\b(?:today|yesterday|ytd)\b"
+    r"|\b(?:last|past|previous|this|current|next)\s+(?:\d+\s+)?(?:day|week|month|quarter|year)s?\b",
+    re.IGNORECASE,
+)
+
+
+class SpeculationConfig:
+    """Settings of the [speculation] section of config.ini."""
+
+    def __init__(self, config=None):
+        config = config if config is not None else load_config()
+        self.enabled = config.getboolean("speculation", "enabled", fallback=False)
+        # Questions shorter or longer than this are not considered clearly specified
+        self.min_words = config.getint("speculation", "min_words", fallback=4)
+        self.max_words = config.getint("speculation", "max_words", fallback=40)
+        # Tables the question must name (see SchemaGraph.relevant_tables)
+        self.min_tables = config.getint("speculation", "min_tables", fallback=1)
+        # Threads generating speculative SQL, per graph
+        self.workers = config.getint("speculation", "workers", fallback=4)
+
+
+SPECULATION_CONFIG = SpeculationConfig()
+
+
+def clearly_specified(question: str, tables: List[str], config: SpeculationConfig = None) -> bool:
+    """
+    Whether SQL can be generated straight from the question: it names at least min_tables
+    tables, has a moderate length and does not refer back to earlier turns.
+    """
+    config = config or SPECULATION_CONFIG
+    words = re.findall(r"[a-z0-9_']+", question.lower())
+    if not config.min_words <= len(words) <= config.max_words:
+        return False
+    if _REFERENCES & set(words):
+        return False
+    return len(tables) >= config.min_tables
+
+
+def constraint_literals(text: str) -> set:
+    """Returns the numbers, dates, quoted values and periods in a text, lower-cased."""
+    return {re.sub(r"\s+", " ", match.lower().strip("'\"")) for match in _CONSTRAINT.findall(text or "")}
+
+
+def stored_values(values: List[str]) -> set:
+    """The "table.column = 'value'" parts of value hints, without the literal they resolve."""
+    return {value.split(" -> ", 1)[-1] for value in values}
+
+
+def speculation_mismatch(speculative: dict, state, context: dict) -> Optional[str]:
+    """
+    Returns why SQL generated speculatively from the raw question does not fit the final
+    requirements and generated prompt, or None when it can be used. They agree when the
+    tables, joins and stored filter values the prompt leads to (context, see
+    SQLTeam.schema_context) were all known to the speculation and the prompt adds no
+    constraint values missing from the question.
+    """
+    question = state.get("question") or ""
+    if speculative.get("question") != question:
+        return "it was generated for another question"
+    if not speculative.get("sql_query"):
+        return "no SQL was generated"
+    known = speculative["context"]
+    tables = set(context["tables"]) - set(known["tables"])
+    if tables:
+        return f"the generated prompt involves {', '.join(sorted(tables))}"
+    if not set(map(tuple, context["joins"])) <= set(map(tuple, known["joins"])):
+        return "the generated prompt joins the tables differently"
+    values = stored_values(context["values"]) - stored_values(known["values"])
+    if values:
+        return f"the generated prompt filters on {', '.join(sorted(values))}"
+    requirements = state.get("data_requirements") or {}
+    if not isinstance(requirements, dict):
+        requirements = {}
+    final = " ".join([state.get("generated_prompt") or "", str(requirements.get("time_frame") or ""),
+                      str(requirements.get("filters_criteria") or "")])
+    added = constraint_literals(final) - constraint_literals(question)
+    if added:
+        return f"the generated prompt adds {', '.join(sorted(added))}"
+    return None
@@ -0,0 +1,179 @@
+import configparser
+import json
+from typing import Iterable, List, Optional
+
+from utilities.config import load_config
+
+# Postgres type OIDs of the result columns that can be summed or grouped by month
+NUMERIC_TYPES = {20, 21, 23, 700, 701, 1700}  # int8, int2, int4, float4, float8, numeric
+DATE_TYPES = {1082, 1114, 1184}  # date, timestamp, timestamptz
+TEXT_TYPES = {18, 25, 1042, 1043}  # char, text, bpchar, varchar
+
+
+class PushdownConfig:
+    """Settings of the aggregation pushdown for large query results ([pushdown])."""
+
+    def __init__(self, config: configparser.ConfigParser = None):
+        config = config if config is not None else load_config()
+        self.enabled = config.getboolean("pushdown", "enabled", fallback=True)
+        self.row_threshold = config.getint("pushdown", "row_threshold", fallback=10000)
+        self.max_groups = config.getint("pushdown", "max_groups", fallback=500)
+        self.max_group_columns = config.getint("pushdown", "max_group_columns", fallback=2)
+        self.sample_rows = config.getint("pushdown", "sample_rows", fallback=1000)
+
+
+def quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def estimate_rows(cursor, query: str, statement=None) -> Optional[int]:
+    """
+    Returns the planner's row estimate for a query, or None if it cannot be explained. With the
+    statement prepare_query returned for the query, the prepared statement is explained, which
+    reuses its cached plan instead of planning the literal query.
+    """
+    if statement is not None:
+        from utilities.sql_templates import execute_statement
+        execute_statement(cursor, statement, explain=True)
+    else:
+        cursor.execute(f"EXPLAIN (FORMAT JSON) {query}")
+    plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+def source_columns(cursor, description) -> dict:
+    """
+    Returns the "schema.table.column" each result column was read from, lower-cased, for the
+    result columns taken straight from a table column.
+    """
+    sources = {column.name: (column.table_oid, column.table_column) for column in description
+               if getattr(column, "table_oid", None)}
+    if not sources:
+        return {}
+    cursor.execute(
+        "SELECT c.oid, a.attnum, n.nspname || '.' || c.relname || '.' || a.attname FROM pg_attribute a "
+        "JOIN pg_class c ON c.oid = a.attrelid JOIN pg_namespace n ON n.oid = c.relnamespace "
+        "WHERE c.oid = ANY(%s::oid[])",
+        (list({oid for oid, _ in sources.values()}),)
+    )
+    names = {(oid, attnum): name.lower() for oid, attnum, name in cursor.fetchall()}
+    return {column: names[key] for column, key in sources.items() if key in names}
+
+
+def measure_select(measures: List[str]) -> List[str]:
+    """The COUNT and SUM/MIN/MAX expressions of the rollup and its totals."""
+    select = ['COUNT(*) AS "row_count"']
+    for name in measures:
+        select += [f"SUM({quote(name)}) AS {quote(name + '_sum')}",
+                   f"MIN({quote(name)}) AS {quote(name + '_min')}",
+                   f"MAX({quote(name)}) AS {quote(name + '_max')}"]
+    return select
+
+
+def rollup_query(query: str, description, low_cardinality: Iterable[str], config: PushdownConfig,
+                 sources: dict = None):
+    """
+    Builds the aggregate query that replaces a large result: COUNT and SUM/MIN/MAX of the
+    numeric columns, grouped by known low-cardinality text columns and by the month of the
+    first date column. low_cardinality holds "schema.table.column" names and sources maps the
+    result columns to theirs (see source_columns). The query returns at most max_groups + 1
+    groups, the largest first, so that a truncated rollup can be told apart.
+    Returns (SQL, group columns, measure columns).
+    """
+    low_cardinality = {name.lower() for name in low_cardinality}
+    sources = sources or {}
+    names = [column[0] for column in description]
+    if len(set(names)) != len(names):
+        raise ValueError("Result has duplicate column names")
+    types = {column[0]: column[1] for column in description}
+
+    groups = [name for name in names if types[name] in TEXT_TYPES and sources.get(name) in low_cardinality]
+    groups = groups[:config.max_group_columns]
+    select, group_by = [quote(name) for name in groups], [quote(name) for name in groups]
+    dates = [name for name in names if types[name] in DATE_TYPES]
+    if dates:
+        month = f"date_trunc('month', {quote(dates[0])})"
+        select.append(f"{month} AS {quote(dates[0] + '_month')}")
+        group_by.append(month)
+        groups.append(dates[0] + "_month")
+
+    measures = [name for name in names if types[name] in NUMERIC_TYPES and not name.lower().endswith("_id")]
+    select += measure_select(measures)
+
+    sql = f"SELECT {', '.join(select)} FROM ({query}) AS raw"
+    if group_by:
+        sql += f" GROUP BY {', '.join(group_by)} ORDER BY \"row_count\" DESC LIMIT {config.max_groups + 1}"
+    return sql, groups, measures
+
+
+def totals_query(query: str, measures: List[str]) -> str:
+    """Builds the query of the rollup's measures over all raw rows, for rollups cut to max_groups."""
+    return f"SELECT {', '.join(measure_select(measures))} FROM ({query}) AS raw"
+
+
+def sample_query(query: str, estimated_rows: int, config: PushdownConfig) -> str:
+    """
+    Builds a query returning about sample_rows random rows of the result. TABLESAMPLE only
+    applies to base tables, so the rows of the arbitrary query are filtered with random().
+    """
+    fraction = min(1.0, 2.0 * config.sample_rows / max(estimated_rows, 1))
+    return f"SELECT * FROM ({query}) AS raw WHERE random() < {fraction:.6f} LIMIT {config.sample_rows}"
+
+
+def run_pushdown(conn, query: str, low_cardinality: Iterable[str], config: PushdownConfig,
+                 statement=None) -> Optional[dict]:
+    """
+    Runs the rollup and sample queries instead of the query when the planner estimates more
+    than row_threshold rows. Returns None when the query should be run as it is. statement is
+    the prepared statement of the query, if any (see estimate_rows).
+
+    Returns:
+        dict: columns and rows of the rollup, sample_columns and sample_rows, estimated_rows,
+        group_by and measures. When the rollup had more than max_groups groups, only the largest
+        are in rows, truncated is set and totals holds row_count and the measures over all raw rows.
+    """
+    query = query.strip().rstrip(";")
+    cursor = conn.cursor()
+    try:
+        estimated_rows = estimate_rows(cursor, query, statement)
+        if estimated_rows is None or estimated_rows <= config.row_threshold:
+            return None
+
+        # Result columns and types without fetching any rows
+        cursor.execute(f"SELECT * FROM ({query}) AS raw LIMIT 0")
+        description = [(column[0], column[1]) for column in cursor.description]
+        sources = source_columns(cursor, cursor.description)
+        rollup, groups, measures = rollup_query(query, description, low_cardinality, config, sources)
+
+        cursor.execute(rollup)
+        rows = cursor.fetchall()
+        columns: List[str] = [column[0] for column in cursor.description]
+        truncated = len(rows) > config.max_groups
+        totals = None
+        if truncated:
+            rows = rows[:config.max_groups]
+            cursor.execute(totals_query(query, measures))
+            totals = dict(zip([column[0] for column in cursor.description], cursor.fetchone()))
+        cursor.execute(sample_query(query, estimated_rows, config))
+        sample_rows = cursor.fetchall()
+        sample_columns = [column[0] for column in cursor.description]
+        return {
+            "columns": columns,
+            "rows": rows,
+            "sample_columns": sample_columns,
+            "sample_rows": sample_rows,
+            "estimated_rows": estimated_rows,
+            "group_by": groups,
+            "measures": measures,
+            "truncated": truncated,
+            "totals": totals,
+        }
+    except Exception as e:
+        # Fall back to the query itself, e.g. for statements EXPLAIN or a subquery cannot wrap
+        print(f"Aggregation pushdown skipped: {e}")
+        conn.rollback()
+        return None
+    finally:
+        cursor.close()
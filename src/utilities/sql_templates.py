@@ -0,0 +1,280 @@
+"""
+Parameterized templates of generated SQL and the server-side prepared statements that run them.
+
+Generated queries for recurring questions often differ only in their literals (dates, regions,
+ids). parameterize() turns a query into a template with $1, $2, ... placeholders plus the
+literal values, and execute_query() runs a template seen prepare_threshold times through a
+statement prepared with PREPARE on the pooled connection, so Postgres parses and plans it once
+per connection (and may switch to a generic plan) and the values are bound as parameters.
+Callers that also explain the query (the aggregation pushdown) call prepare_query() first and
+explain the prepared statement, so the literal query is not planned an extra time.
+"""
+import itertools
+import re
+import threading
+from collections import OrderedDict
+from decimal import Decimal
+from typing import Optional, Tuple
+
+from utilities.config import load_config
+
+_TOKEN = re.compile(r"""
+    (?P<space>\s+)
+  | (?P<comment>--[^\n]*|/\*.*?\*/)
+  | (?P<string>(?<![\w$])[EeNnBbXxUu]&?'(?:[^']|'')*'|'(?:[^']|'')*')
+  | (?P<dollar>\$(?P<tag>[A-Za-z_]\w*)?\$.*?\$(?P=tag)?\$)
+  | (?P<identifier>"(?:[^"]|"")*")
+  | (?P<placeholder>\$\d+|%s|%\(\w+\)s|\?)
+  | (?P<number>(?<![\w.$])\d+(?:\.\d*)?(?:[eE][+-]?\d+)?(?![\w.]))
+  | (?P<word>[A-Za-z_][\w$]*)
+  | (?P<other>.)
+""", re.S | re.X)
+
+# Type names that make the following string a typed literal (INTERVAL '1 day'), which cannot be a parameter
+_TYPED_LITERALS = {"interval", "date", "time", "timestamp", "timestamptz"}
+# Type names whose parenthesized modifiers (numeric(10, 2)) must stay constants
+_TYPE_MODIFIERS = {"numeric", "decimal", "varchar", "char", "character", "varying", "bit", "varbit",
+                   "time", "timestamp", "timestamptz", "interval", "float"}
+# Clauses in which a bare integer is a column position (ORDER BY 2), not a value
+_POSITIONAL = {"order", "group"}
+_CLAUSES = {"select", "from", "where", "having", "limit", "offset", "fetch", "window", "union",
+            "intersect", "except", "on", "join", "and", "or", "returning", "partition"}
+
+
+_UNSET = object()
+
+
+class SqlTemplateConfig:
+    """Settings of the [sql_templates] section of config.ini."""
+
+    def __init__(self, config=None):
+        config = config if config is not None else load_config()
+        self.enabled = config.getboolean("sql_templates", "enabled", fallback=True)
+        # Runs of a template after which it is prepared on the connection that runs it
+        self.prepare_threshold = config.getint("sql_templates", "prepare_threshold", fallback=2)
+        self.max_prepared_per_connection = config.getint("sql_templates", "max_prepared_per_connection",
+                                                         fallback=50)
+        self.max_templates = config.getint("sql_templates", "max_templates", fallback=1000)
+
+
+CONFIG = SqlTemplateConfig()
+
+
+def normalize_whitespace(query: str) -> str:
+    """
+    Collapses whitespace and comments outside string literals, quoted identifiers and
+    dollar-quoted strings to single spaces and drops the trailing semicolon.
+    """
+    parts = []
+    for match in _TOKEN.finditer(query.strip().rstrip(";").strip()):
+        if match.lastgroup in ("space", "comment"):
+            if parts and parts[-1] != " ":
+                parts.append(" ")
+        else:
+            parts.append(match.group())
+    return "".join(parts).strip()
+
+
+def parameterize(query: str) -> Tuple[str, list]:
+    """
+    Returns the template of a query, with its literals replaced by $1, $2, ... and whitespace
+    and comments normalized, and the literal values in order. Numbers keep their literal type
+    through a cast, so results and operator resolution are the same as with the literals.
+    Repeats of a literal get the same placeholder, so expressions such as date_trunc('month', d)
+    in both SELECT and GROUP BY stay identical. Queries that already have placeholders are
+    returned unchanged with no values.
+    """
+    query = query.strip().rstrip(";").strip()
+    parts, params = [], []
+    numbers = {}  # (kind, literal text) -> placeholder number
+    previous = ""  # Last significant token, lower-cased
+    clause = ""
+    parens = []  # Per open parenthesis: whether it holds type modifiers
+    for match in _TOKEN.finditer(query):
+        kind, text = match.lastgroup, match.group()
+        if kind == "tag":
+            kind = "dollar"
+        if kind in ("space", "comment"):
+            if parts and parts[-1] != " ":
+                parts.append(" ")
+            continue
+        if kind == "placeholder":
+            return query, []
+
+        value = None
+        if kind == "string" and text.startswith("'") and previous not in _TYPED_LITERALS:
+            value = text[1:-1].replace("''", "'")
+        elif kind == "number" and not (parens and parens[-1]) \
+                and not (clause in _POSITIONAL and previous in ("by", ",")):
+            if re.fullmatch(r"\d+", text):
+                value = int(text)
+                cast = "integer" if value < 2 ** 31 else "bigint" if value < 2 ** 63 else "numeric"
+            else:
+                value, cast = Decimal(text), "numeric"
+
+        if value is None:
+            parts.append(text)
+        else:
+            number = numbers.get((kind, text))
+            if number is None:
+                params.append(value)
+                number = numbers[(kind, text)] = len(params)
+            parts.append(f"${number}" if kind == "string" else f"${number}::{cast}")
+
+        lowered = text.lower()
+        if kind == "word" and lowered in _POSITIONAL | _CLAUSES:
+            clause = lowered
+        if text == "(":
+            parens.append(previous in _TYPE_MODIFIERS)
+        elif text == ")" and parens:
+            parens.pop()
+        previous = lowered
+    return "".join(parts).strip(), params
+
+
+class TemplateStats:
+    """Process-wide run counts of the templates, the most recently run last."""
+
+    def __init__(self, max_templates: int):
+        self.max_templates = max_templates
+        self.lock = threading.Lock()
+        self.runs = OrderedDict()  # template -> runs
+        self.unpreparable = OrderedDict()  # template -> None, the most recently failed last
+        self.prepares = 0
+        self.prepared_runs = 0
+
+    def record(self, template: str) -> int:
+        """Counts a run of the template and returns its runs so far."""
+        with self.lock:
+            runs = self.runs.pop(template, 0) + 1
+            self.runs[template] = runs
+            while len(self.runs) > self.max_templates:
+                self.runs.popitem(last=False)
+            return runs
+
+    def is_unpreparable(self, template: str) -> bool:
+        with self.lock:
+            return template in self.unpreparable
+
+    def mark_unpreparable(self, template: str):
+        """Records a template Postgres could not prepare, so it runs as is from then on."""
+        with self.lock:
+            self.unpreparable[template] = None
+            self.unpreparable.move_to_end(template)
+            while len(self.unpreparable) > self.max_templates:
+                self.unpreparable.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"templates": len(self.runs), "unpreparable": len(self.unpreparable),
+                    "prepares": self.prepares, "prepared_runs": self.prepared_runs}
+
+
+_stats = TemplateStats(CONFIG.max_templates)
+
+
+def get_template_stats() -> TemplateStats:
+    return _stats
+
+
+def pooled_connection_class():
+    """
+    Returns the psycopg2 connection class of the shared pool, whose connections remember the
+    statements prepared on them (prepared statements belong to the database session).
+    """
+    import psycopg2.extensions
+
+    class PooledConnection(psycopg2.extensions.connection):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.prepared = OrderedDict()  # template -> statement name, least recently used first
+            self.statement_ids = itertools.count(1)
+
+    return PooledConnection
+
+
+def _recoverable(conn, error: Exception) -> bool:
+    """Whether running the literal query is worth a try after the prepared path failed."""
+    # 57014: the statement was cancelled, e.g. because the run was
+    return not conn.closed and getattr(error, "pgcode", None) != "57014"
+
+
+def prepare_query(conn, cursor, query: str) -> Optional[Tuple[str, list]]:
+    """
+    Counts a run of the query's template and returns the name of the statement prepared for it
+    on conn, and the values to execute it with, preparing it once the template has run
+    prepare_threshold times. Returns None when the query is to run as it is: on connections
+    outside the pool, for queries without literals and for templates Postgres cannot prepare.
+    """
+    prepared = getattr(conn, "prepared", None)
+    if prepared is None or not CONFIG.enabled:
+        return None
+    template, params = parameterize(query)
+    if not params or _stats.is_unpreparable(template) or _stats.record(template) < CONFIG.prepare_threshold:
+        return None
+
+    name = prepared.get(template)
+    if name is not None:
+        prepared.move_to_end(template)
+        return name, params
+    name = f"crmgpt_{next(conn.statement_ids)}"
+    try:
+        cursor.execute(f"PREPARE {name} AS {template}")
+    except Exception as e:
+        if not _recoverable(conn, e):
+            raise
+        # E.g. a parameter whose type Postgres cannot infer
+        print(f"Query template not prepared, running the query as is: {e}")
+        conn.rollback()
+        _stats.mark_unpreparable(template)
+        return None
+    prepared[template] = name
+    with _stats.lock:
+        _stats.prepares += 1
+    while len(prepared) > CONFIG.max_prepared_per_connection:
+        _, evicted = prepared.popitem(last=False)
+        cursor.execute(f"DEALLOCATE {evicted}")
+    return name, params
+
+
+def execute_statement(cursor, statement: Tuple[str, list], explain: bool = False):
+    """Executes, or with explain explains, a statement returned by prepare_query."""
+    name, params = statement
+    prefix = "EXPLAIN (FORMAT JSON) " if explain else ""
+    cursor.execute(f"{prefix}EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
+
+
+def execute_query(conn, cursor, query: str, statement=_UNSET):
+    """
+    Executes a generated query on a cursor of conn. On pooled Postgres connections, a query
+    whose template has run prepare_threshold times goes through a prepared statement of the
+    connection; other queries, and queries the prepared path fails for, run as they are.
+    statement is the result of prepare_query when the caller already called it for this run.
+    """
+    if statement is _UNSET:
+        statement = prepare_query(conn, cursor, query)
+    if statement is None:
+        cursor.execute(query)
+        return
+
+    try:
+        execute_statement(cursor, statement)
+    except Exception as e:
+        if not _recoverable(conn, e):
+            raise
+        # The literal query reports its own error if it fails too
+        print(f"Prepared query failed, running the query as is: {e}")
+        conn.rollback()
+        name = statement[0]
+        for template in [template for template, prepared in conn.prepared.items() if prepared == name]:
+            del conn.prepared[template]
+        try:
+            cursor.execute(f"DEALLOCATE {name}")
+        except Exception as e:
+            # The statement then stays on the connection until it is closed
+            print(f"Prepared statement {name} not deallocated: {e}")
+            conn.rollback()
+        cursor.execute(query)
+        return
+    with _stats.lock:
+        _stats.prepared_runs += 1
@@ -0,0 +1,120 @@
+"""
+Cold-start audit for the app and service entry points.
+
+Each entry point is imported in a fresh interpreter with ``-X importtime``. The
+report shows the total import time, the wall time of the interpreter and the
+packages that cost the most, and the command exits with status 1 when an entry
+point misses its target from the [startup] section of config.ini or fails to import,
+so it can be used as a regression check in CI. Entry points that cannot be imported
+because a module they need is not installed or not in the tree are reported as
+skipped instead.
+
+Run from the src directory:
+    python -m utilities.startup_audit [--runs 3] [--top 10] [--record temp/startup_times.jsonl]
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+from utilities.config import load_config
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# name -> (working directory, module imported at startup)
+ENTRY_POINTS = {
+    "app": (SRC_DIR, "app"),
+    "service": (os.path.join(SRC_DIR, "service"), "service"),
+}
+
+
+def parse_importtime(stderr: str):
+    """Parses ``-X importtime`` output into (module, depth, self_us, cumulative_us) tuples."""
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        entries.append((name.strip(), depth, int(self_us), int(cumulative_us)))
+    return entries
+
+
+def measure(name: str) -> dict:
+    """Imports an entry point in a fresh interpreter and returns its timings."""
+    cwd, module = ENTRY_POINTS[name]
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [SRC_DIR, os.getenv("PYTHONPATH")])))
+    start = time.perf_counter()
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=cwd, env=env, capture_output=True, text=True
+    )
+    wall = time.perf_counter() - start
+
+    entries = parse_importtime(process.stderr)
+    packages = defaultdict(int)
+    for module_name, _, self_us, _ in entries:
+        packages[module_name.split(".")[0]] += self_us
+
+    error = missing = None
+    if process.returncode != 0:
+        error = process.stderr.strip().splitlines()[-1] if process.stderr.strip() else "import failed"
+        match = re.match(r"ModuleNotFoundError: No module named '([\w.]+)'", error)
+        missing = match.group(1) if match else None
+    return {
+        "entry_point": name,
+        "import_seconds": sum(cumulative for _, depth, _, cumulative in entries if depth == 0) / 1e6,
+        "wall_seconds": wall,
+        "packages": dict(sorted(packages.items(), key=lambda item: item[1], reverse=True)),
+        "error": error,
+        "missing_module": missing,
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Audit cold-start import time of the entry points.")
+    parser.add_argument("entry_points", nargs="*", default=list(ENTRY_POINTS),
+                        help=f"Entry points to audit: {', '.join(ENTRY_POINTS)} (default: all)")
+    parser.add_argument("--runs", type=int, default=3, help="Runs per entry point; the fastest is reported")
+    parser.add_argument("--top", type=int, default=10, help="Number of packages to list")
+    parser.add_argument("--record", help="Append the results as JSON lines to this file")
+    args = parser.parse_args(argv)
+    unknown = set(args.entry_points) - set(ENTRY_POINTS)
+    if unknown:
+        parser.error(f"unknown entry points: {', '.join(sorted(unknown))}")
+
+    config = load_config()
+    failed = False
+    for name in args.entry_points:
+        result = min((measure(name) for _ in range(args.runs)), key=lambda r: r["import_seconds"])
+        target = config.getfloat("startup", f"{name}_target_seconds", fallback=None)
+        result["target_seconds"] = target
+
+        if result["missing_module"]:
+            status = f"SKIPPED (module {result['missing_module']} is not available)"
+        elif result["error"]:
+            status = f"ERROR ({result['error']})"
+            failed = True
+        elif target is not None and result["import_seconds"] > target:
+            status = f"OVER TARGET ({target:.2f}s)"
+            failed = True
+        else:
+            status = "OK"
+        print(f"{name}: import {result['import_seconds']:.3f}s, wall {result['wall_seconds']:.3f}s - {status}")
+        for package, self_us in list(result["packages"].items())[:args.top]:
+            print(f"    {package:<30} {self_us / 1000:8.1f} ms")
+
+        if args.record:
+            result["recorded_at"] = time.time()
+            with open(args.record, "a") as file:
+                file.write(json.dumps(result) + "\n")
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
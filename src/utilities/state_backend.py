@@ -0,0 +1,382 @@
+"""
+Backend of the state that must outlive a process or be shared between replicas: thread
+checkpoints, the process-wide caches, job records and stored query results.
+
+[state_backend] backend selects it:
+- memory: state stays in the process (checkpoints in memory for the app and in
+  checkpoints.db for the service), so only one replica can run.
+- sqlite: a SQLite file, shared by the processes of one host or a shared volume.
+- postgres: the application database (the db service of Docker-compose), so any replica
+  can serve any turn and replicas can be added with load.
+"""
+import asyncio
+import base64
+import datetime
+import hashlib
+import importlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from decimal import Decimal
+from typing import Any, Callable, List, Optional, Tuple
+
+from utilities.cache import TTLCache
+from utilities.config import load_config
+
+_missing = object()
+# Expired rows are deleted by the first write after this many seconds since the last purge
+PURGE_SECONDS = 300
+
+
+class StateBackendConfig:
+    """Settings of the [state_backend] section of config.ini."""
+
+    def __init__(self, config=None):
+        config = config if config is not None else load_config()
+        self.backend = config.get("state_backend", "backend", fallback="memory")
+        if self.backend not in ("memory", "sqlite", "postgres"):
+            raise ValueError(f"Unknown state backend '{self.backend}', expected memory, sqlite or postgres")
+        self.path = config.get("state_backend", "path", fallback="temp/state.db")
+        self.checkpoints_path = config.get("state_backend", "checkpoints_path", fallback="temp/checkpoints.db")
+        self.result_ttl_seconds = config.getfloat("state_backend", "result_ttl_seconds", fallback=86400)
+        self.checkpoint_pool_size = config.getint("state_backend", "checkpoint_pool_size", fallback=10)
+        # Bounds of the in-process checkpoints of the memory backend
+        self.memory_checkpoints_per_thread = config.getint("state_backend", "memory_checkpoints_per_thread",
+                                                           fallback=50)
+        self.memory_thread_ttl_seconds = config.getfloat("state_backend", "memory_thread_ttl_seconds",
+                                                         fallback=86400)
+
+
+class SqliteStateStore:
+    """Namespaced key-value store with expiry in a SQLite file."""
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        # Several processes share the file; WAL lets readers proceed while one of them writes
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS crmgpt_state (namespace TEXT NOT NULL, key TEXT NOT NULL, "
+            "value BLOB NOT NULL, expires_at REAL, PRIMARY KEY (namespace, key))"
+        )
+        self.purged_at = time.time()
+
+    def get(self, namespace: str, key: str) -> Optional[bytes]:
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT value FROM crmgpt_state WHERE namespace = ? AND key = ? "
+                "AND (expires_at IS NULL OR expires_at > ?)", (namespace, key, time.time())
+            ).fetchone()
+        return row[0] if row else None
+
+    def set(self, namespace: str, key: str, value: bytes, ttl_seconds: Optional[float] = None):
+        expires_at = time.time() + ttl_seconds if ttl_seconds else None
+        with self.lock:
+            self.conn.execute(
+                "INSERT INTO crmgpt_state (namespace, key, value, expires_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (namespace, key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at",
+                (namespace, key, value, expires_at),
+            )
+        if time.time() - self.purged_at > PURGE_SECONDS:
+            self.purged_at = time.time()
+            self.purge_expired()
+
+    def delete(self, namespace: str, key: str):
+        with self.lock:
+            self.conn.execute("DELETE FROM crmgpt_state WHERE namespace = ? AND key = ?", (namespace, key))
+
+    def scan(self, namespace: str) -> List[Tuple[str, bytes]]:
+        """Returns the unexpired (key, value) pairs of a namespace."""
+        with self.lock:
+            return self.conn.execute(
+                "SELECT key, value FROM crmgpt_state WHERE namespace = ? "
+                "AND (expires_at IS NULL OR expires_at > ?)", (namespace, time.time())
+            ).fetchall()
+
+    def purge_expired(self):
+        with self.lock:
+            self.conn.execute("DELETE FROM crmgpt_state WHERE expires_at <= ?", (time.time(),))
+
+
+class PostgresStateStore:
+    """Namespaced key-value store with expiry in the application database."""
+
+    def __init__(self):
+        with self._cursor() as cursor:
+            cursor.execute(
+                "CREATE TABLE IF NOT EXISTS crmgpt_state (namespace TEXT NOT NULL, key TEXT NOT NULL, "
+                "value BYTEA NOT NULL, expires_at DOUBLE PRECISION, PRIMARY KEY (namespace, key))"
+            )
+        self.purged_at = time.time()
+
+    @contextmanager
+    def _cursor(self):
+        """Yields a cursor of a pooled connection and commits its transaction when the block succeeds."""
+        from utilities.db import pooled_connection
+        with pooled_connection() as conn:
+            cursor = conn.cursor()
+            try:
+                yield cursor
+                conn.commit()
+            finally:
+                cursor.close()
+
+    def get(self, namespace: str, key: str) -> Optional[bytes]:
+        with self._cursor() as cursor:
+            cursor.execute(
+                "SELECT value FROM crmgpt_state WHERE namespace = %s AND key = %s "
+                "AND (expires_at IS NULL OR expires_at > %s)", (namespace, key, time.time())
+            )
+            row = cursor.fetchone()
+        return bytes(row[0]) if row else None
+
+    def set(self, namespace: str, key: str, value: bytes, ttl_seconds: Optional[float] = None):
+        expires_at = time.time() + ttl_seconds if ttl_seconds else None
+        with self._cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO crmgpt_state (namespace, key, value, expires_at) VALUES (%s, %s, %s, %s) "
+                "ON CONFLICT (namespace, key) DO UPDATE SET value = EXCLUDED.value, expires_at = EXCLUDED.expires_at",
+                (namespace, key, value, expires_at),
+            )
+        if time.time() - self.purged_at > PURGE_SECONDS:
+            self.purged_at = time.time()
+            self.purge_expired()
+
+    def delete(self, namespace: str, key: str):
+        with self._cursor() as cursor:
+            cursor.execute("DELETE FROM crmgpt_state WHERE namespace = %s AND key = %s", (namespace, key))
+
+    def scan(self, namespace: str) -> List[Tuple[str, bytes]]:
+        """Returns the unexpired (key, value) pairs of a namespace."""
+        with self._cursor() as cursor:
+            cursor.execute(
+                "SELECT key, value FROM crmgpt_state WHERE namespace = %s "
+                "AND (expires_at IS NULL OR expires_at > %s)", (namespace, time.time())
+            )
+            return [(key, bytes(value)) for key, value in cursor.fetchall()]
+
+    def purge_expired(self):
+        with self._cursor() as cursor:
+            cursor.execute("DELETE FROM crmgpt_state WHERE expires_at <= %s", (time.time(),))
+
+
+def _encode_value(value):
+    """json.dumps default for the non-JSON types of cached query results."""
+    if isinstance(value, Decimal):
+        return {"__type__": "decimal", "value": str(value)}
+    if isinstance(value, datetime.datetime):
+        return {"__type__": "datetime", "value": value.isoformat()}
+    if isinstance(value, datetime.date):
+        return {"__type__": "date", "value": value.isoformat()}
+    if isinstance(value, datetime.time):
+        return {"__type__": "time", "value": value.isoformat()}
+    if isinstance(value, datetime.timedelta):
+        return {"__type__": "timedelta", "value": value.total_seconds()}
+    if isinstance(value, uuid.UUID):
+        return {"__type__": "uuid", "value": str(value)}
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return {"__type__": "bytes", "value": base64.b64encode(bytes(value)).decode()}
+    raise TypeError(f"{type(value).__name__} values cannot be stored in the shared cache")
+
+
+_DECODERS = {
+    "decimal": Decimal,
+    "datetime": datetime.datetime.fromisoformat,
+    "date": datetime.date.fromisoformat,
+    "time": datetime.time.fromisoformat,
+    "timedelta": lambda seconds: datetime.timedelta(seconds=seconds),
+    "uuid": uuid.UUID,
+    "bytes": base64.b64decode,
+}
+
+
+def _decode_value(record: dict):
+    decoder = _DECODERS.get(record.get("__type__")) if len(record) == 2 else None
+    return decoder(record["value"]) if decoder is not None else record
+
+
+def dump_value(value) -> bytes:
+    """Serializes a cache value as JSON; tuples come back as lists."""
+    return json.dumps(value, default=_encode_value).encode()
+
+
+def load_value(data: bytes):
+    return json.loads(data, object_hook=_decode_value)
+
+
+class SharedCache:
+    """
+    Cache with the interface of TTLCache whose entries live in the state store, so replicas
+    share them. A local TTLCache in front of it keeps hot entries in memory and makes
+    get_or_compute single-flight within the process.
+
+    Entries are stored as JSON (see dump_value), never pickled, so a row written to the state
+    table by someone else cannot run code in the replicas. Values JSON cannot hold are only
+    cached locally.
+    """
+
+    def __init__(self, store, name: str, ttl_seconds: float, max_items: int = 1024):
+        self.store = store
+        self.namespace = f"cache:{name}"
+        self.ttl_seconds = ttl_seconds
+        self.local = TTLCache(ttl_seconds, max_items)
+
+    def _key(self, key) -> str:
+        return hashlib.sha256(repr(key).encode()).hexdigest()
+
+    def get(self, key, default=None) -> Any:
+        value = self.local.get(key, _missing)
+        if value is _missing:
+            data = self.store.get(self.namespace, self._key(key))
+            if data is None:
+                return default
+            value = load_value(data)
+            self.local.set(key, value)
+        return value
+
+    def _store(self, key, value):
+        try:
+            data = dump_value(value)
+        except (TypeError, ValueError) as e:
+            print(f"Not sharing cache entry of {self.namespace}: {e}")
+            return
+        self.store.set(self.namespace, self._key(key), data, self.ttl_seconds)
+
+    def set(self, key, value):
+        self._store(key, value)
+        self.local.set(key, value)
+
+    def get_or_compute(self, key, compute: Callable[[], Any]) -> Any:
+        def load_or_compute():
+            data = self.store.get(self.namespace, self._key(key))
+            if data is not None:
+                return load_value(data)
+            value = compute()
+            self._store(key, value)
+            return value
+        return self.local.get_or_compute(key, load_or_compute)
+
+    def stats(self) -> dict:
+        return self.local.stats()
+
+
+def bounded_memory_saver(max_checkpoints: int = 50, thread_ttl_seconds: float = 86400):
+    """
+    Returns a MemorySaver that keeps only the latest max_checkpoints checkpoints of each thread
+    (subgraph namespaces included) and forgets threads not written for thread_ttl_seconds.
+    The plain MemorySaver keeps every checkpoint of every thread for the life of the process.
+    """
+    from langgraph.checkpoint.memory import MemorySaver
+
+    class BoundedMemorySaver(MemorySaver):
+        def __init__(self):
+            super().__init__()
+            self.lock = threading.Lock()
+            self.written_at = {}  # thread_id -> time of its last checkpoint
+
+        def put(self, config, checkpoint, metadata, new_versions):
+            result = super().put(config, checkpoint, metadata, new_versions)
+            thread_id = config["configurable"]["thread_id"]
+            now = time.time()
+            with self.lock:
+                self.written_at[thread_id] = now
+                namespaces = self.storage[thread_id]
+                # Checkpoint ids are time-ordered; the thread's latest root checkpoint is always kept
+                latest = max(namespaces.get("") or [""])
+                checkpoints = sorted((checkpoint_id, ns) for ns, saved in namespaces.items() for checkpoint_id in saved)
+                for checkpoint_id, ns in checkpoints[:-max_checkpoints]:
+                    if ns == "" and checkpoint_id == latest:
+                        continue
+                    del namespaces[ns][checkpoint_id]
+                    self.writes.pop((thread_id, ns, checkpoint_id), None)
+                for ns in [ns for ns, saved in namespaces.items() if not saved]:
+                    del namespaces[ns]
+                for idle in [t for t, written_at in self.written_at.items() if now - written_at > thread_ttl_seconds]:
+                    del self.written_at[idle]
+                    self.storage.pop(idle, None)
+                    for key in [key for key in self.writes if key[0] == idle]:
+                        del self.writes[key]
+            return result
+
+    return BoundedMemorySaver()
+
+
+_store = None
+_checkpointer = None
+_store_lock = threading.Lock()
+
+
+def get_state_store():
+    """Returns the process-wide state store, or None with the memory backend."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            config = StateBackendConfig()
+            if config.backend == "sqlite":
+                _store = SqliteStateStore(config.path)
+            elif config.backend == "postgres":
+                _store = PostgresStateStore()
+        return _store
+
+
+def postgres_conninfo() -> str:
+    from psycopg.conninfo import make_conninfo
+    from utilities.db import get_db_settings
+    settings = get_db_settings()
+    return make_conninfo(host=settings["host"], dbname=settings["database"],
+                         user=settings["user"], password=settings["password"])
+
+
+def get_checkpointer():
+    """Returns the process-wide checkpointer of the app's graphs, created on the backend's storage."""
+    global _checkpointer
+    with _store_lock:
+        if _checkpointer is None:
+            _checkpointer = create_checkpointer(StateBackendConfig())
+        return _checkpointer
+
+
+def create_checkpointer(config: StateBackendConfig):
+    if config.backend == "postgres":
+        from langgraph.checkpoint.postgres import PostgresSaver
+        from psycopg.rows import dict_row
+        from psycopg_pool import ConnectionPool
+        pool = ConnectionPool(postgres_conninfo(), max_size=config.checkpoint_pool_size,
+                              kwargs={"autocommit": True, "prepare_threshold": 0, "row_factory": dict_row})
+        saver = PostgresSaver(pool)
+        saver.setup()
+        return saver
+    if config.backend == "sqlite":
+        from langgraph.checkpoint.sqlite import SqliteSaver
+        os.makedirs(os.path.dirname(config.checkpoints_path) or ".", exist_ok=True)
+        return SqliteSaver(sqlite3.connect(config.checkpoints_path, check_same_thread=False))
+    return bounded_memory_saver(config.memory_checkpoints_per_thread, config.memory_thread_ttl_seconds)
+
+
+async def open_async_checkpointer(stack):
+    """Opens the service's checkpointer on the exit stack, which closes it on shutdown."""
+    config = StateBackendConfig()
+    # The checkpointer modules are slow to import, so the import runs in a thread
+    module = "langgraph.checkpoint.postgres.aio" if config.backend == "postgres" else "langgraph.checkpoint.sqlite.aio"
+    await asyncio.to_thread(importlib.import_module, module)
+    if config.backend == "postgres":
+        from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
+        from psycopg.rows import dict_row
+        from psycopg_pool import AsyncConnectionPool
+        pool = await stack.enter_async_context(AsyncConnectionPool(
+            postgres_conninfo(), max_size=config.checkpoint_pool_size,
+            kwargs={"autocommit": True, "prepare_threshold": 0, "row_factory": dict_row},
+        ))
+        saver = AsyncPostgresSaver(pool)
+        await saver.setup()
+        return saver
+    from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+    # The memory backend keeps the service's historical checkpoints.db in the working directory
+    path = config.checkpoints_path if config.backend == "sqlite" else "checkpoints.db"
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    return await stack.enter_async_context(AsyncSqliteSaver.from_conn_string(path))
@@ -0,0 +1,383 @@
+"""
+Per-run span trees of the chain runs.
+
+Each enter_chain run gets a RunTrace whose root span covers the run. TraceCallbackHandler adds
+a span for every graph node, LLM call and tool call, nested the way they ran, and run_query
+adds the database queries under the tool that ran them (see traced()). The finished trace is
+saved as JSON under the [tracing] path, keeping the last `keep` runs, for the timeline panel of
+the Streamlit app. to_otlp() converts a trace to OTLP/JSON, which trace viewers such as Jaeger
+or an OpenTelemetry collector's file receiver read:
+
+    python -m utilities.tracing [run_id] [--output trace.json]
+
+exports the given run, or the latest one, from the src directory.
+"""
+import argparse
+import glob
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+from uuid import UUID, uuid4
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from utilities.config import load_config
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Span kinds, and the OTLP span kind each is exported as
+GRAPH, NODE, LLM, TOOL, DB = "graph", "node", "llm", "tool", "db"
+_OTLP_KINDS = {GRAPH: 2, NODE: 1, LLM: 3, TOOL: 1, DB: 3}  # SERVER, INTERNAL, CLIENT
+_MAX_ATTRIBUTE_CHARS = 2000
+
+
+class TracingConfig:
+    """Settings of the [tracing] section of config.ini."""
+
+    def __init__(self, config=None):
+        config = config if config is not None else load_config()
+        self.enabled = config.getboolean("tracing", "enabled", fallback=True)
+        self.path = config.get("tracing", "path", fallback="temp/traces")
+        # Traces of older runs are deleted
+        self.keep = config.getint("tracing", "keep", fallback=200)
+        self.show_panel = config.getboolean("tracing", "show_panel", fallback=True)
+        self.service_name = config.get("tracing", "service_name", fallback="crmgpt")
+
+
+TRACING_CONFIG = TracingConfig()
+
+
+def _clip(value) -> str:
+    text = value if isinstance(value, str) else str(value)
+    return text if len(text) <= _MAX_ATTRIBUTE_CHARS else text[:_MAX_ATTRIBUTE_CHARS] + "..."
+
+
+class RunTrace:
+    """The spans of one run. Spans are dicts with times in nanoseconds since the epoch."""
+
+    def __init__(self, run_id: str, name: str, attributes: dict = None):
+        self.run_id = run_id
+        try:
+            self.trace_id = UUID(run_id).hex
+        except ValueError:
+            self.trace_id = hashlib.md5(run_id.encode()).hexdigest()
+        self.lock = threading.Lock()
+        self.spans = {}
+        self.open_spans = {}  # Thread id -> ids of the spans open on it, innermost last
+        self.root_id = self.start_span(name, GRAPH, None, attributes)
+
+    def start_span(self, name: str, kind: str, parent_id: Optional[str], attributes: dict = None) -> str:
+        span_id = uuid4().hex[:16]
+        thread = threading.get_ident()
+        with self.lock:
+            self.spans[span_id] = {
+                "span_id": span_id, "parent_id": parent_id, "name": name, "kind": kind,
+                "start": time.time_ns(), "end": None, "thread": thread, "error": None,
+                "attributes": {key: value for key, value in (attributes or {}).items() if value is not None},
+            }
+            self.open_spans.setdefault(thread, []).append(span_id)
+        return span_id
+
+    def end_span(self, span_id: str, error: BaseException = None, attributes: dict = None):
+        with self.lock:
+            span = self.spans.get(span_id)
+            if span is None or span["end"] is not None:
+                return
+            span["end"] = time.time_ns()
+            if error is not None:
+                span["error"] = f"{type(error).__name__}: {_clip(error)}"
+            span["attributes"].update({key: value for key, value in (attributes or {}).items() if value is not None})
+            stack = self.open_spans.get(span["thread"], [])
+            if span_id in stack:
+                stack.remove(span_id)
+            if not stack:
+                self.open_spans.pop(span["thread"], None)
+
+    def current_span(self) -> str:
+        """Returns the innermost span open on the calling thread, else the root span."""
+        with self.lock:
+            stack = self.open_spans.get(threading.get_ident())
+            return stack[-1] if stack else self.root_id
+
+    def finish(self, error: BaseException = None):
+        """Ends the root span, and spans left open by an error or a cancellation with it."""
+        with self.lock:
+            unfinished = [span_id for span_id, span in self.spans.items() if span["end"] is None]
+        for span_id in unfinished:
+            self.end_span(span_id, error if span_id == self.root_id else None)
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            spans = sorted((dict(span) for span in self.spans.values()), key=lambda span: span["start"])
+        for span in spans:
+            del span["thread"]
+        return {"run_id": self.run_id, "trace_id": self.trace_id, "spans": spans}
+
+
+class TraceCallbackHandler(BaseCallbackHandler):
+    """
+    Records the graph nodes, LLM calls and tool calls of a run as spans of a RunTrace. Other
+    chains (agents, prompts, parsers, LangGraph internals) get no span of their own; what ran
+    in them is attached to the nearest recorded ancestor.
+    """
+
+    def __init__(self, trace: RunTrace):
+        self.trace = trace
+        self.lock = threading.Lock()
+        self.parents = {}  # LangChain run id -> parent run id, for every run seen
+        self.spans = {}  # LangChain run id -> span id, for the recorded runs
+
+    def _start(self, run_id, parent_run_id, name: str, kind: str, attributes: dict):
+        with self.lock:
+            self.parents[run_id] = parent_run_id
+            parent = parent_run_id
+            while parent is not None and parent not in self.spans:
+                parent = self.parents.get(parent)
+            parent_id = self.spans[parent] if parent is not None else self.trace.root_id
+        span_id = self.trace.start_span(name, kind, parent_id, attributes)
+        with self.lock:
+            self.spans[run_id] = span_id
+
+    def _end(self, run_id, error: BaseException = None, attributes: dict = None):
+        with self.lock:
+            span_id = self.spans.get(run_id)
+        if span_id is not None:
+            self.trace.end_span(span_id, error, attributes)
+
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, metadata=None, **kwargs):
+        name = kwargs.get("name") or (serialized or {}).get("name")
+        node = (metadata or {}).get("langgraph_node")
+        # LangGraph's own __start__ and channel writes are bookkeeping, not work of the graph
+        if node and name == node and not node.startswith("__"):
+            self._start(run_id, parent_run_id, node, NODE, {"langgraph.step": (metadata or {}).get("langgraph_step")})
+        else:
+            with self.lock:
+                self.parents[run_id] = parent_run_id
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error)
+
+    def _start_llm(self, serialized, run_id, parent_run_id, metadata, kwargs):
+        params = kwargs.get("invocation_params") or {}
+        model = params.get("model_name") or params.get("model") or (serialized or {}).get("name") or "llm"
+        self._start(run_id, parent_run_id, f"llm {model}", LLM,
+                    {"llm.model": model, "langgraph.node": (metadata or {}).get("langgraph_node")})
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, parent_run_id=None, metadata=None, **kwargs):
+        self._start_llm(serialized, run_id, parent_run_id, metadata, kwargs)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, parent_run_id=None, metadata=None, **kwargs):
+        self._start_llm(serialized, run_id, parent_run_id, metadata, kwargs)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        input_tokens = output_tokens = 0
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                input_tokens += usage.get("input_tokens", 0)
+                output_tokens += usage.get("output_tokens", 0)
+        self._end(run_id, attributes={"llm.input_tokens": input_tokens, "llm.output_tokens": output_tokens})
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error)
+
+    def on_tool_start(self, serialized, input_str, *, run_id, parent_run_id=None, **kwargs):
+        name = kwargs.get("name") or (serialized or {}).get("name") or "tool"
+        self._start(run_id, parent_run_id, f"tool {name}", TOOL, {"tool.input": _clip(input_str)})
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error)
+
+
+@contextmanager
+def trace_run(run_handle, name: str, attributes: dict = None):
+    """
+    Traces the run of run_handle for the duration of the block, which gets the callbacks to
+    add to the run's config (none when tracing is off). The trace is saved when the block ends.
+    """
+    if not TRACING_CONFIG.enabled:
+        yield []
+        return
+    trace = RunTrace(run_handle.run_id, name, attributes)
+    run_handle.trace = trace
+    error = None
+    try:
+        yield [TraceCallbackHandler(trace)]
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        run_handle.trace = None
+        trace.finish(error)
+        try:
+            save_trace(trace)
+        except Exception as e:
+            print(f"Error saving the trace of run {trace.run_id}: {e}")
+
+
+@contextmanager
+def traced(run, name: str, kind: str = DB, attributes: dict = None):
+    """
+    Adds a span under the innermost span open on this thread to the trace of run, if it is
+    traced. The block gets a dict of attributes to add to the span when it ends.
+    """
+    trace = getattr(run, "trace", None) if run is not None else None
+    extra = {}
+    if trace is None:
+        yield extra
+        return
+    attributes = {key: _clip(value) if isinstance(value, str) else value for key, value in (attributes or {}).items()}
+    span_id = trace.start_span(name, kind, trace.current_span(), attributes)
+    error = None
+    try:
+        yield extra
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        trace.end_span(span_id, error, extra)
+
+
+def _trace_dir() -> str:
+    return os.path.join(SRC_DIR, TRACING_CONFIG.path)
+
+
+def save_trace(trace: RunTrace):
+    """Writes a finished trace to the [tracing] path and deletes the traces beyond the last `keep`."""
+    directory = _trace_dir()
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{trace.run_id}.json")
+    with open(path + ".tmp", "w") as file:
+        json.dump(trace.to_dict(), file, default=str)
+    os.replace(path + ".tmp", path)
+    paths = sorted(glob.glob(os.path.join(directory, "*.json")), key=os.path.getmtime)
+    for old in paths[:-TRACING_CONFIG.keep] if TRACING_CONFIG.keep > 0 else []:
+        try:
+            os.remove(old)
+        except OSError:
+            pass
+
+
+def load_trace(run_id: str = None) -> Optional[dict]:
+    """Returns the saved trace of a run, or of the latest run when run_id is None."""
+    directory = _trace_dir()
+    if run_id is None:
+        paths = glob.glob(os.path.join(directory, "*.json"))
+        if not paths:
+            return None
+        path = max(paths, key=os.path.getmtime)
+    else:
+        path = os.path.join(directory, f"{os.path.basename(run_id)}.json")
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def timeline_rows(trace: dict) -> list:
+    """
+    Returns the spans of a saved trace depth-first, children in start order, with their depth
+    in the tree and their start and end in milliseconds since the start of the run, for the
+    timeline panel.
+    """
+    spans = trace["spans"]
+    if not spans:
+        return []
+    origin = min(span["start"] for span in spans)
+    ids = {span["span_id"] for span in spans}
+    children = {}
+    for span in spans:  # Saved in start order
+        parent = span["parent_id"] if span["parent_id"] in ids else None
+        children.setdefault(parent, []).append(span)
+    ordered = []
+    pending = [(span, 0) for span in reversed(children.get(None, []))]
+    while pending:
+        span, depth = pending.pop()
+        ordered.append((span, depth))
+        pending.extend((child, depth + 1) for child in reversed(children.get(span["span_id"], [])))
+    rows = []
+    for index, (span, depth) in enumerate(ordered):
+        end = span["end"] or span["start"]
+        rows.append({
+            "row": f"{index:03d} {'· ' * depth}{span['name']}",
+            "name": span["name"], "kind": span["kind"], "depth": depth,
+            "start_ms": round((span["start"] - origin) / 1e6, 1),
+            "end_ms": round((end - origin) / 1e6, 1),
+            "duration_ms": round((end - span["start"]) / 1e6, 1),
+            "error": span["error"] or "",
+            "details": ", ".join(f"{key}={value}" for key, value in span["attributes"].items())[:300],
+        })
+    return rows
+
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": _clip(value)}
+
+
+def to_otlp(trace: dict, service_name: str = None) -> dict:
+    """Converts a saved trace to an OTLP/JSON ExportTraceServiceRequest."""
+    spans = []
+    for span in trace["spans"]:
+        otlp_span = {
+            "traceId": trace["trace_id"],
+            "spanId": span["span_id"],
+            "name": span["name"],
+            "kind": _OTLP_KINDS.get(span["kind"], 1),
+            "startTimeUnixNano": str(span["start"]),
+            "endTimeUnixNano": str(span["end"] or span["start"]),
+            "attributes": [{"key": key, "value": _otlp_value(value)}
+                           for key, value in {"crmgpt.kind": span["kind"], **span["attributes"]}.items()],
+            # STATUS_CODE_ERROR, else STATUS_CODE_UNSET
+            "status": {"code": 2, "message": span["error"]} if span["error"] else {"code": 0},
+        }
+        if span["parent_id"]:
+            otlp_span["parentSpanId"] = span["parent_id"]
+        spans.append(otlp_span)
+    return {"resourceSpans": [{
+        "resource": {"attributes": [
+            {"key": "service.name", "value": {"stringValue": service_name or TRACING_CONFIG.service_name}},
+            {"key": "crmgpt.run_id", "value": {"stringValue": trace["run_id"]}},
+        ]},
+        "scopeSpans": [{"scope": {"name": "crmgpt.tracing"}, "spans": spans}],
+    }]}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Export the trace of a chain run as OTLP/JSON.")
+    parser.add_argument("run_id", nargs="?", help="Run (job) id; the latest run by default")
+    parser.add_argument("--output", help="File to write; standard output by default")
+    args = parser.parse_args(argv)
+
+    trace = load_trace(args.run_id)
+    if trace is None:
+        print(f"No trace found for {args.run_id or 'the latest run'} in {_trace_dir()}", file=sys.stderr)
+        return 1
+    document = json.dumps(to_otlp(trace), indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(document + "\n")
+    else:
+        print(document)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,278 @@
+import bisect
+import difflib
+import re
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from utilities.config import load_config
+from utilities.db import is_sqlite
+from utilities.schema_graph import metadata_version
+from utilities.sql_pushdown import quote
+
+STOPWORDS = {
+    "the", "and", "for", "with", "from", "only", "all", "any", "none", "not", "are", "was", "were",
+    "data", "filter", "filters", "criteria", "where", "which", "that", "this", "those", "these",
+    "each", "per", "by", "in", "on", "of", "to", "or", "is", "be", "no", "specific",
+}
+
+
+class ColumnValues:
+    """Distinct values of one column, sorted by their lower-case form for prefix lookup."""
+
+    __slots__ = ("values", "keys", "refreshed_at")
+
+    def __init__(self, values: List[str]):
+        pairs = sorted((value.lower(), value) for value in set(values))
+        self.keys = [key for key, _ in pairs]
+        self.values = [value for _, value in pairs]
+        self.refreshed_at = time.monotonic()
+
+
+class ValueIndex:
+    """
+    Index of the distinct values of low-cardinality text columns, used to resolve filter
+    literals from the user ("germany", "closed-won") to the values actually stored
+    ("Germany", "Closed Won") before SQL generation.
+
+    A background thread fills the index after start() and then refreshes one column at a
+    time, oldest first, so a refresh never rescans the whole database at once. Columns with
+    more than max_values distinct values are not indexed, which bounds memory per column:
+    columns whose pg_stats estimate is above it are never read, and columns found to be above
+    it are skipped until the metadata changes. get_connection is a context manager yielding a
+    connection, such as utilities.db.pooled_connection.
+    """
+
+    def __init__(self, load_metadata: Callable[[], List[dict]], get_connection: Callable,
+                 max_values: int = 200, max_value_chars: int = 80, refresh_seconds: float = 3600,
+                 column_types: Tuple[str, ...] = ("text", "character varying", "varchar", "character", "char")):
+        self.load_metadata = load_metadata
+        self.get_connection = get_connection
+        self.max_values = max_values
+        self.max_value_chars = max_value_chars
+        self.refresh_seconds = refresh_seconds
+        self.column_types = column_types
+        self.columns: Dict[Tuple[str, str, str], ColumnValues] = {}  # (schema, table, column) -> values
+        self.pending: List[Tuple[str, str, str]] = []
+        self.skipped = set()  # Columns with more than max_values distinct values
+        self.version = None
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        """Starts the background thread that builds and refreshes the index."""
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="value-index", daemon=True)
+                self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def _run(self):
+        while not self.stopped.is_set():
+            try:
+                column = self._next_column()
+                if column is not None:
+                    self.refresh_column(column)
+                    continue
+            except Exception as e:
+                print(f"Error refreshing value index: {e}")
+            self.stopped.wait(min(60, self.refresh_seconds))
+
+    def _candidate_columns(self, metadata: List[dict]) -> List[Tuple[str, str, str]]:
+        return [
+            (row["schema_name"], row["table_name"], row["column_name"])
+            for row in metadata
+            if (row.get("data_type") or "").lower().split("(")[0].strip() in self.column_types
+            and (row.get("constraint_type") or "").upper() not in ("PRIMARY KEY", "FOREIGN KEY")
+        ]
+
+    def _next_column(self) -> Optional[Tuple[str, str, str]]:
+        """Returns the column to index next: new columns first, then the stalest one that is due."""
+        metadata = self.load_metadata()
+        version = metadata_version(metadata)
+        with self.lock:
+            changed = version != self.version
+        if changed:
+            # New metadata: drop columns that disappeared and queue the new ones, except those
+            # the planner statistics already show to have too many distinct values
+            candidates = self._candidate_columns(metadata)
+            skipped = self.high_cardinality_columns(candidates)
+            with self.lock:
+                kept = set(candidates) - skipped
+                self.columns = {key: value for key, value in self.columns.items() if key in kept}
+                self.pending = [key for key in candidates if key in kept and key not in self.columns]
+                self.skipped = skipped
+                self.version = version
+        with self.lock:
+            if self.pending:
+                return self.pending.pop(0)
+            now = time.monotonic()
+            due = [(values.refreshed_at, key) for key, values in self.columns.items()
+                   if now - values.refreshed_at >= self.refresh_seconds]
+        return min(due)[1] if due else None
+
+    def high_cardinality_columns(self, candidates: List[Tuple[str, str, str]]) -> set:
+        """
+        Returns the candidate columns whose distinct values pg_stats estimates above max_values.
+        Columns without statistics (never analyzed, or SQLite) are not in it.
+        """
+        schemas = sorted({schema for schema, _, _ in candidates})
+        with self.get_connection() as conn:
+            if is_sqlite(conn) or not schemas:
+                return set()
+            cursor = conn.cursor()
+            try:
+                # A negative n_distinct is minus the share of distinct rows in the table
+                cursor.execute(
+                    "SELECT s.schemaname, s.tablename, s.attname, "
+                    "CASE WHEN s.n_distinct >= 0 THEN s.n_distinct ELSE -s.n_distinct * GREATEST(c.reltuples, 0) END "
+                    "FROM pg_stats s JOIN pg_namespace n ON n.nspname = s.schemaname "
+                    "JOIN pg_class c ON c.relnamespace = n.oid AND c.relname = s.tablename "
+                    "WHERE s.schemaname = ANY(%s)", (schemas,)
+                )
+                estimates = {(schema, table, name): distinct for schema, table, name, distinct in cursor.fetchall()}
+            finally:
+                cursor.close()
+        return {column for column in candidates if estimates.get(column, 0) > self.max_values}
+
+    def refresh_column(self, column: Tuple[str, str, str]):
+        """
+        Re-reads the distinct values of a column. A column with more than max_values of them
+        is moved to the skipped columns and not read again until the metadata changes.
+        """
+        schema, table, name = column
+        with self.get_connection() as conn:
+            if is_sqlite(conn):
+                query = (f"SELECT DISTINCT {quote(name)} FROM {quote(schema)}.{quote(table)} "
+                         f"WHERE {quote(name)} IS NOT NULL LIMIT {self.max_values + 1}")
+            else:
+                from psycopg2 import sql
+                query = sql.SQL("SELECT DISTINCT {name} FROM {schema}.{table} WHERE {name} IS NOT NULL LIMIT {limit}").format(
+                    name=sql.Identifier(name), schema=sql.Identifier(schema), table=sql.Identifier(table),
+                    limit=sql.Literal(self.max_values + 1),
+                )
+            cursor = conn.cursor()
+            try:
+                cursor.execute(query)
+                rows = cursor.fetchall()
+            finally:
+                cursor.close()
+        with self.lock:
+            if len(rows) > self.max_values:
+                self.columns.pop(column, None)
+                self.skipped.add(column)
+            else:
+                self.columns[column] = ColumnValues([str(row[0])[:self.max_value_chars] for row in rows])
+
+    def lookup(self, literal: str, cutoff: float = 0.8, tables: Optional[Set[str]] = None) -> List[Tuple[str, str]]:
+        """
+        Returns (table.column, stored value) pairs for a literal: case-insensitive exact matches
+        if there are any, otherwise prefix matches, otherwise close (fuzzy) matches. Exact and
+        prefix matches are binary searches in every column; the slower fuzzy matching only runs
+        when they found nothing, and only over the columns of tables ("schema.table") if given.
+        """
+        key = literal.strip().lower()
+        if len(key) < 2:
+            return []
+        with self.lock:
+            columns = list(self.columns.items())
+
+        exact, prefix = [], []
+        for (schema, table, name), values in columns:
+            location = f"{schema}.{table}.{name}"
+            position = bisect.bisect_left(values.keys, key)
+            if position < len(values.keys) and values.keys[position] == key:
+                exact.append((location, values.values[position]))
+            elif len(key) >= 3 and position < len(values.keys) and values.keys[position].startswith(key):
+                prefix.append((location, values.values[position]))
+        if exact or prefix:
+            return exact or prefix
+
+        fuzzy = []
+        for (schema, table, name), values in columns:
+            if tables and f"{schema}.{table}" not in tables:
+                continue
+            for match in difflib.get_close_matches(key, values.keys, n=1, cutoff=cutoff):
+                fuzzy.append((f"{schema}.{table}.{name}", values.values[values.keys.index(match)]))
+        return fuzzy
+
+    def resolve(self, text: str, max_hints: int = 10, tables: Optional[Set[str]] = None) -> List[str]:
+        """
+        Resolves the literals in free-text filter criteria to hints naming the stored values.
+        tables, e.g. those of the schema hint, narrows the fuzzy matching (see lookup).
+        """
+        hints = []
+        resolved = []
+        for literal in extract_literals(text):
+            # Words of a phrase that already resolved ("united" of "united states") are not looked up
+            if any(literal.lower() in phrase for phrase in resolved):
+                continue
+            matches = self.lookup(literal, tables=tables)
+            if matches:
+                resolved.append(literal.lower())
+            for location, value in matches[:3]:
+                hint = f'"{literal}" -> {location} = \'{value}\''
+                if hint not in hints:
+                    hints.append(hint)
+            if len(hints) >= max_hints:
+                break
+        return hints[:max_hints]
+
+    def low_cardinality_columns(self) -> set:
+        """
+        The indexed columns as lower-cased "schema.table.column" names, i.e. the text columns
+        known to have few distinct values.
+        """
+        with self.lock:
+            return {".".join(column).lower() for column in self.columns}
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "columns": len(self.columns),
+                "skipped_columns": len(self.skipped),
+                "pending_columns": len(self.pending),
+                "values": sum(len(values.values) for values in self.columns.values()),
+            }
+
+
+def extract_literals(text: str) -> List[str]:
+    """Returns the candidate filter literals in free text: quoted strings, then phrases and words."""
+    literals = re.findall(r"[\"']([^\"']{2,})[\"']", text)
+    for segment in re.split(r"[,;:()=\n]|\band\b|\bor\b", re.sub(r"[\"']", " ", text)):
+        words = [word for word in re.findall(r"[\w\-&.]+", segment) if word.lower() not in STOPWORDS]
+        candidates = [" ".join(words)] if 1 < len(words) <= 3 else []
+        candidates += [f"{a} {b}" for a, b in zip(words, words[1:])] + words
+        literals += [c for c in candidates if len(c) >= 2 and not c.replace(".", "").isdigit()]
+    return list(dict.fromkeys(literals))
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_value_index(load_metadata: Callable[[], List[dict]]) -> Optional[ValueIndex]:
+    """
+    Returns the process-wide value index, configured by the [value_index] section of
+    config.ini and started on first use, or None when it is disabled.
+    """
+    global _index
+    with _index_lock:
+        if _index is None:
+            config = load_config()
+            if not config.getboolean("value_index", "enabled", fallback=True):
+                return None
+            from utilities.db import pooled_connection
+            section = config["value_index"] if config.has_section("value_index") else {}
+            _index = ValueIndex(
+                load_metadata,
+                pooled_connection,
+                max_values=int(section.get("max_values_per_column", 200)),
+                max_value_chars=int(section.get("max_value_chars", 80)),
+                refresh_seconds=float(section.get("refresh_seconds", 3600)),
+            )
+            _index.start()
+        return _index